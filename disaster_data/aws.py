@@ -0,0 +1,18 @@
+import os
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def client(service):
+    """
+    Return a shared boto3 client, created on first use so importing a module never touches AWS.  Setting
+    <SERVICE>_ENDPOINT_URL (or AWS_ENDPOINT_URL for every service) points the client at a local stand-in.
+    """
+    import boto3
+    endpoint_url = os.environ.get(f"{service.upper()}_ENDPOINT_URL", os.environ.get("AWS_ENDPOINT_URL"))
+    return boto3.client(service, endpoint_url=endpoint_url)
+
+
+@lru_cache(maxsize=None)
+def account_id():
+    return client('sts').get_caller_identity().get('Account')
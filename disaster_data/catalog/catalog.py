@@ -1,5 +1,6 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from satstac import Catalog, Collection
 from disaster_data.utils import gdal_info_stac_multi
@@ -26,6 +27,63 @@ datasource_catalogs = {
 }
 
 
+# Links which encode a document's place in the hierarchy, rewritten whenever the tree is rebuilt
+HIERARCHY_RELS = ('self', 'root', 'parent', 'child', 'collection', 'item')
+WRITE_THREADS = int(os.environ.get("WRITE_THREADS", 32))
+
+
+def iter_features(path, chunk_size=1 << 20):
+    """
+    Stream the features of a GeoJSON feature collection one at a time, reading the file in chunks instead of
+    loading the whole document.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buf += chunk
+            key = buf.find('"features"')
+            start = buf.find('[', key) if key >= 0 else -1
+            if start >= 0:
+                buf = buf[start + 1:]
+                break
+
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos == len(buf):
+                    raise ValueError("Buffer exhausted")
+                feature, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError("Truncated feature collection: {}".format(path))
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield feature
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+
+def relink(doc, depth, children=()):
+    """Replace the hierarchy links of a document ``depth`` levels below the root"""
+    links = [x for x in doc.get('links', []) if x['rel'] not in HIERARCHY_RELS]
+    links.append({'rel': 'root', 'href': ('../' * depth or './') + 'catalog.json'})
+    if depth:
+        links.append({'rel': 'parent', 'href': '../catalog.json'})
+    links += [{'rel': 'child', 'href': './{}/catalog.json'.format(x)} for x in children]
+    return dict(doc, links=links)
+
+
 def organize_stac_assets(assets):
     # Find all collections and items
     collections = [x['data'] for x in assets if x['type'] == 'collection']
@@ -82,4 +140,49 @@ class DisasterDataCatalog(object):
                     year_cat = Catalog.open(os.path.join(self.root, ds_name, year, 'catalog.json'))
                     coll = Collection(feat)
                     year_cat.add_catalog(coll)
-                    year_cat.save()
\ No newline at end of file
+                    year_cat.save()
+
+    def rebuild(self, projects, num_threads=WRITE_THREADS):
+        """
+        Regenerate the root -> datasource -> year -> collection tree from projects files, given as a dict of
+        datasource name to path.  Features are grouped in memory as the files are streamed and every catalog is
+        written exactly once.  Children of the root which aren't rebuilt are kept.
+        """
+        docs = {}
+        ds_ids = []
+        for ds_name, path in projects.items():
+            ds_id = datasource_catalogs[ds_name]['id']
+            ds_ids.append(ds_id)
+            years = {}
+            for feat in iter_features(path):
+                if feat['extent']['temporal'][0]:
+                    year = feat['extent']['temporal'][0].split('-')[0]
+                    coll_id = str(feat['id'])
+                    years.setdefault(year, []).append(coll_id)
+                    docs[os.path.join(ds_id, year, coll_id)] = relink(feat, 3)
+            for year, coll_ids in years.items():
+                docs[os.path.join(ds_id, year)] = relink({
+                    "id": year,
+                    "stac_version": "0.7.0",
+                    "description": "Data acquired during the year {}".format(year)
+                }, 2, sorted(coll_ids))
+            docs[ds_id] = relink(datasource_catalogs[ds_name], 1, sorted(years))
+
+        root_children = set(ds_ids)
+        root_file = os.path.join(self.root, 'catalog.json')
+        if os.path.exists(root_file):
+            with open(root_file, 'r') as f:
+                root_children.update(x['href'].split('/')[-2] for x in json.load(f).get('links', [])
+                                     if x['rel'] == 'child')
+        docs[''] = relink(cat_json, 0, sorted(root_children))
+
+        def write(path):
+            filename = os.path.join(self.root, path, 'catalog.json')
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                json.dump(docs[path], f)
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(write, docs))
+        print("Wrote {} catalogs and collections below {}".format(len(docs), self.root))
+        return len(docs)
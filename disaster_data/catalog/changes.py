@@ -0,0 +1,112 @@
+import json
+import uuid
+import posixpath
+from datetime import datetime
+
+from disaster_data.catalog.links import s3_call, get_json, list_segments, read_segment
+
+CHANGES_PREFIX = 'changes'
+# Cursor of the change feed, written next to the root catalog.json
+CURSOR_NAME = 'changes.json'
+# Source recorded for the changes of each catalog prefix
+SOURCES = {'DGOpenData': 'dg-open-data', 'NOAAStorm': 'noaa-storm'}
+
+
+class ChangeFeed(object):
+
+    """
+    Append-only log of the items added, updated and removed by one index run.
+
+    Each run is published as a single NDJSON segment under ``changes/`` and listed in ``changes.json`` next to
+    the root catalog, so a consumer reads the cursor and then one segment per run it hasn't seen instead of
+    walking the catalog.  Segment keys are ordered by publish time and made unique with a random suffix, so
+    concurrent runs never need to agree on a sequence number.  The cursor is rebuilt from a listing of
+    ``changes/`` after each publish; a run whose listing missed a concurrent segment is corrected by the next
+    publish, and consumers track the segments they applied rather than a high-water mark.
+    """
+
+    def __init__(self, bucket, source, root=''):
+        self.bucket = bucket
+        self.source = source
+        self.root = root
+        self.entries = []
+        self.started = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, op, item, href):
+        self.entries.append({
+            'op': op,
+            'id': item['id'],
+            'collection': item.get('collection'),
+            'href': href,
+            'bbox': item.get('bbox'),
+            'datetime': item.get('properties', {}).get('datetime'),
+        })
+
+    def added(self, item, href):
+        self.record('added', item, href)
+
+    def updated(self, item, href):
+        self.record('updated', item, href)
+
+    def removed(self, item, href):
+        self.record('removed', item, href)
+
+    def counts(self):
+        out = {'added': 0, 'updated': 0, 'removed': 0}
+        for entry in self.entries:
+            out[entry['op']] += 1
+        return out
+
+    def href(self, key):
+        return './' + posixpath.relpath(key, self.root or '.')
+
+    def publish(self):
+        """
+        Upload the segment of this run and rebuild the cursor, returning the href of the segment
+        """
+        if not self.entries:
+            print("No catalog changes to publish.")
+            return None
+
+        published = datetime.utcnow().strftime("%Y%m%dT%H%M%S.%fZ")
+        key = posixpath.join(self.root, CHANGES_PREFIX, '{}-{}-{}.ndjson'.format(
+            published, self.source, uuid.uuid4().hex[:8]))
+        body = ''.join(json.dumps(x) + '\n' for x in self.entries)
+        s3_call('put_object', Bucket=self.bucket, Key=key, Body=body, ContentType='application/x-ndjson')
+
+        own = dict({'href': self.href(key), 'source': self.source, 'started': self.started}, **self.counts())
+        self.update_cursor(own)
+        print("Published {} catalog changes as {}.".format(len(self.entries), own['href']))
+        return own['href']
+
+    def update_cursor(self, own):
+        """
+        List the segments under ``changes/`` into the cursor, in key (publish time) order.  Segments published
+        by other runs and not yet in the cursor are read to count their changes.
+        """
+        cursor_key = posixpath.join(self.root, CURSOR_NAME)
+        cursor = get_json(self.bucket, cursor_key) or {'segments': []}
+        known = {x['href']: x for x in cursor['segments']}
+        known[own['href']] = own
+
+        segments = []
+        for key in sorted(list_segments(self.bucket, self.root, CHANGES_PREFIX)):
+            href = self.href(key)
+            if href not in known:
+                counts = {'added': 0, 'updated': 0, 'removed': 0}
+                for entry in read_segment(self.bucket, key):
+                    counts[entry['op']] += 1
+                source = posixpath.splitext(posixpath.basename(key))[0].split('-', 1)[1].rsplit('-', 1)[0]
+                known[href] = dict({'href': href, 'source': source}, **counts)
+            segments.append(known[href])
+
+        cursor = {
+            'sequence': len(segments),
+            'updated': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'segments': segments,
+        }
+        s3_call('put_object', Bucket=self.bucket, Key=cursor_key, Body=json.dumps(cursor),
+                ContentType='application/json')
@@ -0,0 +1,124 @@
+import os
+import json
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+from disaster_data.endpoints import request
+
+MANIFEST_NAME = 'manifest.json'
+WALK_THREADS = int(os.environ.get("WALK_THREADS", 32))
+
+
+def resolve(base, href):
+    """Resolve a STAC link relative to the document it was found in"""
+    if base.startswith(('http://', 'https://')):
+        return urljoin(base, href)
+    if href.startswith('/'):
+        return href
+    return os.path.normpath(os.path.join(os.path.dirname(base), href))
+
+
+def read_json(url):
+    if url.startswith(('http://', 'https://')):
+        r = request('get', url)
+        r.raise_for_status()
+        return r.json()
+    with open(url, 'r') as f:
+        return json.load(f)
+
+
+def is_missing(e):
+    """Whether reading a document failed because it doesn't exist.  Public buckets answer 403 for missing keys."""
+    if isinstance(e, FileNotFoundError):
+        return True
+    return getattr(getattr(e, 'response', None), 'status_code', None) in (403, 404)
+
+
+def walk_catalog(url, num_threads=WALK_THREADS):
+    """
+    Concurrently walk a static STAC catalog, yielding ``(href, item)`` for every item below ``url``.
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        frontier = [url]
+        while frontier:
+            item_urls = []
+            children = []
+            for cat_url, cat in zip(frontier, executor.map(read_json, frontier)):
+                for link in cat.get('links', []):
+                    if link['rel'] == 'child':
+                        children.append(resolve(cat_url, link['href']))
+                    elif link['rel'] == 'item':
+                        item_urls.append(resolve(cat_url, link['href']))
+            for item_url, item in zip(item_urls, executor.map(read_json, item_urls)):
+                yield item_url, item
+            frontier = children
+
+
+class ItemIndex(object):
+
+    """
+    Compact index of the item ids and data asset hrefs already present in a collection, and where each item
+    is published.
+    """
+
+    def __init__(self, ids=None, hrefs=None, items=None):
+        self.ids = set(ids or [])
+        self.hrefs = set(hrefs or [])
+        # Published href of each item, by id
+        self.items = dict(items or {})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item):
+        if item.get('id') in self.ids:
+            return True
+        return item.get('assets', {}).get('data', {}).get('href') in self.hrefs
+
+    def add(self, item, href=None):
+        self.ids.add(item['id'])
+        data_href = item.get('assets', {}).get('data', {}).get('href')
+        if data_href:
+            self.hrefs.add(data_href)
+        if href:
+            self.items[item['id']] = href
+
+    def to_dict(self):
+        return {'ids': sorted(self.ids), 'hrefs': sorted(self.hrefs), 'items': self.items}
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def from_manifest(cls, url):
+        manifest = read_json(url)
+        return cls(manifest['ids'], manifest['hrefs'], manifest.get('items'))
+
+    @classmethod
+    def from_catalog(cls, url, num_threads=WALK_THREADS):
+        index = cls()
+        for item_url, item in walk_catalog(url, num_threads):
+            index.add(item, item_url)
+        return index
+
+    @classmethod
+    def load(cls, collection_url, num_threads=WALK_THREADS):
+        """
+        Load the index of a collection from its manifest, falling back to walking the collection.  A
+        collection which isn't published yet has an empty index, any other failure to read it is raised: an
+        empty index would have every published item counted again as new.
+        """
+        try:
+            return cls.from_manifest(resolve(collection_url, MANIFEST_NAME))
+        except Exception:
+            pass
+        try:
+            read_json(collection_url)
+        except Exception as e:
+            if is_missing(e):
+                print("Collection not published yet: {}".format(collection_url))
+                return cls()
+            raise
+        print("No manifest found, walking collection: {}".format(collection_url))
+        return cls.from_catalog(collection_url, num_threads)
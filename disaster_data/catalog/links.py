@@ -0,0 +1,281 @@
+import os
+import json
+import uuid
+import socket
+import posixpath
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint
+from disaster_data.catalog.index import ItemIndex, MANIFEST_NAME
+
+LINK_LOG_PREFIX = '_links'
+FLUSH_SIZE = int(os.environ.get("LINK_LOG_FLUSH_SIZE", 500))
+COMPACT_THREADS = int(os.environ.get("COMPACT_THREADS", 32))
+STAC_VERSION = '0.7.0'
+
+
+def worker_id():
+    return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def s3_call(method, **kwargs):
+    return endpoint('s3').call(getattr(client('s3'), method), **kwargs)
+
+
+def put_json(bucket, key, data):
+    s3_call('put_object', Bucket=bucket, Key=key, Body=json.dumps(data), ContentType='application/json')
+
+
+def get_json(bucket, key):
+    """Read a JSON object, returning None if it doesn't exist"""
+    try:
+        r = s3_call('get_object', Bucket=bucket, Key=key)
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(r['Body'].read())
+
+
+def object_url(bucket, key):
+    return 'https://{}.s3.amazonaws.com/{}'.format(bucket, key)
+
+
+def item_key(item, prefix):
+    """Key of an item below its collection's date catalog"""
+    date = item['properties']['datetime'].split('T')[0]
+    return posixpath.join(prefix, item['collection'], date, item['id'] + '.json')
+
+
+class LinkLog(object):
+
+    """
+    Write side of the catalog for a single worker.
+
+    Items are written as immutable objects and their links are appended to a log private to this worker, so
+    any number of workers can ingest concurrently without touching shared catalogs.  S3 has no append, the log
+    is a series of numbered NDJSON segments under ``<prefix>/_links/<worker>/``.  ``compact`` merges the logs
+    into the parent catalogs.
+    """
+
+    def __init__(self, bucket, prefix, flush_size=FLUSH_SIZE):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.flush_size = flush_size
+        self.worker = worker_id()
+        self.segment = 0
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def add_item(self, item):
+        key = item_key(item, self.prefix)
+        item = dict(item, links=[
+            {'rel': 'self', 'href': object_url(self.bucket, key)},
+            {'rel': 'parent', 'href': './catalog.json'},
+            {'rel': 'collection', 'href': '../catalog.json'},
+        ])
+        put_json(self.bucket, key, item)
+        # Enough of the item for compaction to update the manifest and change feed without reading it
+        self.add_link(posixpath.join(posixpath.dirname(key), 'catalog.json'),
+                      {'rel': 'item', 'href': './' + posixpath.basename(key)}, id=item['id'],
+                      data=item.get('assets', {}).get('data', {}).get('href'), bbox=item.get('bbox'),
+                      datetime=item['properties'].get('datetime'))
+        return key
+
+    def add_link(self, parent, link, **kwargs):
+        """Log a link to be added to the catalog at key ``parent``"""
+        self.buffer.append(dict(kwargs, parent=parent, link=link))
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        key = posixpath.join(self.prefix, LINK_LOG_PREFIX, self.worker, '{:08d}.ndjson'.format(self.segment))
+        body = ''.join(json.dumps(x) + '\n' for x in self.buffer)
+        s3_call('put_object', Bucket=self.bucket, Key=key, Body=body, ContentType='application/x-ndjson')
+        self.segment += 1
+        self.buffer = []
+
+
+def list_segments(bucket, prefix, log_prefix=LINK_LOG_PREFIX):
+    paginator = client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=posixpath.join(prefix, log_prefix) + '/'):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+def read_segment(bucket, key):
+    body = s3_call('get_object', Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def link_key(catalog_key, href):
+    """Bucket key a catalog link points at, so relative and absolute links to the same object compare equal"""
+    if href.startswith(('http://', 'https://')):
+        return urlparse(href).path.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(catalog_key), href))
+
+
+def new_catalog(key):
+    id = posixpath.basename(posixpath.dirname(key))
+    return {
+        'id': id,
+        'stac_version': STAC_VERSION,
+        'description': 'Data acquired on {}'.format(id),
+        'links': [
+            {'rel': 'parent', 'href': '../catalog.json'},
+        ]
+    }
+
+
+def walk_bucket(bucket, key, num_threads=COMPACT_THREADS):
+    """
+    Walk a catalog through the S3 API like ``walk_catalog``, yielding ``(key, item)`` for every item below the
+    catalog at ``key``.
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        frontier = [key]
+        while frontier:
+            item_keys = []
+            children = []
+            for cat_key, cat in zip(frontier, executor.map(lambda k: get_json(bucket, k), frontier)):
+                for link in (cat or {}).get('links', []):
+                    if link['rel'] == 'child':
+                        children.append(link_key(cat_key, link['href']))
+                    elif link['rel'] == 'item':
+                        item_keys.append(link_key(cat_key, link['href']))
+            for found, item in zip(item_keys, executor.map(lambda k: get_json(bucket, k), item_keys)):
+                if item is not None:
+                    yield found, item
+            frontier = children
+
+
+def update_manifests(bucket, prefix, records, num_threads=COMPACT_THREADS):
+    """
+    Add the items of link log ``records`` to the manifests of their collections, so ``ItemIndex.load`` finds
+    them without walking the collection.  A collection without a manifest is walked once to create it.  Like
+    ``compact`` this is a read-modify-write of shared documents.
+    """
+    collections = {}
+    for record in records:
+        collections.setdefault(posixpath.relpath(record['parent'], prefix).split('/')[0], []).append(record)
+
+    for coll_id, coll_records in collections.items():
+        key = posixpath.join(prefix, coll_id, MANIFEST_NAME)
+        manifest = get_json(bucket, key)
+        if manifest is None:
+            print("No manifest found, walking collection: {}".format(coll_id))
+            index = ItemIndex()
+            for found, item in walk_bucket(bucket, posixpath.join(prefix, coll_id, 'catalog.json'), num_threads):
+                index.add(item, object_url(bucket, found))
+        else:
+            index = ItemIndex(manifest['ids'], manifest['hrefs'], manifest.get('items'))
+        for record in coll_records:
+            index.add({'id': record['id'], 'assets': {'data': {'href': record.get('data')}}},
+                      object_url(bucket, link_key(record['parent'], record['link']['href'])))
+        put_json(bucket, key, index.to_dict())
+    return sorted(collections)
+
+
+def compact(bucket, prefix, num_threads=COMPACT_THREADS, feed=None):
+    """
+    Merge the link logs below ``prefix`` into their parent catalogs, writing each changed catalog once, and add
+    the items linked to the manifests of their collections.  Missing date catalogs are created and linked from
+    their collection.  Only the segments read are deleted, so workers can keep ingesting during compaction, and
+    merging is idempotent so an interrupted compaction can simply be run again.  Catalogs are
+    read-modify-written, so compaction of a prefix must only run in one process at a time (the
+    ``compact-catalog`` command), never from the ingesting workers.
+
+    Items whose link is new are recorded as added to ``feed``, items written again over an existing link as
+    updated.  The caller publishes the feed once the rest of the compaction is written.
+    """
+    segments = list(list_segments(bucket, prefix))
+    if not segments:
+        print("No link logs to compact.")
+        return {}
+
+    links = {}
+    item_records = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for records in executor.map(lambda k: read_segment(bucket, k), segments):
+            for record in records:
+                links.setdefault(record['parent'], []).append(record['link'])
+                if record['link']['rel'] == 'item' and 'id' in record:
+                    item_records.append(record)
+
+        catalogs = dict(zip(links, executor.map(lambda k: get_json(bucket, k), links)))
+
+        # New catalogs need a child link from their parent, which may itself be new
+        pending = [k for k, v in catalogs.items() if v is None]
+        while pending:
+            key = pending.pop()
+            catalogs[key] = new_catalog(key)
+            parent = posixpath.join(posixpath.dirname(posixpath.dirname(key)), 'catalog.json')
+            if not parent.startswith(prefix + '/'):
+                continue
+            if parent not in catalogs:
+                catalogs[parent] = get_json(bucket, parent)
+                if catalogs[parent] is None:
+                    pending.append(parent)
+            child = posixpath.basename(posixpath.dirname(key))
+            links.setdefault(parent, []).append({'rel': 'child', 'href': './{}/catalog.json'.format(child)})
+
+        added = {}
+        new_targets = set()
+        for key, new_links in links.items():
+            catalog = catalogs[key]
+            existing = {link_key(key, x['href']) for x in catalog['links'] if x['rel'] in ('item', 'child')}
+            count = 0
+            for link in new_links:
+                target = link_key(key, link['href'])
+                if target not in existing:
+                    catalog['links'].append(link)
+                    existing.add(target)
+                    new_targets.add(target)
+                    count += 1
+            added[key] = count
+
+        changed = [k for k in links if added[k]]
+        list(executor.map(lambda k: put_json(bucket, k, catalogs[k]), changed))
+
+    if item_records:
+        update_manifests(bucket, prefix, item_records, num_threads)
+    if feed is not None:
+        recorded = set()
+        for record in item_records:
+            target = link_key(record['parent'], record['link']['href'])
+            if target in recorded:
+                continue
+            recorded.add(target)
+            item = {'id': record['id'], 'collection': posixpath.relpath(target, prefix).split('/')[0],
+                    'bbox': record.get('bbox'), 'properties': {'datetime': record.get('datetime')}}
+            if target in new_targets:
+                feed.added(item, object_url(bucket, target))
+            else:
+                feed.updated(item, object_url(bucket, target))
+
+    for idx in range(0, len(segments), 1000):
+        s3_call('delete_objects', Bucket=bucket,
+                Delete={'Objects': [{'Key': k} for k in segments[idx:idx + 1000]], 'Quiet': True})
+
+    print("Compacted {} link log segments into {} catalogs ({} new links).".format(
+        len(segments), len(changed), sum(added.values())))
+    return added
+
+
+def compacted_collections(added, prefix):
+    """Ids of the collections whose date catalogs gained links in a compaction"""
+    collections = set()
+    for key, count in added.items():
+        parts = posixpath.relpath(key, prefix).split('/')
+        if count and len(parts) == 3:
+            collections.add(parts[0])
+    return sorted(collections)
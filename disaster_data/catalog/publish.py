@@ -0,0 +1,77 @@
+import os
+import hashlib
+import mimetypes
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint
+from disaster_data.catalog.links import get_json, put_json
+
+# Content hashes of every object published from a local tree, written at the root of the tree's key prefix
+PUBLISH_MANIFEST = 'publish-manifest.json'
+PUBLISH_THREADS = int(os.environ.get("PUBLISH_THREADS", 32))
+CONTENT_TYPES = {'.json': 'application/json', '.jpg': 'image/jpeg', '.pmtiles': 'application/vnd.pmtiles'}
+
+
+def file_hash(path, block_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def local_files(local_dir, prefix):
+    """``(key, path)`` of every file below ``local_dir``, published under the key ``prefix``"""
+    for dirpath, _, filenames in os.walk(local_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            yield posixpath.join(prefix, rel) if prefix else rel, path
+
+
+def manifest_key(prefix):
+    return posixpath.join(prefix, PUBLISH_MANIFEST) if prefix else PUBLISH_MANIFEST
+
+
+def content_type(key):
+    ext = posixpath.splitext(key)[1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+def publish(trees, bucket, num_threads=PUBLISH_THREADS):
+    """
+    Upload local outputs to ``bucket``, skipping every file whose content hash matches the manifest of the
+    last publish.  ``trees`` is a list of ``(local directory, key prefix)``, each with its own manifest under its
+    prefix, so flows publishing different prefixes never overwrite each other's hashes.  The manifest replaces
+    listing the bucket, so a run which changed a few items makes a few PUTs whatever the size of the catalog.
+    It's updated last, an interrupted publish only re-uploads what it didn't record.  Returns the keys uploaded.
+    """
+    changed = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for local_dir, prefix in trees:
+            changed += publish_tree(executor, local_dir, prefix, bucket)
+    return changed
+
+
+def publish_tree(executor, local_dir, prefix, bucket):
+    manifest = get_json(bucket, manifest_key(prefix)) or {}
+    files = dict(local_files(local_dir, prefix))
+    # The manifest of a tree is never published as one of its files
+    files.pop(manifest_key(prefix), None)
+    hashes = dict(zip(files, executor.map(file_hash, files.values())))
+    changed = [k for k, v in hashes.items() if manifest.get(k) != v]
+
+    def upload(key):
+        endpoint('s3').call(client('s3').upload_file, files[key], bucket, key,
+                            ExtraArgs={'ContentType': content_type(key)})
+
+    list(executor.map(upload, changed))
+
+    if changed:
+        manifest.update({k: hashes[k] for k in changed})
+        put_json(bucket, manifest_key(prefix), manifest)
+    print("Published {} of {} files below {}, {} unchanged.".format(len(changed), len(files), prefix or '/',
+                                                                     len(files) - len(changed)))
+    return changed
@@ -0,0 +1,201 @@
+import json
+import calendar
+from datetime import datetime
+
+import numpy as np
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 1000
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+}
+
+
+def utc_offset(value):
+    """Seconds east of UTC of an ISO 8601 offset (``Z``, ``+05:30``, ``-0400``), 0 when there is none"""
+    if not value or value.upper() == 'Z':
+        return 0
+    sign = -1 if value[0] == '-' else 1
+    digits = value[1:].replace(':', '')
+    return sign * (int(digits[:2]) * 3600 + int(digits[2:4] or 0) * 60)
+
+
+def to_timestamp(value):
+    """Seconds since the epoch of an ISO 8601 date or datetime, converted to UTC when it carries an offset"""
+    value = value.strip().replace(' ', 'T')
+    if len(value) >= 19:
+        dt = datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+        # Skip fractional seconds to reach the offset
+        zone = value[19:].lstrip('.0123456789')
+        return calendar.timegm(dt.timetuple()) - utc_offset(zone)
+    elif len(value) >= 10:
+        dt = datetime.strptime(value[:10], "%Y-%m-%d")
+    elif len(value) == 7:
+        dt = datetime.strptime(value, "%Y-%m")
+    else:
+        dt = datetime.strptime(value[:4], "%Y")
+    return calendar.timegm(dt.timetuple())
+
+
+def period_end(value):
+    """Last second of the year, month, day or second given by an ISO 8601 value"""
+    value = value.strip()
+    if len(value) >= 19:
+        return to_timestamp(value)
+    if len(value) >= 10:
+        return to_timestamp(value[:10]) + 86399
+    year = int(value[:4])
+    if len(value) == 7:
+        month = int(value[5:7])
+        return to_timestamp(value) + calendar.monthrange(year, month)[1] * 86400 - 1
+    return to_timestamp(value[:4]) + (366 if calendar.isleap(year) else 365) * 86400 - 1
+
+
+def parse_interval(value):
+    """
+    Parse a STAC API datetime parameter into an inclusive (start, end) range of timestamps.  Either end may
+    be open (``..``), and a year, month or date matches the whole period.
+    """
+    if '/' in value:
+        start, end = value.split('/', 1)
+        start = to_timestamp(start) if start not in ('', '..') else None
+        end = period_end(end) if end not in ('', '..') else None
+        return start, end
+    return to_timestamp(value), period_end(value)
+
+
+def get_property(item, name):
+    if name in ('id', 'collection'):
+        return item.get(name)
+    return item.get('properties', {}).get(name)
+
+
+def match_query(item, query):
+    for name, conditions in query.items():
+        value = get_property(item, name)
+        for op, expected in conditions.items():
+            if not OPERATORS[op](value, expected):
+                return False
+    return True
+
+
+class CatalogIndex(object):
+
+    """
+    Read-only search index over the items of a static catalog.
+
+    Items are held as their serialized JSON next to compact arrays of bboxes, datetimes and collection codes.
+    Spatial queries go through an STR-tree over the bboxes and temporal queries bisect a sorted datetime
+    index, so property filters only parse the few items left.  Items without a datetime are returned last and
+    never match a temporal query, items without a bbox are left out of the STR-tree and never match a spatial
+    query.
+    """
+
+    def __init__(self, records):
+        self.hrefs = []
+        self.docs = []
+        self.collections = {}
+        bboxes = []
+        located = []
+        timestamps = []
+        dated = []
+        codes = []
+        for href, doc in records:
+            item = json.loads(doc)
+            self.hrefs.append(href)
+            self.docs.append(doc)
+            bbox = item.get('bbox')
+            if bbox:
+                # 3D bboxes are indexed by their horizontal extent
+                bboxes.append(bbox[:2] + bbox[3:5] if len(bbox) == 6 else bbox)
+                located.append(len(self.docs) - 1)
+            try:
+                timestamps.append(to_timestamp(item['properties']['datetime']))
+                dated.append(True)
+            except (KeyError, TypeError, AttributeError, ValueError):
+                timestamps.append(0)
+                dated.append(False)
+            codes.append(self.collections.setdefault(item.get('collection'), len(self.collections)))
+
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        # Item index of each bbox
+        self.located = np.asarray(located, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.dated = np.asarray(dated, dtype=bool)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        # Newest first, which is also the order results are returned in, undated items after the rest
+        self.order = np.lexsort((-self.timestamps, ~self.dated))
+        self.dated_count = int(self.dated.sum())
+        self.sorted_timestamps = -self.timestamps[self.order[:self.dated_count]]
+        self.boxes = [box(*x) for x in self.bboxes]
+        self.box_index = {id(x): idx for idx, x in enumerate(self.boxes)}
+        self.tree = STRtree(self.boxes) if self.boxes else None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def spatial(self, bbox):
+        if self.tree is None:
+            return np.empty(0, dtype=np.int64)
+        results = self.tree.query(box(*bbox))
+        if len(results) and hasattr(results[0], 'bounds'):
+            # Shapely 1.x returns the geometries rather than their indices
+            results = [self.box_index[id(x)] for x in results]
+        return self.located[np.asarray(results, dtype=np.int64)]
+
+    def candidates(self, bbox=None, interval=None, collections=None):
+        """Indices of the items matching the spatial, temporal and collection filters, newest first"""
+        if interval:
+            start, end = interval
+            lo = 0 if end is None else np.searchsorted(self.sorted_timestamps, -end, side='left')
+            hi = self.dated_count if start is None else np.searchsorted(self.sorted_timestamps, -start, side='right')
+            selected = self.order[lo:hi]
+        else:
+            selected = self.order
+        if collections is not None:
+            codes = [self.collections[x] for x in collections if x in self.collections]
+            selected = selected[np.isin(self.codes[selected], codes)]
+        if bbox is not None:
+            selected = selected[np.isin(selected, self.spatial(bbox))]
+        return selected
+
+    def search(self, bbox=None, datetime=None, collections=None, query=None, limit=DEFAULT_LIMIT, page=1):
+        """
+        Return ``(features, matched)`` for a page of results.  ``matched`` is None when a property query
+        stopped evaluating once the page was filled.
+        """
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        page = max(1, int(page))
+        selected = self.candidates(bbox, parse_interval(datetime) if datetime else None, collections)
+        offset = (page - 1) * limit
+        if not query:
+            return [self.docs[x] for x in selected[offset:offset + limit]], len(selected)
+
+        features = []
+        skipped = 0
+        for idx in selected:
+            if not match_query(json.loads(self.docs[idx]), query):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            features.append(self.docs[idx])
+            if len(features) == limit + 1:
+                break
+        # One extra match is read to know whether there is a next page
+        if len(features) > limit:
+            return features[:limit], None
+        # Every candidate was evaluated, a page past the end skipped fewer than its offset
+        return features, skipped + len(features)
+
+    def collection_counts(self):
+        counts = np.bincount(self.codes, minlength=len(self.collections))
+        return {name: int(counts[code]) for name, code in self.collections.items()}
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from disaster_data.endpoints import request
+from disaster_data.catalog.index import resolve, read_json, walk_catalog, MANIFEST_NAME, WALK_THREADS
+from disaster_data.catalog.changes import CURSOR_NAME
+from disaster_data.catalog.search import CatalogIndex, DEFAULT_LIMIT
+
+RELOAD_INTERVAL = int(os.environ.get("SERVE_RELOAD_INTERVAL", 30))
+
+
+def read_text(url):
+    if url.startswith(('http://', 'https://')):
+        r = request('get', url)
+        r.raise_for_status()
+        return r.text
+    with open(url, 'r') as f:
+        return f.read()
+
+
+def fingerprint(url):
+    """ETag or modification time of a document, None if it doesn't exist"""
+    try:
+        if url.startswith(('http://', 'https://')):
+            r = request('head', url)
+            return r.headers.get('ETag') if r.ok else None
+        return os.path.getmtime(url)
+    except Exception:
+        return None
+
+
+def serialize(item):
+    return json.dumps(item, separators=(',', ':'))
+
+
+class CatalogServer(object):
+
+    """
+    Keeps a search index of a static catalog up to date.
+
+    The catalog is walked once at startup.  Afterwards the change feed cursor is polled and new segments are
+    applied by fetching only the items they list.  A manifest which changes without a matching change feed
+    entry (a run from before the feed existed, or a mirror) triggers a full reload.  The index is rebuilt off
+    to the side and swapped in, so searches are never blocked.
+    """
+
+    def __init__(self, catalog_url, num_threads=WALK_THREADS):
+        self.catalog_url = catalog_url
+        self.cursor_url = resolve(catalog_url, CURSOR_NAME)
+        self.num_threads = num_threads
+        self.records = {}
+        self.manifests = {}
+        # Change feed segments already reflected in the index
+        self.applied = set()
+        self.index = CatalogIndex([])
+
+    def cursor(self):
+        try:
+            return read_json(self.cursor_url)
+        except Exception:
+            return None
+
+    def load(self):
+        started = time.monotonic()
+        cursor = self.cursor()
+        records = {}
+        collections = set()
+        for href, item in walk_catalog(self.catalog_url, self.num_threads):
+            records[href] = serialize(item)
+            for link in item.get('links', []):
+                if link['rel'] == 'collection':
+                    collections.add(resolve(href, link['href']))
+
+        self.records = records
+        self.manifests = {x: fingerprint(x) for x in (resolve(c, MANIFEST_NAME) for c in collections)}
+        self.applied = {x['href'] for x in cursor['segments']} if cursor else set()
+        self.index = CatalogIndex(self.records.items())
+        print("Loaded {} items in {:.1f}s.".format(len(self.index), time.monotonic() - started))
+
+    def apply_changes(self, cursor):
+        segments = [x for x in cursor['segments'] if x['href'] not in self.applied]
+        changes = {}
+        for segment in segments:
+            for line in read_text(resolve(self.cursor_url, segment['href'])).splitlines():
+                if line.strip():
+                    entry = json.loads(line)
+                    changes[entry['href']] = entry['op']
+
+        fetch = [href for href, op in changes.items() if op != 'removed']
+        records = dict(self.records)
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for href, item in zip(fetch, executor.map(read_json, fetch)):
+                records[href] = serialize(item)
+        for href, op in changes.items():
+            if op == 'removed':
+                records.pop(href, None)
+
+        self.records = records
+        self.applied.update(x['href'] for x in segments)
+        self.index = CatalogIndex(self.records.items())
+        print("Applied {} changes from {} segments, {} items.".format(len(changes), len(segments), len(self.index)))
+
+    def refresh(self):
+        """Bring the index up to date, returning True if it changed"""
+        cursor = self.cursor()
+        if cursor and any(x['href'] not in self.applied for x in cursor['segments']):
+            self.apply_changes(cursor)
+            self.manifests = {x: fingerprint(x) for x in self.manifests}
+            return True
+        if any(fingerprint(url) != value for url, value in self.manifests.items()):
+            print("Manifest changed, reloading catalog.")
+            self.load()
+            return True
+        return False
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Failed to refresh catalog: {}".format(e))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def search_params(params):
+    """Normalize GET query parameters or a POST body into keyword arguments of CatalogIndex.search"""
+    out = {}
+    bbox = params.get('bbox')
+    if bbox is not None:
+        out['bbox'] = [float(x) for x in (bbox.split(',') if isinstance(bbox, str) else bbox)]
+        if len(out['bbox']) != 4:
+            raise ValueError("bbox must have four values")
+    collections = params.get('collections')
+    if collections is not None:
+        out['collections'] = collections.split(',') if isinstance(collections, str) else list(collections)
+    query = params.get('query')
+    if query is not None:
+        out['query'] = json.loads(query) if isinstance(query, str) else query
+    for key in ('datetime', 'limit', 'page'):
+        if params.get(key) is not None:
+            out[key] = params[key]
+    return out
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+
+    catalog = None
+    verbose = False
+
+    def send_json(self, body, status=200):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def base_url(self):
+        return 'http://{}'.format(self.headers.get('Host', '{}:{}'.format(*self.server.server_address)))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path in ('', '/'):
+            self.send_json(json.dumps({
+                'id': 'cognition-disaster-data',
+                'stac_version': '0.7.0',
+                'description': 'Search the catalog at {}'.format(self.catalog.catalog_url),
+                'links': [
+                    {'rel': 'search', 'href': self.base_url() + '/search'},
+                    {'rel': 'data', 'href': self.base_url() + '/collections'},
+                ]
+            }))
+        elif url.path == '/collections':
+            self.send_json(json.dumps({'collections': self.catalog.index.collection_counts()}))
+        elif url.path == '/search':
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            self.search(params, method='GET')
+        else:
+            self.send_json(json.dumps({'error': 'Not found'}), status=404)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/search':
+            self.send_json(json.dumps({'error': 'Not found'}), status=404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self.send_json(json.dumps({'error': str(e)}), status=400)
+            return
+        self.search(params, method='POST')
+
+    def search(self, params, method):
+        try:
+            kwargs = search_params(params)
+            features, matched = self.catalog.index.search(**kwargs)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(json.dumps({'error': 'Invalid search: {}'.format(e)}), status=400)
+            return
+
+        limit = int(kwargs.get('limit', DEFAULT_LIMIT))
+        page = int(kwargs.get('page', 1))
+        links = []
+        if matched is None or matched > page * limit:
+            if method == 'GET':
+                href = '{}/search?{}'.format(self.base_url(), urlencode(dict(params, page=page + 1)))
+                links.append({'rel': 'next', 'href': href})
+            else:
+                links.append({'rel': 'next', 'href': self.base_url() + '/search', 'method': 'POST',
+                              'body': dict(params, page=page + 1), 'merge': False})
+        context = {'page': page, 'limit': limit, 'returned': len(features)}
+        if matched is not None:
+            context['matched'] = matched
+
+        # Items are kept serialized so a page is assembled without encoding them again
+        self.send_json('{"type":"FeatureCollection","features":[' + ','.join(features) + '],"links":' +
+                       json.dumps(links) + ',"context":' + json.dumps(context) + '}')
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(catalog_url, host='127.0.0.1', port=8080, reload_interval=RELOAD_INTERVAL, num_threads=WALK_THREADS,
+          verbose=False):
+    """
+    Serve STAC API searches over a static catalog from memory, reloading as the catalog changes.
+    """
+    catalog = CatalogServer(catalog_url, num_threads)
+    catalog.load()
+    if reload_interval:
+        threading.Thread(target=catalog.watch, args=(reload_interval,), daemon=True).start()
+
+    SearchHandler.catalog = catalog
+    SearchHandler.verbose = verbose
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    print("Serving {} on http://{}:{}".format(catalog_url, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,196 @@
+import posixpath
+from bisect import bisect_right
+
+from disaster_data.catalog.links import s3_call, put_json, get_json, list_segments, worker_id
+
+SUMMARIES_NAME = 'summaries.json'
+SUMMARY_LOG_PREFIX = '_summaries'
+# Lower edges of each histogram's bins, the last bin is open ended
+HISTOGRAMS = {
+    'eo:gsd': [0, 0.3, 0.5, 0.75, 1, 2, 5, 10, 30],
+    'eo:cloud_cover': [0, 10, 20, 30, 40, 50, 60, 70, 80, 90],
+    'eo:off_nadir': [0, 5, 10, 15, 20, 25, 30, 35, 40, 45],
+}
+RANGES = ('eo:gsd', 'eo:cloud_cover', 'eo:off_nadir', 'eo:sun_elevation', 'datetime')
+
+
+def empty_aggregate():
+    return {
+        'count': 0,
+        'histograms': {k: [0] * len(edges) for k, edges in HISTOGRAMS.items()},
+        'dates': {},
+    }
+
+
+def add_to_aggregate(aggregate, properties):
+    aggregate['count'] += 1
+    for name, edges in HISTOGRAMS.items():
+        value = properties.get(name)
+        if isinstance(value, (int, float)):
+            aggregate['histograms'][name][max(0, bisect_right(edges, value) - 1)] += 1
+    date = (properties.get('datetime') or '')[:10]
+    if date:
+        aggregate['dates'][date] = aggregate['dates'].get(date, 0) + 1
+
+
+def merge_aggregates(a, b):
+    a['count'] += b['count']
+    for name in HISTOGRAMS:
+        a['histograms'][name] = [x + y for x, y in zip(a['histograms'][name], b['histograms'][name])]
+    for date, count in b['dates'].items():
+        a['dates'][date] = a['dates'].get(date, 0) + count
+
+
+class Summary(object):
+
+    """
+    Counts and histograms of a collection's items by platform, GSD, cloud cover, off-nadir angle and date.
+
+    Every aggregate is a sum, so summaries built by different workers, or by different runs, are merged by
+    adding them up.  Histograms are kept for the collection and for each platform, which answers questions like
+    "how much WV03 imagery under 20% cloud" without reading any items.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.total = data.get('total') or empty_aggregate()
+        self.platforms = data.get('platforms', {})
+        self.instruments = data.get('instruments', {})
+        self.ranges = data.get('ranges', {})
+
+    def __len__(self):
+        return self.total['count']
+
+    def add(self, item):
+        properties = item.get('properties', {})
+        platform = properties.get('eo:platform') or 'unknown'
+        add_to_aggregate(self.total, properties)
+        add_to_aggregate(self.platforms.setdefault(platform, empty_aggregate()), properties)
+        instrument = properties.get('eo:instrument')
+        if instrument:
+            self.instruments[instrument] = self.instruments.get(instrument, 0) + 1
+        for name in RANGES:
+            value = properties.get(name)
+            if value is not None:
+                self.extend_range(name, value, value)
+
+    def extend_range(self, name, low, high):
+        if name in self.ranges:
+            low, high = min(low, self.ranges[name][0]), max(high, self.ranges[name][1])
+        self.ranges[name] = [low, high]
+
+    def merge(self, other):
+        merge_aggregates(self.total, other.total)
+        for platform, aggregate in other.platforms.items():
+            merge_aggregates(self.platforms.setdefault(platform, empty_aggregate()), aggregate)
+        for instrument, count in other.instruments.items():
+            self.instruments[instrument] = self.instruments.get(instrument, 0) + count
+        for name, (low, high) in other.ranges.items():
+            self.extend_range(name, low, high)
+        return self
+
+    def to_dict(self):
+        return {
+            'edges': HISTOGRAMS,
+            'total': self.total,
+            'platforms': self.platforms,
+            'instruments': self.instruments,
+            'ranges': self.ranges,
+        }
+
+    def stac_summaries(self):
+        """The ``summaries`` field of the collection, distinct values and min/max ranges"""
+        summaries = {
+            'eo:platform': sorted(x for x in self.platforms if x != 'unknown'),
+            'eo:instrument': sorted(self.instruments),
+        }
+        summaries.update({name: {'min': low, 'max': high} for name, (low, high) in self.ranges.items()})
+        return {k: v for k, v in summaries.items() if v}
+
+
+def summarize(items):
+    """Summaries of items grouped by collection id"""
+    summaries = {}
+    for item in items:
+        summaries.setdefault(item['collection'], Summary()).add(item)
+    return summaries
+
+
+def update_collection(bucket, key, summary, collection=True):
+    """
+    Merge a summary into the summaries document next to the collection at ``key``, and refresh the
+    collection's ``summaries`` field unless another writer owns the collection document.  This is a
+    read-modify-write, it's only called by ``compact_summaries``.
+    """
+    summaries_key = posixpath.join(posixpath.dirname(key), SUMMARIES_NAME)
+    current = Summary(get_json(bucket, summaries_key)).merge(summary)
+    put_json(bucket, summaries_key, current.to_dict())
+
+    if collection:
+        data = get_json(bucket, key)
+        if data is not None:
+            data['summaries'] = current.stac_summaries()
+            put_json(bucket, key, data)
+    return current
+
+
+class SummaryLog(object):
+
+    """
+    Partial summaries of the items written by one worker.  Each ``flush`` writes the aggregates built since the
+    last one as a segment under ``<prefix>/_summaries/<worker>/``, and ``compact_summaries`` adds the segments
+    into the collections, so ingesting processes never read-modify-write the shared summaries documents.  A segment written
+    under a ``name`` replaces the previous one of that name, which keeps retried jobs from being counted twice.
+    """
+
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.worker = worker_id()
+        self.segment = 0
+        self.summaries = {}
+
+    def add(self, summaries):
+        for coll_id, summary in summaries.items():
+            self.summaries.setdefault(coll_id, Summary()).merge(summary)
+
+    def flush(self, name=None):
+        if not self.summaries:
+            return
+        if name:
+            key = posixpath.join(self.prefix, SUMMARY_LOG_PREFIX, 'named', name + '.json')
+        else:
+            key = posixpath.join(self.prefix, SUMMARY_LOG_PREFIX, self.worker, '{:08d}.json'.format(self.segment))
+            self.segment += 1
+        put_json(self.bucket, key, {k: v.to_dict() for k, v in self.summaries.items()})
+        self.summaries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+def compact_summaries(bucket, prefix, collection=True):
+    """
+    Merge the partial summaries written by workers below ``prefix`` into their collections.  Like ``compact``
+    this must only run in one process at a time.  ``collection`` is off when another writer owns the
+    collection documents.
+    """
+    segments = list(list_segments(bucket, prefix, SUMMARY_LOG_PREFIX))
+    if not segments:
+        return {}
+
+    merged = {}
+    for key in segments:
+        for coll_id, data in (get_json(bucket, key) or {}).items():
+            merged.setdefault(coll_id, Summary()).merge(Summary(data))
+    for coll_id, summary in merged.items():
+        update_collection(bucket, posixpath.join(prefix, coll_id, 'catalog.json'), summary, collection)
+
+    for idx in range(0, len(segments), 1000):
+        s3_call('delete_objects', Bucket=bucket,
+                Delete={'Objects': [{'Key': k} for k in segments[idx:idx + 1000]], 'Quiet': True})
+    print("Merged {} summary segments into {} collections.".format(len(segments), len(merged)))
+    return merged
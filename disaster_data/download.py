@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 64 * 1024 * 1024))
+CONNECTIONS_PER_FILE = int(os.environ.get("DOWNLOAD_CONNECTIONS", 8))
+MAX_CONNECTIONS = int(os.environ.get("DOWNLOAD_MAX_CONNECTIONS", 32))
+# Bytes per second shared by every download in the process, 0 means unlimited
+MAX_BANDWIDTH = int(os.environ.get("DOWNLOAD_MAX_BANDWIDTH", 0))
+READ_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 30
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Bandwidth(object):
+
+    """Token bucket shared by all connections in the process"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount or self.tokens >= self.rate:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+bandwidth = Bandwidth(MAX_BANDWIDTH)
+
+
+def remote_size(url, session=None):
+    """
+    Return (content length, supports byte ranges) from a HEAD request.
+    """
+    session = session or requests
+    r = session.head(url, allow_redirects=True)
+    r.raise_for_status()
+    length = r.headers.get('Content-Length')
+    ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return (int(length) if length is not None else None), ranges
+
+
+class Progress(object):
+
+    def __init__(self, url, total, done=0):
+        self.url = url
+        self.total = total
+        self.done = done
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.lock = threading.Lock()
+
+    def update(self, amount):
+        with self.lock:
+            self.done += amount
+            now = time.monotonic()
+            if now - self.reported < PROGRESS_INTERVAL:
+                return
+            self.reported = now
+        self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        pct = 100.0 * self.done / self.total if self.total else 0
+        print("Downloaded {:.1f}% of {} ({:.1f} MB/s)".format(pct, self.url, self.done / elapsed / 1e6))
+
+
+class Download(object):
+
+    """
+    Download a single remote file over several concurrent byte-range connections.
+
+    Chunks are written in place to ``<outfile>.part`` and completed chunks are recorded in
+    ``<outfile>.part.json`` so an interrupted download resumes where it left off.
+    """
+
+    def __init__(self, url, outfile, connections=CONNECTIONS_PER_FILE, chunk_size=CHUNK_SIZE):
+        self.url = url
+        self.outfile = outfile
+        self.partfile = outfile + '.part'
+        self.statefile = self.partfile + '.json'
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+
+    def load_state(self, size):
+        if os.path.exists(self.statefile) and os.path.exists(self.partfile):
+            with open(self.statefile, 'r') as f:
+                state = json.load(f)
+            if state['url'] == self.url and state['size'] == size and state['chunk_size'] == self.chunk_size:
+                return state
+        return {'url': self.url, 'size': size, 'chunk_size': self.chunk_size, 'completed': []}
+
+    def save_state(self, state):
+        tmp = self.statefile + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.statefile)
+
+    def fetch_chunk(self, index, size, state, progress):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size) - 1
+        with connection_slots:
+            r = self.session.get(self.url, headers={'Range': f'bytes={start}-{end}'}, stream=True)
+            if r.status_code != 206:
+                raise DownloadError(f"Expected partial content for {self.url}, received HTTP {r.status_code}")
+            written = 0
+            with open(self.partfile, 'r+b') as f:
+                f.seek(start)
+                for block in r.iter_content(READ_SIZE):
+                    bandwidth.consume(len(block))
+                    f.write(block)
+                    written += len(block)
+                    progress.update(len(block))
+        if written != end - start + 1:
+            progress.update(-written)
+            raise DownloadError(f"Chunk {index} of {self.url} is truncated ({written} of {end - start + 1} bytes)")
+        with self.lock:
+            state['completed'].append(index)
+            self.save_state(state)
+
+    def fetch_ranges(self, size):
+        state = self.load_state(size)
+        if not os.path.exists(self.partfile) or not state['completed']:
+            with open(self.partfile, 'wb') as f:
+                f.truncate(size)
+            state['completed'] = []
+            self.save_state(state)
+
+        chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+        completed = set(state['completed'])
+        remaining = [x for x in range(chunk_count) if x not in completed]
+        done = sum(min(self.chunk_size, size - x * self.chunk_size) for x in state['completed'])
+        if done:
+            print("Resuming download of {} at {} bytes".format(self.url, done))
+        progress = Progress(self.url, size, done)
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            futures = [executor.submit(self.fetch_chunk, x, size, state, progress) for x in remaining]
+            for future in futures:
+                future.result()
+        progress.report()
+
+    def fetch_stream(self, size):
+        """Fallback for servers which do not support byte ranges"""
+        progress = Progress(self.url, size)
+        with connection_slots:
+            r = self.session.get(self.url, stream=True)
+            r.raise_for_status()
+            with open(self.partfile, 'wb') as f:
+                for block in r.iter_content(READ_SIZE):
+                    bandwidth.consume(len(block))
+                    f.write(block)
+                    progress.update(len(block))
+        progress.report()
+
+    def run(self):
+        if os.path.exists(self.outfile):
+            print("Found existing download: {}".format(self.outfile))
+            return self.outfile
+
+        size, ranges = remote_size(self.url, self.session)
+        if size and ranges:
+            self.fetch_ranges(size)
+        else:
+            self.fetch_stream(size)
+
+        # Verify against Content-Length before exposing the file
+        actual = os.path.getsize(self.partfile)
+        if size is not None and actual != size:
+            raise DownloadError(f"Size mismatch for {self.url}: expected {size} bytes, found {actual}")
+        os.replace(self.partfile, self.outfile)
+        if os.path.exists(self.statefile):
+            os.unlink(self.statefile)
+        return self.outfile
+
+
+def download(url, out_dir, connections=CONNECTIONS_PER_FILE):
+    """
+    Download ``url`` into ``out_dir``, returning the local path
+    """
+    outfile = os.path.join(out_dir, os.path.basename(url))
+    return Download(url, outfile, connections=connections).run()
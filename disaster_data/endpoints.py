@@ -0,0 +1,247 @@
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+RETRYABLE_AWS_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequestsException', 'SlowDown',
+                       'RequestLimitExceeded', 'ServiceUnavailable', 'InternalError', 'RequestTimeout')
+
+DEFAULTS = {
+    'rate': 20.0,
+    'burst': 20,
+    'max_concurrency': 32,
+    'min_concurrency': 1,
+    'initial_concurrency': 8,
+    'target_latency': 2.0,
+    'retries': 4,
+    'backoff_base': 0.5,
+    'backoff_max': 30.0,
+    'failure_threshold': 10,
+    'reset_timeout': 30.0,
+}
+
+# Per-endpoint overrides of DEFAULTS
+ENDPOINTS = {
+    'api.discover.digitalglobe.com': {'rate': 10.0, 'burst': 10, 'max_concurrency': 16},
+    'api.openaerialmap.org': {'rate': 2.0, 'burst': 2, 'max_concurrency': 4},
+    's3': {'rate': 200.0, 'burst': 200, 'max_concurrency': 128, 'target_latency': 1.0},
+    'lambda': {'rate': 100.0, 'burst': 100, 'max_concurrency': 64, 'target_latency': 1.0},
+    'sqs': {'rate': 100.0, 'burst': 100, 'max_concurrency': 64, 'target_latency': 1.0},
+}
+
+# Number of processes the limits of every endpoint are split between, see ``share``
+processes = 1
+
+
+class RetryableError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_retryable(e):
+    if isinstance(e, RetryableError):
+        return True
+    name = type(e).__name__
+    # requests and botocore connection failures, matched by name so neither has to be imported here
+    if name in ('ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ChunkedEncodingError',
+                'EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError'):
+        return True
+    if name == 'ClientError':
+        error = getattr(e, 'response', {}).get('Error', {})
+        status = getattr(e, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return error.get('Code') in RETRYABLE_AWS_CODES or status in RETRYABLE_STATUS
+    return False
+
+
+def check_response(r):
+    """Raise RetryableError for throttled or failed HTTP responses, return the response otherwise"""
+    if r.status_code in RETRYABLE_STATUS:
+        raise RetryableError(f"HTTP {r.status_code} from {r.url}")
+    return r
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker(object):
+
+    """Open after ``failure_threshold`` consecutive failures, allow a trial call after ``reset_timeout``"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.reset_timeout:
+                # Half open, let one call through and re-open on failure
+                self.opened = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+
+
+class EndpointController(object):
+
+    """
+    Adaptive concurrency and retry control for an external endpoint (DG api, OpenAerialMap, NOAA servers, S3,
+    Lambda, SQS).
+
+    Calls pass through a token bucket limiting the request rate and an AIMD concurrency limit driven by observed
+    latency and errors.  Retryable failures are retried with jittered exponential backoff, and a circuit breaker
+    fails fast while the endpoint is down.  Controllers are per process, processes running side by side
+    each get an equal share of the limits (see ``share``).
+    """
+
+    def __init__(self, name, **kwargs):
+        config = dict(DEFAULTS, **ENDPOINTS.get(name, {}))
+        config.update(kwargs)
+        if processes > 1:
+            config['rate'] = config['rate'] / processes
+            for key in ('burst', 'max_concurrency', 'initial_concurrency'):
+                config[key] = max(1, int(config[key]) // processes)
+            config['min_concurrency'] = min(config['min_concurrency'], config['max_concurrency'])
+        self.name = name
+        self.config = config
+        self.bucket = TokenBucket(config['rate'], config['burst'])
+        self.breaker = CircuitBreaker(config['failure_threshold'], config['reset_timeout'])
+        self.limit = float(config['initial_concurrency'])
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.stats = {'calls': 0, 'errors': 0, 'retries': 0}
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, ok):
+        with self.condition:
+            self.in_flight -= 1
+            # Additive increase of one slot per window of healthy calls, multiplicative decrease on trouble
+            if ok and latency <= self.config['target_latency']:
+                self.limit = min(self.config['max_concurrency'], self.limit + 1.0 / self.limit)
+            elif not ok or latency > 2 * self.config['target_latency']:
+                self.limit = max(self.config['min_concurrency'], self.limit / 2)
+            self.condition.notify_all()
+
+    def count(self, key):
+        with self.condition:
+            self.stats[key] += 1
+
+    def backoff(self, attempt):
+        ceiling = min(self.config['backoff_max'], self.config['backoff_base'] * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call ``fn`` within the limits of this endpoint, retrying retryable failures with jittered backoff.
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for endpoint {self.name}")
+            self.bucket.acquire()
+            self.acquire()
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                # Only failures of the endpoint itself should back off concurrency
+                self.release(time.monotonic() - started, not retryable)
+                self.count('errors')
+                if not retryable:
+                    raise
+                self.breaker.failure()
+                if attempt >= self.config['retries']:
+                    raise
+                self.count('retries')
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.release(time.monotonic() - started, True)
+            self.breaker.success()
+            self.count('calls')
+            return result
+
+
+controllers = {}
+controllers_lock = threading.Lock()
+
+
+def endpoint(name):
+    """Return the shared controller for an endpoint, keyed by AWS service name or host"""
+    with controllers_lock:
+        if name not in controllers:
+            controllers[name] = EndpointController(name)
+        return controllers[name]
+
+
+def share(n):
+    """
+    Split the limits of every endpoint between ``n`` processes.  Called by each of ``n`` worker processes
+    before its first call, so together they stay within the limits of a single process.  Controllers inherited
+    from the parent are dropped.
+    """
+    global processes
+    with controllers_lock:
+        processes = n
+        controllers.clear()
+
+
+def host(url):
+    """
+    Endpoint name of a URL, including /vsicurl/ paths.  URLs read through the range cache are keyed on the
+    cache, which limits its misses with the controller of the remote host itself.
+    """
+    if '/vsicurl/' in url:
+        url = url.split('/vsicurl/', 1)[-1]
+    parsed = urlparse(url)
+    return parsed.netloc or url
+
+
+def request(method, url, **kwargs):
+    """Make an HTTP request through the controller of the remote host"""
+    import requests
+
+    return endpoint(host(url)).call(lambda: check_response(requests.request(method, url, **kwargs)))
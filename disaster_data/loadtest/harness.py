@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from disaster_data.catalog.server import ThreadingHTTPServer
+from disaster_data.loadtest.site import FakeSite
+from disaster_data.loadtest.services import (Request, Response, NoaaStormSite, DGOpenDataSite, DGImageServer,
+                                             ObjectStore, S3Service, BucketWebsite, LambdaService, SQSService,
+                                             AWSServices)
+
+CATALOG_BUCKET = 'cognition-disaster-data'
+PERCENTILES = (50, 90, 99)
+# Production endpoints whose rate and concurrency limits apply to the stand-ins replacing them
+ENDPOINT_CONFIGS = {
+    'dg-api': 'api.discover.digitalglobe.com',
+    'bucket': 's3',
+}
+
+
+class Stats(object):
+
+    """Request counts, bytes and latencies per service group, as seen by the stand-ins"""
+
+    def __init__(self):
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def record(self, group, status, latency, received, sent, injected=False):
+        with self.lock:
+            entry = self.groups.setdefault(group, {
+                'requests': 0, 'injected_errors': 0, 'status': {}, 'bytes_received': 0, 'bytes_sent': 0,
+                'latencies': []
+            })
+            entry['requests'] += 1
+            entry['injected_errors'] += int(injected)
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+            entry['bytes_received'] += received
+            entry['bytes_sent'] += sent
+            entry['latencies'].append(latency)
+
+    def report(self):
+        out = {}
+        with self.lock:
+            for group, entry in sorted(self.groups.items()):
+                latencies = np.asarray(entry['latencies']) * 1000
+                out[group] = dict({k: v for k, v in entry.items() if k != 'latencies'}, latency_ms=dict(
+                    {'p{}'.format(p): round(float(np.percentile(latencies, p)), 1) for p in PERCENTILES},
+                    max=round(float(latencies.max()), 1)
+                ))
+        return out
+
+
+class Faults(object):
+
+    """
+    Latency and error injection per stand-in (noaa, dg, dg-api, aws, bucket).  Latency is drawn from an
+    exponential distribution around the configured mean.  Errors are answered with HTTP 503 (SlowDown for S3)
+    before the request reaches the stand-in, so they have no side effects and every client retries them.
+    """
+
+    def __init__(self, latency=None, error_rate=None, seed=0):
+        self.latency = latency or {}
+        self.error_rate = error_rate or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def setting(self, settings, group):
+        return settings.get(group, settings.get('*', 0))
+
+    def delay(self, group):
+        mean = self.setting(self.latency, group)
+        if mean:
+            with self.lock:
+                seconds = self.random.expovariate(1.0 / mean)
+            time.sleep(seconds)
+
+    def fail(self, group):
+        rate = self.setting(self.error_rate, group)
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+
+def error_response(name):
+    if name in ('aws', 'bucket'):
+        return Response(503, {'Content-Type': 'application/xml'},
+                        b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>SlowDown</Code>'
+                        b'<Message>Injected error</Message></Error>')
+    return Response(503, {'Content-Type': 'text/plain', 'Retry-After': '1'}, b'Injected error')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    name = None
+    router = None
+    stats = None
+    faults = None
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def handle_request(self):
+        started = time.monotonic()
+        url = urlparse(self.path)
+        body = self.read_body()
+        query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        request = Request(self.command, url.path, query, self.headers, body)
+        self.faults.delay(self.name)
+        injected = self.faults.fail(self.name)
+        if injected:
+            group, response = self.name, error_response(self.name)
+        else:
+            group, response = self.router(request)
+
+        self.send_response(response.status)
+        for k, v in response.headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(response.body)))
+        self.end_headers()
+        sent = 0
+        if self.command != 'HEAD':
+            self.wfile.write(response.body)
+            sent = len(response.body)
+        self.stats.record(group, response.status, time.monotonic() - started, len(body), sent, injected)
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn(object):
+
+    """One stand-in HTTP server on an ephemeral port"""
+
+    def __init__(self, name, router, stats, faults, host='127.0.0.1'):
+        handler = type('Handler', (StandInHandler,), {'name': name, 'router': staticmethod(router), 'stats': stats,
+                                                      'faults': faults})
+        self.server = ThreadingHTTPServer((host, 0), handler)
+        self.url = 'http://{}:{}'.format(*self.server.server_address)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LoadTest(object):
+
+    """
+    Local stand-ins for NOAA Storm, DG Open Data, the DG ImageServer, S3, Lambda and SQS, configured so the real
+    index flows run against them unchanged.
+    """
+
+    def __init__(self, events=100, archives_per_event=2, tiles_per_archive=4, items_per_event=10, latency=None,
+                 error_rate=None, seed=0):
+        self.site = FakeSite(events, archives_per_event, tiles_per_archive, items_per_event)
+        self.store = ObjectStore()
+        self.stats = Stats()
+        self.faults = Faults(latency, error_rate, seed)
+        self.lambda_ = LambdaService(self.store, CATALOG_BUCKET)
+        self.sqs = SQSService()
+        self.servers = {}
+
+    def start(self):
+        routers = {
+            'noaa': NoaaStormSite(self.site),
+            'dg': DGOpenDataSite(self.site),
+            'dg-api': DGImageServer(self.site),
+            'aws': AWSServices(S3Service(self.store), self.lambda_, self.sqs),
+            'bucket': BucketWebsite(self.store, CATALOG_BUCKET),
+        }
+        for name, router in routers.items():
+            self.servers[name] = StandIn(name, router, self.stats, self.faults).start()
+        self.site.base_urls = {name: server.url for name, server in self.servers.items()}
+        self.sqs.base_url = self.servers['aws'].url
+
+        for key, body in self.site.catalog_seed(self.servers['bucket'].url).items():
+            self.store.put(CATALOG_BUCKET, key, body, 'application/json')
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def configure(self, data_dir):
+        """
+        Point the index flows at the stand-ins.  Must run before any source module is imported, their endpoints
+        are read into module constants.
+        """
+        from disaster_data import endpoints
+
+        os.environ.update({
+            'NOAA_STORM_URL': self.servers['noaa'].url + '/',
+            'DG_OPEN_DATA_URL': self.servers['dg'].url + '/ecosystem/open-data',
+            'DG_API_URL': self.servers['dg-api'].url + '/v1/services/ImageServer/query',
+            'CATALOG_ROOT_URL': self.servers['bucket'].url,
+            'AWS_ENDPOINT_URL': self.servers['aws'].url,
+            'DATA_DIR': data_dir.rstrip('/') + '/',
+        })
+        for name, value in (('DG_API_KEY', 'loadtest'), ('AWS_ACCESS_KEY_ID', 'loadtest'),
+                            ('AWS_SECRET_ACCESS_KEY', 'loadtest'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+            os.environ.setdefault(name, value)
+        for name, config in ENDPOINT_CONFIGS.items():
+            endpoints.ENDPOINTS[self.servers[name].url.split('//', 1)[1]] = endpoints.ENDPOINTS[config]
+
+    def changes(self):
+        """Items added and updated by the change feed segments published so far"""
+        obj = self.store.get(CATALOG_BUCKET, 'changes.json')
+        if obj is None:
+            return 0, 0
+        segments = json.loads(obj[0])['segments']
+        return len(segments), sum(x['added'] + x['updated'] for x in segments)
+
+    def report(self, flow, seconds, items):
+        from disaster_data.endpoints import controllers
+        from disaster_data.memory import monitor
+
+        services = self.stats.report()
+        return {
+            'flow': flow,
+            'seconds': round(seconds, 1),
+            'items': items,
+            'items_per_second': round(items / seconds, 2) if seconds else None,
+            'bytes_sent': sum(x['bytes_sent'] for x in services.values()),
+            'bytes_received': sum(x['bytes_received'] for x in services.values()),
+            'services': services,
+            'stages': [{'stage': x['stage'], 'seconds': x['seconds']} for x in monitor().report()['stages']],
+            'endpoints': {name: dict(x.stats) for name, x in controllers.items()},
+            'lambda_invocations': dict(self.lambda_.invocations),
+        }
+
+
+def run_flow(flow, test, num_threads, writer, cog):
+    # Imported only now, the modules read the stand-in urls when they're first imported
+    if flow == 'noaa-storm':
+        from disaster_data.sources.noaa_storm.utils import build_stac_catalog
+
+        build_stac_catalog(test.site.noaa_events(), cog=cog)
+    else:
+        from disaster_data.sources.dg_open_data.utils import build_outputs
+
+        build_outputs(test.site.dg_events(), outputs=('catalog',), num_threads=num_threads, writer=writer)
+        if writer == 'log':
+            from disaster_data.catalog.links import compact
+            from disaster_data.catalog.summaries import compact_summaries
+            from disaster_data.catalog.changes import ChangeFeed
+
+            # Ingestion leaves its links and summaries in logs, compact-catalog merges them
+            feed = ChangeFeed(CATALOG_BUCKET, 'dg-open-data')
+            compact(CATALOG_BUCKET, 'DGOpenData', feed=feed)
+            compact_summaries(CATALOG_BUCKET, 'DGOpenData')
+            feed.publish()
+
+
+def print_report(report):
+    print("{flow}: {items} items in {seconds}s ({items_per_second} items/s), {mb_sent:.1f} MB served, "
+          "{mb_received:.1f} MB received".format(mb_sent=report['bytes_sent'] / 1e6,
+                                                  mb_received=report['bytes_received'] / 1e6, **report))
+    print("  {:<16} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+        'service', 'requests', 'errors', 'MB sent', 'p50 ms', 'p90 ms', 'p99 ms'))
+    for name, entry in report['services'].items():
+        print("  {:<16} {:>8} {:>7} {:>10.1f} {:>9} {:>9} {:>9}".format(
+            name, entry['requests'], entry['injected_errors'], entry['bytes_sent'] / 1e6,
+            entry['latency_ms']['p50'], entry['latency_ms']['p90'], entry['latency_ms']['p99']))
+    for stage in report['stages']:
+        print("  stage {:<24} {:>8}s".format(stage['stage'], stage['seconds']))
+
+
+def run_load_test(flow='dg-open-data', events=100, archives_per_event=2, tiles_per_archive=4, items_per_event=10,
+                  latency=None, error_rate=None, num_threads=10, writer='log', cog=False, data_dir=None,
+                  report_file=None, seed=0):
+    """
+    Run an index flow end to end against generated sites and AWS stand-ins, reporting items/sec, bytes
+    transferred and per-service latency percentiles.  ``latency`` and ``error_rate`` map stand-ins (or ``*``)
+    to a mean latency in seconds and a fraction of requests failed.
+    """
+    test = LoadTest(events, archives_per_event, tiles_per_archive, items_per_event, latency, error_rate, seed).start()
+    # Only a directory created here is removed afterwards
+    scratch = tempfile.mkdtemp(prefix='loadtest-data-') if data_dir is None else None
+    data_dir = data_dir or scratch
+    test.configure(data_dir)
+    print("Stand-ins: " + ', '.join('{} {}'.format(k, v.url) for k, v in test.servers.items()))
+
+    started = time.monotonic()
+    try:
+        run_flow(flow, test, num_threads, writer, cog)
+    finally:
+        seconds = time.monotonic() - started
+        test.stop()
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    segments, items = test.changes()
+    if not segments:
+        print("No change feed segment was published, the flow didn't complete any items.")
+    report = test.report(flow, seconds, items)
+    print_report(report)
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
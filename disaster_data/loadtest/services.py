@@ -0,0 +1,424 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+from urllib.parse import parse_qs, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from disaster_data.queues import SQLiteQueue, Message
+from disaster_data.catalog.links import item_key
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers', 'body'])
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+ACCOUNT_ID = '000000000000'
+SQS_NAMESPACE = 'http://queue.amazonaws.com/doc/2012-11-05/'
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+LIST_PAGE_SIZE = 1000
+
+
+def html(text):
+    return Response(200, {'Content-Type': 'text/html; charset=utf-8'}, text.encode('utf-8'))
+
+
+def as_json(data, status=200):
+    return Response(status, {'Content-Type': 'application/json'}, json.dumps(data).encode('utf-8'))
+
+
+def xml(text, status=200):
+    return Response(status, {'Content-Type': 'application/xml'},
+                    ('<?xml version="1.0" encoding="UTF-8"?>' + text).encode('utf-8'))
+
+
+def not_found():
+    return Response(404, {'Content-Type': 'text/plain'}, b'Not found')
+
+
+def serve_bytes(request, data, content_type, etag=None):
+    """Full or single byte range response, which is all GDAL's /vsicurl and the downloader need"""
+    headers = {'Content-Type': content_type, 'Accept-Ranges': 'bytes'}
+    if etag:
+        headers['ETag'] = etag
+    match = re.match(r'bytes=(\d*)-(\d*)$', request.headers.get('Range', ''))
+    if match and data:
+        start, end = match.groups()
+        if start:
+            start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+        else:
+            start, end = max(0, len(data) - int(end)), len(data) - 1
+        if start >= len(data) or start > end:
+            return Response(416, {'Content-Range': 'bytes */{}'.format(len(data))}, b'')
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(data))
+        return Response(206, headers, data[start:end + 1])
+    return Response(200, headers, data)
+
+
+class NoaaStormSite(object):
+
+    def __init__(self, site):
+        self.site = site
+
+    def __call__(self, request):
+        parts = [x for x in request.path.split('/') if x]
+        if not parts:
+            return 'noaa-pages', html(self.site.noaa_index())
+        if parts[0] == 'archives' and len(parts) == 3:
+            data = self.site.archive(parts[1], parts[2])
+            if data is None:
+                return 'noaa-archives', not_found()
+            return 'noaa-archives', serve_bytes(request, data, 'application/x-tar')
+        if len(parts) == 2 and parts[1] == 'index.html':
+            return 'noaa-pages', html(self.site.noaa_event(parts[0]))
+        if len(parts) == 2 and parts[1] == 'metadata.html':
+            return 'noaa-pages', html(self.site.fgdc(parts[0]))
+        return 'noaa-pages', not_found()
+
+
+class DGOpenDataSite(object):
+
+    def __init__(self, site):
+        self.site = site
+
+    def __call__(self, request):
+        parts = [x for x in request.path.split('/') if x]
+        if parts[:1] == ['imagery']:
+            return 'dg-imagery', serve_bytes(request, self.site.template('tif'), 'image/tiff')
+        if parts == ['ecosystem', 'open-data']:
+            return 'dg-pages', html(self.site.dg_index())
+        if len(parts) == 3 and parts[:2] == ['ecosystem', 'open-data']:
+            return 'dg-pages', html(self.site.dg_event(parts[2]))
+        return 'dg-pages', not_found()
+
+
+class DGImageServer(object):
+
+    def __init__(self, site):
+        self.site = site
+
+    def __call__(self, request):
+        if request.method != 'POST':
+            return 'dg-api', not_found()
+        return 'dg-api', as_json(self.site.image_server(request.body))
+
+
+class ObjectStore(object):
+
+    """In-memory buckets shared by the S3 API and the public bucket endpoint"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, body, content_type='binary/octet-stream'):
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        with self.lock:
+            self.objects[(bucket, key)] = (body, content_type, etag)
+        return etag
+
+    def get(self, bucket, key):
+        with self.lock:
+            return self.objects.get((bucket, key))
+
+    def delete(self, bucket, key):
+        with self.lock:
+            self.objects.pop((bucket, key), None)
+
+    def list(self, bucket, prefix=''):
+        with self.lock:
+            return sorted(k for b, k in self.objects if b == bucket and k.startswith(prefix))
+
+
+def s3_error(code, status, message=''):
+    return xml('<Error><Code>{}</Code><Message>{}</Message></Error>'.format(code, escape(message)), status=status)
+
+
+def decode_aws_chunked(body):
+    """Strip the chunk framing botocore adds to streamed uploads"""
+    out = []
+    pos = 0
+    while pos < len(body):
+        end = body.index(b'\r\n', pos)
+        size = int(body[pos:end].split(b';')[0], 16)
+        if size == 0:
+            break
+        out.append(body[end + 2:end + 2 + size])
+        pos = end + 2 + size + 2
+    return b''.join(out)
+
+
+class S3Service(object):
+
+    """Path-style S3 API covering the calls made by the catalog writers, compaction and uploads"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self, request):
+        bucket, _, key = request.path.lstrip('/').partition('/')
+        key = unquote(key)
+        body = request.body
+        if (request.headers.get('x-amz-content-sha256', '').startswith('STREAMING-') or
+                'aws-chunked' in request.headers.get('Content-Encoding', '')):
+            body = decode_aws_chunked(body)
+
+        if not key:
+            if request.method == 'GET':
+                return 's3', self.list_objects(bucket, request.query)
+            if request.method == 'POST' and 'delete' in request.query:
+                return 's3', self.delete_objects(bucket, body)
+            # CreateBucket and friends
+            return 's3', Response(200, {}, b'')
+
+        if request.method == 'PUT' and 'uploadId' in request.query:
+            upload = self.store.uploads.get(request.query['uploadId'])
+            if upload is None:
+                return 's3', s3_error('NoSuchUpload', 404)
+            upload[int(request.query['partNumber'])] = body
+            return 's3', Response(200, {'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}, b'')
+        if request.method == 'PUT':
+            etag = self.store.put(bucket, key, body, request.headers.get('Content-Type', 'binary/octet-stream'))
+            return 's3', Response(200, {'ETag': etag}, b'')
+        if request.method == 'POST' and 'uploads' in request.query:
+            upload_id = uuid.uuid4().hex
+            self.store.uploads[upload_id] = {'content_type': request.headers.get('Content-Type')}
+            return 's3', xml(
+                '<InitiateMultipartUploadResult xmlns="{}"><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId>'
+                '</InitiateMultipartUploadResult>'.format(S3_NAMESPACE, bucket, escape(key), upload_id))
+        if request.method == 'POST' and 'uploadId' in request.query:
+            upload = self.store.uploads.pop(request.query['uploadId'], None)
+            if upload is None:
+                return 's3', s3_error('NoSuchUpload', 404)
+            content_type = upload.pop('content_type') or 'binary/octet-stream'
+            etag = self.store.put(bucket, key, b''.join(upload[x] for x in sorted(upload)), content_type)
+            return 's3', xml(
+                '<CompleteMultipartUploadResult xmlns="{}"><Bucket>{}</Bucket><Key>{}</Key><ETag>{}</ETag>'
+                '</CompleteMultipartUploadResult>'.format(S3_NAMESPACE, bucket, escape(key), escape(etag)))
+        if request.method == 'DELETE':
+            self.store.delete(bucket, key)
+            return 's3', Response(204, {}, b'')
+        if request.method in ('GET', 'HEAD'):
+            obj = self.store.get(bucket, key)
+            if obj is None:
+                return 's3', s3_error('NoSuchKey', 404, key)
+            return 's3', serve_bytes(request, obj[0], obj[1], obj[2])
+        return 's3', s3_error('NotImplemented', 501)
+
+    def list_objects(self, bucket, query):
+        prefix = query.get('prefix', '')
+        keys = self.store.list(bucket, prefix)
+        start = query.get('continuation-token') or query.get('start-after') or ''
+        keys = [x for x in keys if x > start]
+        limit = min(int(query.get('max-keys', LIST_PAGE_SIZE)), LIST_PAGE_SIZE)
+        page, truncated = keys[:limit], len(keys) > limit
+        contents = ''
+        for key in page:
+            obj = self.store.get(bucket, key)
+            if obj:
+                contents += '<Contents><Key>{}</Key><Size>{}</Size><ETag>{}</ETag></Contents>'.format(
+                    escape(key), len(obj[0]), escape(obj[2]))
+        token = '<NextContinuationToken>{}</NextContinuationToken>'.format(escape(page[-1])) if truncated else ''
+        return xml(
+            '<ListBucketResult xmlns="{}"><Name>{}</Name><Prefix>{}</Prefix><KeyCount>{}</KeyCount>'
+            '<MaxKeys>{}</MaxKeys><IsTruncated>{}</IsTruncated>{}{}</ListBucketResult>'.format(
+                S3_NAMESPACE, bucket, escape(prefix), len(page), limit, 'true' if truncated else 'false', token,
+                contents))
+
+    def delete_objects(self, bucket, body):
+        root = ElementTree.fromstring(body)
+        deleted = ''
+        for element in root.iter():
+            if element.tag.endswith('Key'):
+                self.store.delete(bucket, element.text)
+                deleted += '<Deleted><Key>{}</Key></Deleted>'.format(escape(element.text))
+        return xml('<DeleteResult xmlns="{}">{}</DeleteResult>'.format(S3_NAMESPACE, deleted))
+
+
+class BucketWebsite(object):
+
+    """Public https://<bucket>.s3.amazonaws.com/<key> reads of one bucket, used for catalog and manifest reads"""
+
+    def __init__(self, store, bucket):
+        self.store = store
+        self.bucket = bucket
+
+    def __call__(self, request):
+        obj = self.store.get(self.bucket, unquote(request.path.lstrip('/')))
+        if obj is None:
+            return 'catalog-reads', not_found()
+        return 'catalog-reads', serve_bytes(request, obj[0], obj[1], obj[2])
+
+
+class LambdaService(object):
+
+    """
+    Accepts invocations and counts them per function, the way stac-updater is kicked off.  Like stac-updater,
+    the item sent is written below ``prefix`` of ``bucket`` (links are left to the real Lambda).
+    """
+
+    def __init__(self, store, bucket, prefix='DGOpenData'):
+        self.store = store
+        self.bucket = bucket
+        self.prefix = prefix
+        self.invocations = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        match = re.match(r'/2015-03-31/functions/([^/]+)/invocations', request.path)
+        if not match or request.method != 'POST':
+            return 'lambda', not_found()
+        name = unquote(match.group(1))
+        with self.lock:
+            self.invocations[name] = self.invocations.get(name, 0) + 1
+        item = json.loads(request.body.decode('utf-8'))
+        self.store.put(self.bucket, item_key(item, self.prefix), json.dumps(item).encode('utf-8'), 'application/json')
+        if request.headers.get('X-Amz-Invocation-Type') == 'Event':
+            return 'lambda', Response(202, {}, b'')
+        return 'lambda', Response(200, {'Content-Type': 'application/json'}, b'null')
+
+
+def md5(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class SQSService(object):
+
+    """
+    SQS stand-in speaking both the JSON and the query protocol, with queues backed by the SQLite queue used
+    for local workers.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.tempdir = tempfile.mkdtemp(prefix='loadtest-sqs-')
+
+    def queue(self, name):
+        with self.lock:
+            if name not in self.queues:
+                self.queues[name] = SQLiteQueue(os.path.join(self.tempdir, name + '.db'))
+            return self.queues[name]
+
+    def queue_url(self, name):
+        return '{}/{}/{}'.format(self.base_url, ACCOUNT_ID, name)
+
+    def __call__(self, request):
+        target = request.headers.get('X-Amz-Target', '')
+        if target.startswith('AmazonSQS.'):
+            params = json.loads(request.body or b'{}')
+            result = self.dispatch(target.split('.', 1)[1], params, request.path)
+            return 'sqs', Response(200, {'Content-Type': 'application/x-amz-json-1.0'},
+                                   json.dumps(result).encode('utf-8'))
+
+        form = {k: v[-1] for k, v in parse_qs(request.body.decode('utf-8')).items()}
+        form.update(request.query)
+        action = form.pop('Action', None)
+        if not action:
+            return 'sqs', not_found()
+        result = self.dispatch(action, self.query_params(action, form), request.path)
+        return 'sqs', xml(self.query_response(action, result))
+
+    def query_params(self, action, form):
+        """Convert flattened query protocol parameters into the JSON protocol shape"""
+        params = {k: v for k, v in form.items() if '.' not in k}
+        if action == 'SendMessageBatch':
+            entries = {}
+            for k, v in form.items():
+                match = re.match(r'SendMessageBatchRequestEntry\.(\d+)\.(\w+)$', k)
+                if match:
+                    entries.setdefault(int(match.group(1)), {})[match.group(2)] = v
+            params['Entries'] = [entries[x] for x in sorted(entries)]
+        for int_param in ('MaxNumberOfMessages', 'WaitTimeSeconds', 'VisibilityTimeout'):
+            if int_param in params:
+                params[int_param] = int(params[int_param])
+        return params
+
+    def dispatch(self, action, params, path):
+        if action in ('CreateQueue', 'GetQueueUrl'):
+            self.queue(params['QueueName'])
+            return {'QueueUrl': self.queue_url(params['QueueName'])}
+
+        name = (params.get('QueueUrl') or path).rstrip('/').split('/')[-1]
+        queue = self.queue(name)
+        if action == 'SendMessage':
+            return self.send(queue, [{'Id': '0', 'MessageBody': params['MessageBody']}])['Successful'][0]
+        if action == 'SendMessageBatch':
+            return self.send(queue, params['Entries'])
+        if action == 'ReceiveMessage':
+            messages = queue.receive(max_messages=params.get('MaxNumberOfMessages', 1),
+                                     wait=params.get('WaitTimeSeconds', 0),
+                                     visibility=params.get('VisibilityTimeout', 30))
+            return {'Messages': [
+                {'MessageId': x.id, 'ReceiptHandle': '{}:{}'.format(x.id, x.receipt), 'Body': x.body,
+                 'MD5OfBody': md5(x.body)} for x in messages
+            ]}
+        if action in ('DeleteMessage', 'ChangeMessageVisibility'):
+            id, _, receipt = params['ReceiptHandle'].partition(':')
+            message = Message(id, None, receipt)
+            if action == 'DeleteMessage':
+                queue.ack(message)
+            else:
+                queue.extend(message, int(params['VisibilityTimeout']))
+            return {}
+        if action == 'GetQueueAttributes':
+            return {'Attributes': {'ApproximateNumberOfMessages': str(len(queue))}}
+        raise ValueError("Unsupported SQS action {}".format(action))
+
+    def send(self, queue, entries):
+        # SQLiteQueue assigns its own ids, they're only reported back to the caller
+        queue.send([x['MessageBody'] for x in entries])
+        return {'Successful': [
+            {'Id': x['Id'], 'MessageId': uuid.uuid4().hex, 'MD5OfMessageBody': md5(x['MessageBody'])}
+            for x in entries
+        ], 'Failed': []}
+
+    def query_response(self, action, result):
+        if action == 'SendMessage':
+            inner = '<MessageId>{MessageId}</MessageId><MD5OfMessageBody>{MD5OfMessageBody}</MD5OfMessageBody>'.format(
+                **result)
+        elif action == 'SendMessageBatch':
+            inner = ''.join(
+                '<SendMessageBatchResultEntry><Id>{Id}</Id><MessageId>{MessageId}</MessageId>'
+                '<MD5OfMessageBody>{MD5OfMessageBody}</MD5OfMessageBody></SendMessageBatchResultEntry>'.format(**x)
+                for x in result['Successful'])
+        elif action == 'ReceiveMessage':
+            inner = ''.join(
+                '<Message><MessageId>{}</MessageId><ReceiptHandle>{}</ReceiptHandle><MD5OfBody>{}</MD5OfBody>'
+                '<Body>{}</Body></Message>'.format(x['MessageId'], x['ReceiptHandle'], x['MD5OfBody'],
+                                                   escape(x['Body']))
+                for x in result['Messages'])
+        elif action == 'GetQueueAttributes':
+            inner = ''.join('<Attribute><Name>{}</Name><Value>{}</Value></Attribute>'.format(k, v)
+                            for k, v in result['Attributes'].items())
+        elif 'QueueUrl' in result:
+            inner = '<QueueUrl>{}</QueueUrl>'.format(escape(result['QueueUrl']))
+        else:
+            inner = ''
+        body = '<{0}Result>{1}</{0}Result>'.format(action, inner) if inner else ''
+        return '<{0}Response xmlns="{1}">{2}<ResponseMetadata><RequestId>{3}</RequestId></ResponseMetadata>' \
+               '</{0}Response>'.format(action, SQS_NAMESPACE, body, uuid.uuid4().hex)
+
+
+class AWSServices(object):
+
+    """Route requests of the single AWS endpoint to the S3, Lambda or SQS stand-in"""
+
+    def __init__(self, s3, lambda_, sqs):
+        self.s3 = s3
+        self.lambda_ = lambda_
+        self.sqs = sqs
+
+    def __call__(self, request):
+        if request.path.startswith('/2015-03-31/functions/'):
+            return self.lambda_(request)
+        if (request.headers.get('X-Amz-Target', '').startswith('AmazonSQS.') or
+                request.path.startswith('/{}/'.format(ACCOUNT_ID)) or
+                (request.method == 'POST' and b'Action=' in request.body[:200] and not request.query)):
+            return self.sqs(request)
+        return self.s3(request)
@@ -0,0 +1,285 @@
+import io
+import re
+import json
+import tarfile
+import zlib
+import threading
+from html import escape
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+
+PLATFORMS = ['WV01', 'WV02', 'WV03', 'GE01']
+TILE_SIZE = 256
+# Generated archives kept in memory, each one is rebuilt from the templates when evicted
+ARCHIVE_CACHE_SIZE = 64
+EPOCH = datetime(2017, 8, 1)
+
+
+def event_seed(name):
+    return zlib.crc32(name.encode('utf-8'))
+
+
+def render_tile(driver, bands=3, size=TILE_SIZE, options=None):
+    """Encode a gradient tile with GDAL, georeferenced in WGS84"""
+    import numpy as np
+    from osgeo import gdal, osr
+
+    mem = gdal.GetDriverByName('MEM').Create('', size, size, bands, gdal.GDT_Byte)
+    mem.SetGeoTransform((-80.0, 0.00001, 0, 26.0, 0, -0.00001))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    mem.SetProjection(srs.ExportToWkt())
+    ramp = np.add.outer(np.arange(size), np.arange(size)).astype(np.uint8)
+    for idx in range(bands):
+        mem.GetRasterBand(idx + 1).WriteArray(np.roll(ramp, idx * 32, axis=1))
+
+    path = '/vsimem/loadtest_tile'
+    gdal.GetDriverByName(driver).CreateCopy(path, mem, options=options or [])
+    f = gdal.VSIFOpenL(path, 'rb')
+    gdal.VSIFSeekL(f, 0, 2)
+    length = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    data = gdal.VSIFReadL(1, length, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(path)
+    # The JPEG driver keeps the georeferencing in a side car
+    gdal.Unlink(path + '.aux.xml')
+    return data
+
+
+def world_file(col, row, pixel=0.00001):
+    """World file of a tile in a grid of JPEG tiles, so every tile has its own footprint"""
+    x = -80.0 + col * TILE_SIZE * pixel
+    y = 26.0 - row * TILE_SIZE * pixel
+    return "{}\n0.0\n0.0\n{}\n{}\n{}\n".format(pixel, -pixel, x, y).encode('utf-8')
+
+
+class FakeSite(object):
+
+    """
+    Generated copies of the NOAA Storm and DG Open Data sites and the DG ImageServer.
+
+    Pages are rendered from the event number on request, so thousands of events cost nothing until they're
+    crawled.  Archives are tarballs of template GeoTIFFs or JPEG tiles with world files, built on first request
+    and kept in a small LRU cache.
+    """
+
+    def __init__(self, events=100, archives_per_event=2, tiles_per_archive=4, items_per_event=10):
+        self.events = events
+        self.archives_per_event = archives_per_event
+        self.tiles_per_archive = tiles_per_archive
+        self.items_per_event = items_per_event
+        self.base_urls = {}
+        self.archives = OrderedDict()
+        self.lock = threading.Lock()
+        self.templates = {}
+
+    # Templates are only encoded when the first archive or image is requested
+    def template(self, name):
+        with self.lock:
+            if name not in self.templates:
+                if name == 'tif':
+                    self.templates[name] = render_tile('GTiff', options=['TILED=YES'])
+                else:
+                    self.templates[name] = render_tile('JPEG', options=['QUALITY=75'])
+            return self.templates[name]
+
+    def noaa_events(self):
+        return ['storm-{:04d}'.format(x) for x in range(self.events)]
+
+    def dg_events(self):
+        return ['dg-event-{:04d}'.format(x) for x in range(self.events)]
+
+    def event_date(self, name):
+        return EPOCH + timedelta(days=event_seed(name) % 700)
+
+    def archive_names(self, event):
+        date = self.event_date(event).strftime('%Y%m%d')
+        names = []
+        for idx in range(self.archives_per_event):
+            letter = chr(ord('a') + idx % 26)
+            if idx % 2:
+                names.append('{}{}_JPEGTiles_GCS_NAD83.tar'.format(date, letter))
+            else:
+                names.append('{}{}_RGB.tar'.format(date, letter))
+        return names
+
+    # NOAA Storm
+
+    def noaa_index(self):
+        rows = ''.join(
+            '<h2><a href="{}/{}/index.html">{} ({})</a></h2>'.format(
+                self.base_urls['noaa'], name, name.replace('-', ' ').title(), self.event_date(name).year)
+            for name in self.noaa_events()
+        )
+        return '<html><body><div class="layout_col1">{}</div></body></html>'.format(rows)
+
+    def noaa_event(self, event):
+        base = self.base_urls['noaa']
+        links = ''.join('<li><a href="{}/archives/{}/{}">{}</a></li>'.format(base, event, name, name)
+                        for name in self.archive_names(event))
+        return (
+            '<html><head><meta name="viewport" content="width=device-width"></head><body>'
+            '<ul class="dropdown-menu">{}</ul>'
+            '<div id="metadata"><ul><li><a href="{}/{}/metadata.html">FGDC metadata</a></li></ul></div>'
+            '</body></html>'
+        ).format(links, base, event)
+
+    def fgdc(self, event):
+        start = self.event_date(event)
+        end = start + timedelta(days=3)
+        fields = [
+            ('Title', '{} imagery'.format(event.replace('-', ' ').title())),
+            ('Abstract', 'Generated aerial imagery for load testing'),
+            ('Purpose', 'Load testing. Imagery is synthetic. Footprints are arbitrary.'),
+            ('West Bounding Coordinate', '-80.0'),
+            ('South Bounding Coordinate', '25.9'),
+            ('East Bounding Coordinate', '-79.9'),
+            ('North Bounding Coordinate', '26.0'),
+            ('Beginning Date', start.strftime('%Y%m%d')),
+            ('Ending Date', end.strftime('%Y%m%d')),
+            ('Theme Keyword', 'aerial'),
+            ('Theme Keyword', 'hurricane'),
+            ('Theme Keyword', 'end'),
+        ]
+        rows = ''.join('<dt><em>{}: </em>{}</dt>'.format(k, escape(v)) for k, v in fields)
+        return '<html><body><dl>{}</dl></body></html>'.format(rows)
+
+    def archive(self, event, name):
+        """Bytes of a generated archive, None if the archive isn't listed on the event page"""
+        if name not in self.archive_names(event):
+            return None
+        key = (event, name)
+        with self.lock:
+            if key in self.archives:
+                self.archives.move_to_end(key)
+                return self.archives[key]
+
+        prefix = name.split('_')[0]
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            for idx in range(self.tiles_per_archive):
+                stem = '{}{:04d}'.format(prefix, idx)
+                if name.endswith('_RGB.tar'):
+                    members = [(stem + '.tif', self.template('tif'))]
+                else:
+                    members = [(stem + '.jpg', self.template('jpg')), (stem + '.jgw', world_file(idx % 16, idx // 16))]
+                for member, data in members:
+                    info = tarfile.TarInfo(member)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+        data = buf.getvalue()
+
+        with self.lock:
+            self.archives[key] = data
+            while len(self.archives) > ARCHIVE_CACHE_SIZE:
+                self.archives.popitem(last=False)
+        return data
+
+    # DG Open Data
+
+    def dg_index(self):
+        rows = ''.join(
+            '<div class="event-list__event"><div><a href="/ecosystem/open-data/{}">{}</a></div><p>{}</p></div>'.format(
+                name, name, self.event_date(name).strftime('%B %Y'))
+            for name in self.dg_events()
+        )
+        return '<html><body>{}</body></html>'.format(rows)
+
+    def dg_rows(self, event, phase):
+        count = self.items_per_event // 2 if phase == 'pre-event' else self.items_per_event - self.items_per_event // 2
+        date = self.event_date(event) + timedelta(days=-10 if phase == 'pre-event' else 2)
+        rows = []
+        # Two tiles per image, like the real tables
+        for idx in range(0, count, 2):
+            parent_id = '10{:02d}{:08X}{:04d}'.format(idx % 4, event_seed(event) ^ event_seed(phase), idx)
+            tiles = ''.join(
+                '<a href="{}/imagery/{}/{}/{}/{}/{}.tif">Download</a>'.format(
+                    self.base_urls['dg'], event, phase, date.strftime('%Y-%m-%d'), parent_id,
+                    '{}{:03d}'.format(phase[:3], tile))
+                for tile in range(idx, min(idx + 2, count))
+            )
+            rows.append('<tr><td><p>{}</p></td><td><ul><p>{}</p></ul></td><td>{}</td></tr>'.format(
+                date.strftime('%Y-%m-%d'), parent_id, tiles))
+        return '<table id="table--{}"><tbody>{}</tbody></table>'.format(phase, ''.join(rows))
+
+    def dg_event(self, event):
+        return '<html><body>{}{}</body></html>'.format(self.dg_rows(event, 'pre-event'),
+                                                       self.dg_rows(event, 'post-event'))
+
+    def image_server(self, body):
+        """Answer an ImageServer query for one image identifier with deterministic metadata"""
+        where = parse_qs(body.decode('utf-8')).get('where', [''])[0]
+        match = re.search(r"IN \('([^']+)'\)", where)
+        if not match:
+            return {'features': []}
+        imgid = match.group(1)
+        seed = event_seed(imgid)
+        collected = int((EPOCH + timedelta(seconds=seed % (700 * 86400))).timestamp() * 1000)
+        platform = PLATFORMS[seed % len(PLATFORMS)]
+        return {
+            'features': [{
+                'attributes': {
+                    'image_identifier': imgid,
+                    'legacy_identifier_reference': imgid,
+                    'vehicle_name': platform,
+                    'sensor_name': platform,
+                    'area_cloud_cover_percentage': seed % 100,
+                    'area_avg_off_nadir_angle': round((seed >> 8) % 450 / 10.0, 1),
+                    'multi_resolution_avg': round(1.2 + (seed >> 16) % 80 / 100.0, 2),
+                    'pan_resolution_avg': round(0.3 + (seed >> 16) % 30 / 100.0, 2),
+                    'sun_elevation_avg': round(20 + (seed >> 4) % 600 / 10.0, 1),
+                    'sun_azimuth_avg': round((seed >> 12) % 3600 / 10.0, 1),
+                    'target_azimuth_avg': round((seed >> 20) % 3600 / 10.0, 1),
+                    'collect_time_start': collected,
+                    'collect_time_end': collected + 30000,
+                    'browse_url': '',
+                    'objectid': seed % 100000,
+                }
+            }]
+        }
+
+    def catalog_seed(self, root_url):
+        """
+        Root, NOAA Storm and DG Open Data catalogs of the catalog bucket.  DG collections already exist, so the
+        DG flow opens them instead of creating them.
+        """
+        docs = {
+            'catalog.json': {
+                'id': 'cognition-disaster-data', 'stac_version': '0.7.0', 'description': 'Load test catalog',
+                'links': [
+                    {'rel': 'self', 'href': root_url + '/catalog.json'},
+                    {'rel': 'root', 'href': './catalog.json'},
+                    {'rel': 'child', 'href': './NOAAStorm/catalog.json'},
+                    {'rel': 'child', 'href': './DGOpenData/catalog.json'},
+                ]
+            },
+            'NOAAStorm/catalog.json': {
+                'id': 'NOAAStorm', 'stac_version': '0.7.0', 'description': 'NOAA Storm imagery',
+                'links': [
+                    {'rel': 'self', 'href': root_url + '/NOAAStorm/catalog.json'},
+                    {'rel': 'root', 'href': '../catalog.json'},
+                    {'rel': 'parent', 'href': '../catalog.json'},
+                ]
+            },
+            'DGOpenData/catalog.json': {
+                'id': 'DGOpenData', 'stac_version': '0.7.0', 'description': 'DG Open Data imagery',
+                'links': [
+                    {'rel': 'self', 'href': root_url + '/DGOpenData/catalog.json'},
+                    {'rel': 'root', 'href': '../catalog.json'},
+                    {'rel': 'parent', 'href': '../catalog.json'},
+                ] + [{'rel': 'child', 'href': './{}/catalog.json'.format(x)} for x in self.dg_events()]
+            },
+        }
+        for event in self.dg_events():
+            docs['DGOpenData/{}/catalog.json'.format(event)] = {
+                'id': event, 'stac_version': '0.7.0', 'description': 'Satellite imagery for {}'.format(event),
+                'license': 'CC-BY-NC-4.0', 'extent': {'spatial': [-80.0, 25.9, -79.9, 26.0], 'temporal': [None, None]},
+                'links': [
+                    {'rel': 'self', 'href': '{}/DGOpenData/{}/catalog.json'.format(root_url, event)},
+                    {'rel': 'root', 'href': '../../catalog.json'},
+                    {'rel': 'parent', 'href': '../catalog.json'},
+                ]
+            }
+        return {k: json.dumps(v).encode('utf-8') for k, v in docs.items()}
@@ -0,0 +1,196 @@
+import os
+import gc
+import json
+import time
+import threading
+import tracemalloc
+from functools import lru_cache
+from contextlib import contextmanager
+
+# Soft limit on resident memory.  Defaults to 80% of the container limit so the pipeline can back off before
+# the kernel kills it.
+MEMORY_SOFT_LIMIT_MB = os.environ.get("MEMORY_SOFT_LIMIT_MB")
+MEMORY_TRACE = os.environ.get("MEMORY_TRACE", "0") == "1"
+MEMORY_REPORT = os.environ.get("MEMORY_REPORT")
+THROTTLE_TIMEOUT = float(os.environ.get("MEMORY_THROTTLE_TIMEOUT", 60))
+TOP_ALLOCATORS = 10
+CGROUP_LIMITS = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+CGROUP_USAGE = ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory/memory.usage_in_bytes')
+
+
+def rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def read_cgroup(paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports a huge number and v2 reports "max" when unlimited
+        if value.isdigit() and int(value) < 2 ** 60:
+            return int(value)
+    return None
+
+
+def container_limit():
+    return read_cgroup(CGROUP_LIMITS)
+
+
+def container_usage():
+    """Memory used by the whole container, which includes worker processes"""
+    return read_cgroup(CGROUP_USAGE)
+
+
+def default_soft_limit():
+    if MEMORY_SOFT_LIMIT_MB:
+        return int(float(MEMORY_SOFT_LIMIT_MB) * 1024 ** 2)
+    limit = container_limit()
+    return int(limit * 0.8) if limit else None
+
+
+def gdal_cache():
+    """Bytes used by and allotted to the GDAL block cache, or None when GDAL isn't loaded"""
+    try:
+        from osgeo import gdal
+    except ImportError:
+        return None
+    return {'used': gdal.GetCacheUsed(), 'max': gdal.GetCacheMax()}
+
+
+def flush_gdal_cache():
+    from osgeo import gdal
+
+    # Shrinking the cache writes out and evicts cached blocks
+    cache_max = gdal.GetCacheMax()
+    gdal.SetCacheMax(0)
+    gdal.SetCacheMax(cache_max)
+
+
+class MemoryMonitor(object):
+
+    """
+    Per-stage memory tracking and a soft limit for index jobs.
+
+    Stages record resident memory and GDAL cache usage, and the top allocators from tracemalloc when tracing is
+    enabled (MEMORY_TRACE=1, it slows Python allocations down).  ``guard`` is called from the intake loops of a
+    pipeline: past the soft limit it runs the pipeline's flush callbacks, drops the GDAL cache and waits for
+    in-flight work to release memory before taking on more.
+    """
+
+    def __init__(self, soft_limit=None, trace=MEMORY_TRACE):
+        self.soft_limit = soft_limit if soft_limit is not None else default_soft_limit()
+        self.trace = trace
+        self.stages = []
+        self.peak = rss()
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.lock = threading.Lock()
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start(5)
+
+    def sample(self):
+        current = rss()
+        self.peak = max(self.peak, current)
+        return current
+
+    def usage(self):
+        # The soft limit applies to the container so worker processes see each other's memory
+        current = self.sample()
+        return container_usage() or current
+
+    def over_limit(self):
+        return bool(self.soft_limit) and self.usage() > self.soft_limit
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    @contextmanager
+    def stage(self, name):
+        before = self.sample()
+        started = time.monotonic()
+        snapshot = self.snapshot() if self.trace else None
+        try:
+            yield
+        finally:
+            entry = {
+                'stage': name,
+                'seconds': round(time.monotonic() - started, 1),
+                'rss_before': before,
+                'rss_after': self.sample(),
+                'gdal_cache': gdal_cache(),
+            }
+            if snapshot:
+                stats = self.snapshot().compare_to(snapshot, 'lineno')[:TOP_ALLOCATORS]
+                entry['top_allocators'] = [
+                    {'location': str(x.traceback[0]), 'size_diff': x.size_diff, 'count_diff': x.count_diff}
+                    for x in stats
+                ]
+            self.stages.append(entry)
+            print("Stage {}: RSS {} -> {} MB".format(name, before // 1024 ** 2, entry['rss_after'] // 1024 ** 2))
+
+    def guard(self, *flush, timeout=THROTTLE_TIMEOUT):
+        """
+        Block intake while memory is over the soft limit, returning True if the pipeline was throttled.  A
+        timeout of 0 only flushes, for single threaded pipelines where waiting can't free anything.
+        """
+        if not self.over_limit():
+            return False
+        with self.lock:
+            # Another thread may have flushed while this one waited for the lock
+            if not self.over_limit():
+                return False
+            self.throttled += 1
+            print("Memory over soft limit ({} MB > {} MB), flushing buffers.".format(
+                self.usage() // 1024 ** 2, self.soft_limit // 1024 ** 2))
+            for fn in flush:
+                fn()
+            if gdal_cache() is not None:
+                flush_gdal_cache()
+            gc.collect()
+
+            started = time.monotonic()
+            while self.over_limit() and time.monotonic() - started < timeout:
+                time.sleep(1)
+            self.throttle_seconds += time.monotonic() - started
+        return True
+
+    def report(self):
+        return {
+            'soft_limit': self.soft_limit,
+            'peak_rss': self.peak,
+            'throttled': self.throttled,
+            'throttle_seconds': round(self.throttle_seconds, 1),
+            'stages': self.stages,
+        }
+
+    def print_report(self):
+        report = self.report()
+        print("Peak RSS: {} MB (soft limit {})".format(
+            report['peak_rss'] // 1024 ** 2,
+            "{} MB".format(self.soft_limit // 1024 ** 2) if self.soft_limit else "none"))
+        if self.throttled:
+            print("Throttled {} times for {}s".format(self.throttled, report['throttle_seconds']))
+        for stage in self.stages:
+            print("  {:<24} {:>8}s  {:>6} -> {:>6} MB".format(
+                stage['stage'], stage['seconds'], stage['rss_before'] // 1024 ** 2, stage['rss_after'] // 1024 ** 2))
+            for alloc in stage.get('top_allocators', []):
+                print("      {:>+10} KB  {}".format(alloc['size_diff'] // 1024, alloc['location']))
+        if MEMORY_REPORT:
+            with open(MEMORY_REPORT, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+
+
+@lru_cache(maxsize=None)
+def monitor():
+    """Return the memory monitor of this process"""
+    return MemoryMonitor()
@@ -0,0 +1,168 @@
+import os
+import gzip
+import json
+import struct
+import hashlib
+
+MEDIA_TYPE = 'application/vnd.pmtiles'
+HEADER_SIZE = 127
+# Clients fetch the header and root directory with one 16 KiB range request
+ROOT_SIZE = 16384 - HEADER_SIZE
+LEAF_SIZE = 4096
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+TILE_TYPES = {'png': 2, 'jpeg': 3, 'webp': 4}
+
+
+def zxy_to_tile_id(z, x, y):
+    """Position of a tile on the Hilbert curve of its zoom level, after all tiles of lower zooms"""
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    s = 1 << z >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x, y = s - 1 - x, s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return tile_id
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def serialize_directory(entries):
+    """Entries are ``(tile_id, offset, length, run_length)``, each column delta or varint encoded, gzipped"""
+    out = bytearray()
+    write_varint(out, len(entries))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        write_varint(out, tile_id - last_id)
+        last_id = tile_id
+    for _, _, _, run_length in entries:
+        write_varint(out, run_length)
+    for _, _, length, _ in entries:
+        write_varint(out, length)
+    for idx, (_, offset, _, _) in enumerate(entries):
+        # Zero means the tile directly follows the previous one
+        if idx and offset == entries[idx - 1][1] + entries[idx - 1][2]:
+            write_varint(out, 0)
+        else:
+            write_varint(out, offset + 1)
+    return gzip.compress(bytes(out))
+
+
+def build_directories(entries):
+    """
+    Root and leaf directories of the entries.  When the root directory would be larger than ``ROOT_SIZE`` the
+    entries are split into leaf directories, with the root pointing at each leaf (run length 0).
+    """
+    root = serialize_directory(entries)
+    if len(root) <= ROOT_SIZE:
+        return root, b''
+
+    leaf_size = LEAF_SIZE
+    while True:
+        leaves = bytearray()
+        root_entries = []
+        for idx in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[idx:idx + leaf_size])
+            root_entries.append((entries[idx][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+        root = serialize_directory(root_entries)
+        if len(root) <= ROOT_SIZE:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+
+class PMTilesWriter(object):
+
+    """
+    Writes tiles into a single PMTiles (v3) archive.
+
+    Tiles can be added in any order, they are spooled to a temporary file and written out clustered by tile id
+    when the archive is finished.  Identical tiles are stored once, and runs of consecutive identical tiles (open
+    water, blank collars) share one directory entry.  A client reads any tile with at most three range requests:
+    header and root directory, leaf directory, tile.
+    """
+
+    def __init__(self, path, tile_type='png'):
+        self.path = path
+        self.tile_type = tile_type
+        self.spool = open(path + '.spool', 'w+b')
+        self.tiles = []
+        self.zooms = set()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def add(self, z, x, y, data):
+        self.spool.seek(0, os.SEEK_END)
+        self.tiles.append((zxy_to_tile_id(z, x, y), self.spool.tell(), len(data), hashlib.sha1(data).digest()))
+        self.spool.write(data)
+        self.zooms.add(z)
+
+    def entries(self):
+        """Directory entries of the tiles sorted by id, and the spooled tiles in the order they're written"""
+        entries = []
+        contents = []
+        offsets = {}
+        size = 0
+        previous = None
+        for tile_id, spool_offset, length, digest in sorted(self.tiles):
+            if previous and previous[0] == digest and entries[-1][0] + entries[-1][3] == tile_id:
+                entry = entries[-1]
+                entries[-1] = (entry[0], entry[1], entry[2], entry[3] + 1)
+                continue
+            if digest not in offsets:
+                offsets[digest] = size
+                contents.append((spool_offset, length))
+                size += length
+            entries.append((tile_id, offsets[digest], length, 1))
+            previous = (digest, tile_id)
+        return entries, contents, size
+
+    def finish(self, bounds, metadata=None, center_zoom=None):
+        """Write the archive.  ``bounds`` are the WGS84 bounds of the tiles as ``[west, south, east, north]``"""
+        entries, contents, data_length = self.entries()
+        root, leaves = build_directories(entries)
+        metadata = gzip.compress(json.dumps(metadata or {}).encode('utf-8'))
+
+        min_zoom, max_zoom = min(self.zooms), max(self.zooms)
+        if center_zoom is None:
+            center_zoom = min_zoom
+        root_offset = HEADER_SIZE
+        metadata_offset = root_offset + len(root)
+        leaves_offset = metadata_offset + len(metadata)
+        data_offset = leaves_offset + len(leaves)
+        e7 = [int(round(x * 1e7)) for x in bounds]
+        header = b'PMTiles' + struct.pack(
+            '<B11Q6B4iB2i', 3,
+            root_offset, len(root), metadata_offset, len(metadata), leaves_offset, len(leaves),
+            data_offset, data_length, len(self.tiles), len(entries), len(contents),
+            1, COMPRESSION_GZIP, COMPRESSION_NONE, TILE_TYPES[self.tile_type], min_zoom, max_zoom,
+            e7[0], e7[1], e7[2], e7[3],
+            center_zoom, (e7[0] + e7[2]) // 2, (e7[1] + e7[3]) // 2
+        )
+
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            f.write(root)
+            f.write(metadata)
+            f.write(leaves)
+            for spool_offset, length in contents:
+                self.spool.seek(spool_offset)
+                f.write(self.spool.read(length))
+        self.close()
+        return self.path
+
+    def close(self):
+        self.spool.close()
+        if os.path.exists(self.spool.name):
+            os.unlink(self.spool.name)
@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from collections import namedtuple
+
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint
+
+VISIBILITY_TIMEOUT = int(os.environ.get("QUEUE_VISIBILITY_TIMEOUT", 900))
+# Messages received this many times without being acknowledged are left for inspection
+MAX_RECEIVES = int(os.environ.get("QUEUE_MAX_RECEIVES", 3))
+
+Message = namedtuple('Message', ['id', 'body', 'receipt'])
+
+
+class SQSQueue(object):
+
+    def __init__(self, url):
+        self.url = url
+
+    def call(self, method, **kwargs):
+        return endpoint('sqs').call(getattr(client('sqs'), method), QueueUrl=self.url, **kwargs)
+
+    def send(self, bodies):
+        bodies = list(bodies)
+        for idx in range(0, len(bodies), 10):
+            entries = [{'Id': str(n), 'MessageBody': body} for n, body in enumerate(bodies[idx:idx + 10])]
+            failed = self.call('send_message_batch', Entries=entries).get('Failed', [])
+            if failed:
+                raise RuntimeError("Failed to send {} messages: {}".format(len(failed), failed[0].get('Message')))
+        return len(bodies)
+
+    def receive(self, max_messages=1, wait=20, visibility=VISIBILITY_TIMEOUT):
+        r = self.call('receive_message', MaxNumberOfMessages=max_messages, WaitTimeSeconds=wait,
+                      VisibilityTimeout=visibility)
+        return [Message(x['MessageId'], x['Body'], x['ReceiptHandle']) for x in r.get('Messages', [])]
+
+    def ack(self, message):
+        self.call('delete_message', ReceiptHandle=message.receipt)
+
+    def extend(self, message, visibility=VISIBILITY_TIMEOUT):
+        self.call('change_message_visibility', ReceiptHandle=message.receipt, VisibilityTimeout=visibility)
+
+    def __len__(self):
+        r = self.call('get_queue_attributes', AttributeNames=['ApproximateNumberOfMessages'])
+        return int(r['Attributes']['ApproximateNumberOfMessages'])
+
+
+class SQLiteQueue(object):
+
+    """
+    Local stand-in for SQS with the same visibility timeout semantics, shared by any number of worker
+    processes on one machine.
+    """
+
+    def __init__(self, path, max_receives=MAX_RECEIVES):
+        self.path = path
+        self.max_receives = max_receives
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    visible_at REAL NOT NULL,
+                    receipt TEXT,
+                    receives INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def connect(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return Transaction(self.local.conn)
+
+    def send(self, bodies):
+        now = time.time()
+        rows = [(uuid.uuid4().hex, body, now) for body in bodies]
+        with self.connect() as conn:
+            conn.executemany("INSERT INTO messages (id, body, visible_at) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def receive(self, max_messages=1, wait=20, visibility=VISIBILITY_TIMEOUT):
+        deadline = time.time() + wait
+        while True:
+            now = time.time()
+            with self.connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, body FROM messages WHERE visible_at <= ? AND receives < ? ORDER BY rowid LIMIT ?",
+                    (now, self.max_receives, max_messages)
+                ).fetchall()
+                messages = []
+                for id, body in rows:
+                    receipt = uuid.uuid4().hex
+                    conn.execute(
+                        "UPDATE messages SET visible_at = ?, receipt = ?, receives = receives + 1 WHERE id = ?",
+                        (now + visibility, receipt, id)
+                    )
+                    messages.append(Message(id, body, receipt))
+            if messages or time.time() >= deadline:
+                return messages
+            time.sleep(min(1.0, max(0.0, deadline - time.time())))
+
+    def ack(self, message):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM messages WHERE id = ? AND receipt = ?", (message.id, message.receipt))
+
+    def extend(self, message, visibility=VISIBILITY_TIMEOUT):
+        with self.connect() as conn:
+            conn.execute("UPDATE messages SET visible_at = ? WHERE id = ? AND receipt = ?",
+                         (time.time() + visibility, message.id, message.receipt))
+
+    def __len__(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE receives < ?", (self.max_receives,)).fetchone()[0]
+
+
+class Transaction(object):
+
+    """Run statements in an immediate transaction so concurrent receivers can't claim the same message"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def open_queue(url):
+    """Open an SQS queue by url, or a local SQLite queue with ``sqlite:///path/to/queue.db``"""
+    if url.startswith('sqlite://'):
+        return SQLiteQueue(url[len('sqlite://'):])
+    return SQSQueue(url)
+
+
+class Heartbeat(object):
+
+    """Keep extending the visibility of a message while a long job runs"""
+
+    def __init__(self, queue, message, visibility=VISIBILITY_TIMEOUT):
+        self.queue = queue
+        self.message = message
+        self.visibility = visibility
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.visibility / 3):
+            try:
+                self.queue.extend(self.message, self.visibility)
+            except Exception as e:
+                print("Failed to extend message visibility: {}".format(e))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
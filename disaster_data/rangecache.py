@@ -0,0 +1,387 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from disaster_data.endpoints import request, ENDPOINTS
+
+# Set in the environment of worker processes to route their remote reads through the node's range cache
+RANGE_CACHE_URL = os.environ.get("RANGE_CACHE_URL")
+CACHE_DIR = os.environ.get("RANGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), 'disaster-data-range-cache'))
+MAX_SIZE = int(float(os.environ.get("RANGE_CACHE_MAX_SIZE", 10)) * 1024 ** 3)
+BLOCK_SIZE = int(os.environ.get("RANGE_CACHE_BLOCK_SIZE", 128 * 1024))
+# Seconds a remote file's size and ETag are trusted before they're checked again
+METADATA_TTL = int(os.environ.get("RANGE_CACHE_METADATA_TTL", 3600))
+# Files larger than this (MB) requested whole, without a Range, are passed through without being cached
+PASSTHROUGH_SIZE = int(float(os.environ.get("RANGE_CACHE_PASSTHROUGH_SIZE", 256)) * 1024 ** 2)
+# Blocks read from the cache at a time while streaming a whole file
+STREAM_BLOCKS = 16
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+# Reads through the cache are limited by its own controller, misses are still limited by the remote host's
+# controller inside the cache process
+LOCAL_ENDPOINT = {'rate': 5000.0, 'burst': 500, 'max_concurrency': 256, 'initial_concurrency': 64,
+                  'target_latency': 5.0}
+if RANGE_CACHE_URL:
+    ENDPOINTS.setdefault(urlparse(RANGE_CACHE_URL).netloc, LOCAL_ENDPOINT)
+
+
+def cached_url(url):
+    """URL of a remote file through the range cache, unchanged when no cache is configured"""
+    if RANGE_CACHE_URL and url.startswith(('http://', 'https://')):
+        return RANGE_CACHE_URL.rstrip('/') + '/' + url
+    return url
+
+
+def vsicurl(url):
+    return '/vsicurl/' + cached_url(url)
+
+
+def digest(*parts):
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def read_range(response, start, end, chunk_size=BLOCK_SIZE):
+    """Bytes ``start`` to ``end`` of a streamed response to a whole file, reading no further than ``end``"""
+    data = bytearray()
+    offset = 0
+    for chunk in response.iter_content(chunk_size):
+        if offset + len(chunk) > start:
+            data += chunk[max(start - offset, 0):end + 1 - offset]
+        offset += len(chunk)
+        if offset > end:
+            break
+    return bytes(data)
+
+
+class RemoteFileError(Exception):
+
+    def __init__(self, status):
+        super().__init__("HTTP {}".format(status))
+        self.status = status
+
+
+class BlockCache(object):
+
+    """
+    Fixed size blocks of remote files on local disk, keyed by URL, ETag and block number so a changed file
+    never serves stale bytes.  The least recently used blocks are evicted once the store exceeds ``max_size``.
+    Blocks are written to a temporary file and renamed into place, the store survives restarts and is rescanned
+    on startup.  Concurrent reads of a missing block wait for a single fetch of it.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE, block_size=BLOCK_SIZE, metadata_ttl=METADATA_TTL):
+        self.directory = directory
+        self.max_size = max_size
+        self.block_size = block_size
+        self.metadata_ttl = metadata_ttl
+        self.metadata = {}
+        self.blocks = OrderedDict()
+        # Events of the blocks being fetched, keyed by block path
+        self.fetching = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'bytes_from_cache': 0, 'bytes_fetched': 0, 'evicted': 0,
+                      'bytes_passed_through': 0}
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.endswith('.tmp'):
+                    os.unlink(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self.blocks[path] = size
+            self.size += size
+        self.evict()
+
+    def count(self, **kwargs):
+        with self.lock:
+            for k, v in kwargs.items():
+                self.stats[k] += v
+
+    def report(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, blocks=len(self.blocks), size=self.size,
+                        hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else None)
+
+    def block_path(self, url, etag, block):
+        key = digest(url, etag)
+        return os.path.join(self.directory, key[:2], '{}.{}'.format(key, block))
+
+    def head(self, url):
+        """Size, ETag and content type of a remote file, cached for ``metadata_ttl`` seconds"""
+        cached = self.metadata.get(url)
+        if cached and time.time() - cached['checked'] < self.metadata_ttl:
+            return cached
+
+        r = request('head', url, allow_redirects=True)
+        if not r.ok or 'Content-Length' not in r.headers:
+            # Some servers don't answer HEAD, the total size is in the Content-Range of a one byte read
+            r = request('get', url, headers={'Range': 'bytes=0-0'}, allow_redirects=True, stream=True)
+            # Never read the body, a server ignoring the range would send the whole file
+            r.close()
+            if r.status_code != 206:
+                raise RemoteFileError(r.status_code)
+            size = int(r.headers['Content-Range'].split('/')[-1])
+        else:
+            size = int(r.headers['Content-Length'])
+        metadata = {
+            'size': size,
+            # Servers without ETags are versioned by their modification time and size
+            'etag': r.headers.get('ETag') or '{}-{}'.format(r.headers.get('Last-Modified', ''), size),
+            'content_type': r.headers.get('Content-Type', 'application/octet-stream'),
+            'checked': time.time(),
+        }
+        self.metadata[url] = metadata
+        return metadata
+
+    def get_block(self, path):
+        with self.lock:
+            if path not in self.blocks:
+                return None
+            self.blocks.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread since the lookup
+            with self.lock:
+                self.size -= self.blocks.pop(path, 0)
+            return None
+        return data
+
+    def put_block(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += len(data) - self.blocks.pop(path, 0)
+            self.blocks[path] = len(data)
+        self.evict()
+
+    def evict(self):
+        while True:
+            with self.lock:
+                if self.size <= self.max_size or not self.blocks:
+                    return
+                path, size = self.blocks.popitem(last=False)
+                self.size -= size
+                self.stats['evicted'] += 1
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def fetch(self, url, metadata, first, last):
+        """Read blocks ``first`` to ``last`` with a single range request"""
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, metadata['size']) - 1
+        r = request('get', url, headers={'Range': 'bytes={}-{}'.format(start, end)}, allow_redirects=True,
+                    stream=True)
+        try:
+            if r.status_code not in (200, 206):
+                raise RemoteFileError(r.status_code)
+            etag = r.headers.get('ETag')
+            if etag and etag != metadata['etag']:
+                # The file changed since it was last checked.  The client retries and reads the new version, the
+                # old blocks are never read again and age out.
+                self.metadata.pop(url, None)
+                raise RemoteFileError(503)
+            # A server which ignores the range sends the whole file, it's only read up to the end of the run
+            data = r.content if r.status_code == 206 else read_range(r, start, end, self.block_size)
+        finally:
+            r.close()
+        self.count(bytes_fetched=len(data))
+        return [data[idx:idx + self.block_size] for idx in range(0, len(data), self.block_size)]
+
+    def fetch_runs(self, url, metadata, missing, blocks):
+        """Fetch missing blocks into ``blocks``, consecutive ones with a single request"""
+        runs = []
+        for block in missing:
+            if runs and runs[-1][1] == block - 1:
+                runs[-1][1] = block
+            else:
+                runs.append([block, block])
+        for run_first, run_last in runs:
+            for block, data in zip(range(run_first, run_last + 1), self.fetch(url, metadata, run_first, run_last)):
+                self.put_block(self.block_path(url, metadata['etag'], block), data)
+                blocks[block] = data
+
+    def read(self, url, start, end):
+        """Bytes ``start`` to ``end`` (inclusive) of a remote file, fetching the blocks not cached yet"""
+        metadata = self.head(url)
+        first, last = start // self.block_size, end // self.block_size
+        blocks = {}
+        missing = []
+        for block in range(first, last + 1):
+            data = self.get_block(self.block_path(url, metadata['etag'], block))
+            if data is None:
+                missing.append(block)
+            else:
+                blocks[block] = data
+        self.count(requests=1, hits=len(blocks), misses=len(missing), bytes_from_cache=sum(map(len, blocks.values())))
+
+        # Claim the missing blocks nobody else is fetching, and wait for the others
+        claimed = []
+        waiting = {}
+        with self.lock:
+            for block in missing:
+                path = self.block_path(url, metadata['etag'], block)
+                if path in self.fetching:
+                    waiting[block] = self.fetching[path]
+                else:
+                    self.fetching[path] = threading.Event()
+                    claimed.append(block)
+        try:
+            self.fetch_runs(url, metadata, claimed, blocks)
+        finally:
+            with self.lock:
+                for block in claimed:
+                    self.fetching.pop(self.block_path(url, metadata['etag'], block)).set()
+
+        retry = []
+        for block, event in waiting.items():
+            event.wait()
+            data = self.get_block(self.block_path(url, metadata['etag'], block))
+            if data is None:
+                # The other fetch failed, or the block was evicted already
+                retry.append(block)
+            else:
+                blocks[block] = data
+        self.fetch_runs(url, metadata, retry, blocks)
+
+        data = b''.join(blocks[x] for x in range(first, last + 1))
+        offset = first * self.block_size
+        return data[start - offset:end - offset + 1]
+
+
+class RangeCacheHandler(BaseHTTPRequestHandler):
+
+    """Serves ``/<remote url>`` from the cache, answering HEAD and (range) GET requests like the remote server"""
+
+    protocol_version = 'HTTP/1.1'
+    cache = None
+    verbose = False
+
+    def send_head(self, status, headers, length):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        self.head_sent = True
+
+    def send_body(self, status, headers, body=b'', length=None):
+        self.send_head(status, headers, len(body) if length is None else length)
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_file(self, url, headers, size):
+        """
+        Whole file GETs are written out a few blocks at a time rather than read into memory.  Files larger than
+        ``PASSTHROUGH_SIZE`` are passed through without being cached, they'd evict the blocks of every other file.
+        """
+        if size <= PASSTHROUGH_SIZE:
+            self.send_head(200, headers, size)
+            step = self.cache.block_size * STREAM_BLOCKS
+            for start in range(0, size, step):
+                self.wfile.write(self.cache.read(url, start, min(start + step, size) - 1))
+            return
+
+        r = request('get', url, allow_redirects=True, stream=True)
+        try:
+            if r.status_code != 200:
+                raise RemoteFileError(r.status_code)
+            self.send_head(200, dict(headers, ETag=r.headers.get('ETag', headers['ETag'])),
+                           int(r.headers.get('Content-Length', size)))
+            for chunk in r.iter_content(self.cache.block_size):
+                self.cache.count(bytes_passed_through=len(chunk))
+                self.wfile.write(chunk)
+        finally:
+            r.close()
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            self.send_body(200, {'Content-Type': 'application/json'}, json.dumps(self.cache.report()).encode('utf-8'))
+            return
+
+        url = self.path[1:]
+        self.head_sent = False
+        try:
+            metadata = self.cache.head(url)
+            headers = {'Content-Type': metadata['content_type'], 'ETag': metadata['etag'], 'Accept-Ranges': 'bytes'}
+            size = metadata['size']
+            if self.command == 'HEAD':
+                self.send_body(200, headers, length=size)
+                return
+
+            match = RANGE_PATTERN.match(self.headers.get('Range', '').strip())
+            if not match:
+                self.send_file(url, headers, size)
+                return
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(size - int(match.group(2)), 0), size - 1
+            if start >= size or start > end:
+                self.send_body(416, {'Content-Range': 'bytes */{}'.format(size)})
+                return
+            body = self.cache.read(url, start, end)
+            self.send_body(206, dict(headers, **{'Content-Range': 'bytes {}-{}/{}'.format(start, end, size)}), body)
+        except Exception as e:
+            if self.head_sent:
+                # Part of the body is written already, the client sees the connection close early
+                print("Failed to stream {}: {}".format(url, e))
+                self.close_connection = True
+            elif isinstance(e, RemoteFileError):
+                self.send_body(e.status, {})
+            else:
+                print("Failed to read {}: {}".format(url, e))
+                self.send_body(502, {})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(directory=CACHE_DIR, max_size=MAX_SIZE, block_size=BLOCK_SIZE, host='127.0.0.1', port=8086,
+          verbose=False):
+    """
+    Run the range cache of a node.  Worker processes reach it by setting ``RANGE_CACHE_URL``, every remote
+    read which goes through ``vsicurl``/``cached_url`` is then served from the shared store when possible.
+    """
+    from disaster_data.catalog.server import ThreadingHTTPServer
+
+    RangeCacheHandler.cache = BlockCache(directory, max_size, block_size)
+    RangeCacheHandler.verbose = verbose
+    server = ThreadingHTTPServer((host, port), RangeCacheHandler)
+    print("Caching remote reads in {} ({:.1f} GB max) on http://{}:{}".format(
+        directory, max_size / 1024 ** 3, host, port))
+    print("Export RANGE_CACHE_URL=http://{}:{} in the environment of the workers.".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Range cache: {}".format(json.dumps(RangeCacheHandler.cache.report())))
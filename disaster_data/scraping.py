@@ -3,6 +3,7 @@ import tempfile
 import shutil
 import json
 import logging
+import importlib
 
 
 logging.getLogger('scrapy').setLevel(logging.FATAL)
@@ -32,6 +33,7 @@ class ScrapyRunner(object):
 
     def execute(self, **kwargs):
         oam = kwargs.pop('oam') if kwargs.get('oam') else None
+        raw = kwargs.pop('raw') if kwargs.get('raw') else None
         tempdir = tempfile.mkdtemp()
         outfile = os.path.join(tempdir, 'output.json')
         self.spider.crawl(outfile=outfile, **kwargs)
@@ -39,7 +41,7 @@ class ScrapyRunner(object):
         with open(outfile, 'r') as geoj:
             data = json.load(geoj)
 
-            if oam:
+            if oam or raw:
                 for item in data:
                     yield item
             else:
@@ -56,3 +58,91 @@ class ScrapyRunner(object):
                     yield item
 
 
+DEFAULT_SETTINGS = {
+    'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_TARGET_CONCURRENCY': 4.0,
+    'DNSCACHE_ENABLED': True,
+    'DNSCACHE_SIZE': 10000,
+    'DNS_TIMEOUT': 60,
+    'LOG_ENABLED': False,
+}
+
+# Spiders which may be scheduled by name
+SPIDERS = {
+    'noaa-storm': ('disaster_data.sources.noaa_storm.spider', 'NoaaStormCatalog'),
+    'noaa-coast': ('disaster_data.sources.noaa_coast.spider', 'NoaaImageryCollections'),
+    'dg-open-data': ('disaster_data.sources.dg_open_data.spider', 'DGOpenDataCatalog'),
+}
+
+
+def load_spider(name):
+    module, cls = SPIDERS[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+class NdjsonConsumer(object):
+
+    """Write each scraped item as a line of newline-delimited JSON"""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.f = open(outfile, 'w')
+        self.count = 0
+
+    def __call__(self, item):
+        self.f.write(json.dumps(dict(item)) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+
+class MultiSpiderRunner(object):
+
+    """
+    Run several spiders concurrently on a single Twisted reactor.
+
+    All spiders share the runner settings (concurrency, autothrottle) and one DNS cache, each spider may
+    override settings, and every scraped item is handed to the consumer registered with its spider.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.crawls = []
+
+    def add(self, spider, consumer, settings=None, **kwargs):
+        """
+        Schedule ``spider`` (a class or a registered name), passing ``kwargs`` to the spider instance.
+        """
+        if isinstance(spider, str):
+            spider = load_spider(spider)
+        self.crawls.append((spider, consumer, settings or {}, kwargs))
+
+    def run(self):
+        # Imported here, installing the reactor is a side effect of importing scrapy.crawler
+        from twisted.internet import reactor
+        from scrapy import signals
+        from scrapy.crawler import Crawler, CrawlerRunner
+        from scrapy.resolver import CachingThreadedResolver
+        from scrapy.settings import Settings
+
+        runner = CrawlerRunner(Settings(self.settings))
+        reactor.installResolver(
+            CachingThreadedResolver(reactor, self.settings['DNSCACHE_SIZE'], self.settings['DNS_TIMEOUT'])
+        )
+
+        for spidercls, consumer, settings, kwargs in self.crawls:
+            crawler = Crawler(spidercls, Settings(dict(self.settings, **settings)))
+            crawler.signals.connect(
+                lambda item, response, spider, consumer=consumer: consumer(item),
+                signal=signals.item_scraped
+            )
+            runner.crawl(crawler, **kwargs)
+
+        d = runner.join()
+        d.addBoth(lambda _: reactor.stop())
+        # Blocked while crawling
+        reactor.run()
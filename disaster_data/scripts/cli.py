@@ -1,6 +1,7 @@
 import click
 
-from disaster_data.sources.noaa_storm import noaa_storm_catalog
+# Source modules pull in GDAL, Scrapy, satstac and boto3.  They are imported inside each command so that
+# parsing arguments (and --help) stays fast and works without credentials.
 
 
 @click.group()
@@ -9,6 +10,264 @@ def cognition_disaster_data():
 
 @cognition_disaster_data.command(name="index-noaa-storm")
 @click.option('--id', type=str, multiple=True, help="ID of collection.")
+@click.option('--disk-budget', type=float, default=None, help="Disk budget for downloaded archives (GB).")
+@click.option('--plan', is_flag=True, default=False, help="Print the download schedule without downloading.")
+@click.option('--cog', is_flag=True, default=False, help="Convert imagery to Cloud Optimized GeoTIFFs.")
+@click.option('--metadata', type=click.Choice(['tile-index', 'gdal']), default='tile-index',
+              help="Read item geometries from the archive tile index or from each raster.")
+@click.option('--tiles', is_flag=True, default=False, help="Build tile pyramids of collections with new COGs.")
+@click.option('--publish', 'publish_mode', type=click.Choice(['diff', 'sync']), default='diff',
+              help="Upload only files changed since the last publish, or everything with aws s3 sync.")
 @click.option('--verbose/--quiet', default=False)
-def index_noaa_storm(id, verbose):
-    noaa_storm_catalog(id, verbose)
\ No newline at end of file
+def index_noaa_storm(id, disk_budget, plan, cog, metadata, tiles, publish_mode, verbose):
+    from disaster_data.sources.noaa_storm import noaa_storm_catalog
+
+    if disk_budget:
+        disk_budget = int(disk_budget * 1024 ** 3)
+    noaa_storm_catalog(id, verbose, disk_budget=disk_budget, plan=plan, cog=cog, metadata=metadata, tiles=tiles,
+                       publish_mode=publish_mode)
+
+@cognition_disaster_data.command(name="enqueue-noaa-storm")
+@click.option('--id', type=str, multiple=True, help="ID of collection.")
+@click.option('--queue', type=str, required=True, help="SQS queue url, or sqlite:///path for a local queue.")
+@click.option('--verbose/--quiet', default=False)
+def enqueue_noaa_storm(id, queue, verbose):
+    from disaster_data.sources.noaa_storm.worker import enqueue
+
+    enqueue(id, queue, verbose=verbose)
+
+@cognition_disaster_data.command(name="worker")
+@click.option('--queue', type=str, required=True, help="SQS queue url, or sqlite:///path for a local queue.")
+@click.option('--out-dir', type=str, default='/data/', help="Directory for downloaded archives.")
+@click.option('--max-jobs', type=int, default=None, help="Exit after this many archives.")
+@click.option('--idle-timeout', type=int, default=60, help="Exit after the queue is empty for this many seconds.")
+@click.option('--cog', is_flag=True, default=False, help="Convert imagery to Cloud Optimized GeoTIFFs.")
+@click.option('--metadata', type=click.Choice(['tile-index', 'gdal']), default='tile-index',
+              help="Read item geometries from the archive tile index or from each raster.")
+def worker(queue, out_dir, max_jobs, idle_timeout, cog, metadata):
+    from disaster_data.sources.noaa_storm.worker import run_worker
+
+    run_worker(queue, out_dir=out_dir, max_jobs=max_jobs, idle_timeout=idle_timeout, cog=cog, metadata=metadata)
+
+@cognition_disaster_data.command(name="index-dg-open-data")
+@click.option('--id', type=str, multiple=True, help="ID of collection.")
+@click.option('--num-threads', type=int, default=10, help="Number of worker processes.")
+@click.option('--limit', type=int, default=None, help="Maximum number of items to index.")
+@click.option('--collections-only', is_flag=True, default=False, help="Only create collections.")
+@click.option('--skip-existing/--reindex', default=True, help="Skip items already in the catalog.")
+@click.option('--catalog/--no-catalog', default=True, help="Build the STAC catalog.")
+@click.option('--summary', is_flag=True, default=False, help="Write per-event item counts.")
+@click.option('--summary-file', type=str, default='counts.json', help="Output file for item counts.")
+@click.option('--oam', is_flag=True, default=False, help="Build OAM upload definitions.")
+@click.option('--tiles', is_flag=True, default=False, help="Build tile pyramids of collections with new items.")
+@click.option('--writer', type=click.Choice(['log', 'lambda']), default='lambda', envvar='CATALOG_WRITER',
+              help="Write items through the stac-updater Lambda, or with link logs linked by compact-catalog.")
+@click.option('--verbose/--quiet', default=False)
+def index_dg_open_data(id, num_threads, limit, collections_only, skip_existing, catalog, summary, summary_file, oam,
+                       tiles, writer, verbose):
+    from disaster_data.sources.dg_open_data.utils import build_stac_catalog, build_outputs
+
+    if collections_only:
+        build_stac_catalog(id, collections_only=True, verbose=verbose)
+        return
+
+    # A single crawl feeds every selected output
+    outputs = [name for name, selected in (('catalog', catalog), ('summary', summary), ('oam', oam),
+                                           ('tiles', tiles)) if selected]
+    if catalog and tiles and writer == 'log':
+        raise click.UsageError("Tiles can't be built before compact-catalog links the items, use compact-catalog "
+                               "--tiles.")
+    build_outputs(id, outputs=outputs, num_threads=num_threads, limit=limit, skip_existing=skip_existing,
+                  summary_file=summary_file, writer=writer, verbose=verbose)
+
+@cognition_disaster_data.command(name="pair-dg-open-data")
+@click.option('--id', type=str, multiple=True, required=True, help="ID of collection.")
+def pair_dg_open_data(id):
+    from disaster_data.sources.dg_open_data.utils import pair_collections
+
+    pair_collections(id)
+
+@cognition_disaster_data.command(name="serve")
+@click.option('--catalog', type=str, default='https://cognition-disaster-data.s3.amazonaws.com/catalog.json',
+              help="Root catalog, a local path or URL.")
+@click.option('--host', type=str, default='127.0.0.1')
+@click.option('--port', type=int, default=8080)
+@click.option('--reload-interval', type=int, default=30, help="Seconds between checks for catalog changes, 0 disables.")
+@click.option('--num-threads', type=int, default=32, help="Concurrent reads while loading the catalog.")
+@click.option('--verbose/--quiet', default=False)
+def serve(catalog, host, port, reload_interval, num_threads, verbose):
+    from disaster_data.catalog.server import serve
+
+    serve(catalog, host=host, port=port, reload_interval=reload_interval, num_threads=num_threads, verbose=verbose)
+
+@cognition_disaster_data.command(name="range-cache")
+@click.option('--dir', 'directory', type=str, default=None, help="Directory of the block store.")
+@click.option('--max-size', type=float, default=10, help="Size of the block store (GB).")
+@click.option('--block-size', type=int, default=128 * 1024, help="Bytes read from remote files at a time.")
+@click.option('--host', type=str, default='127.0.0.1')
+@click.option('--port', type=int, default=8086)
+@click.option('--verbose/--quiet', default=False)
+def range_cache(directory, max_size, block_size, host, port, verbose):
+    from disaster_data.rangecache import serve, CACHE_DIR
+
+    serve(directory or CACHE_DIR, max_size=int(max_size * 1024 ** 3), block_size=block_size, host=host, port=port,
+          verbose=verbose)
+
+@cognition_disaster_data.command(name="compact-catalog")
+@click.option('--bucket', type=str, default='cognition-disaster-data', help="Catalog bucket.")
+@click.option('--prefix', type=str, default='DGOpenData', help="Catalog prefix holding the link and summary logs.")
+@click.option('--num-threads', type=int, default=32, help="Concurrent S3 requests.")
+@click.option('--pair', is_flag=True, default=False, help="Pair DG Open Data collections which gained items.")
+@click.option('--tiles', is_flag=True, default=False, help="Build tile pyramids of collections which gained items.")
+@click.option('--root-url', type=str, default='https://cognition-disaster-data.s3.amazonaws.com',
+              help="URL of the catalog bucket, tiles are rendered from the published items.")
+@click.option('--collections/--no-collections', default=True,
+              help="Refresh the summaries field of collections, off when stac-updater owns them.")
+def compact_catalog(bucket, prefix, num_threads, pair, tiles, root_url, collections):
+    from disaster_data.catalog.links import compact, compacted_collections
+    from disaster_data.catalog.summaries import compact_summaries
+    from disaster_data.catalog.changes import ChangeFeed, SOURCES
+
+    feed = ChangeFeed(bucket, SOURCES.get(prefix, prefix))
+    added = compact(bucket, prefix, num_threads=num_threads, feed=feed)
+    compact_summaries(bucket, prefix, collection=collections)
+    feed.publish()
+    if pair:
+        from disaster_data.sources.dg_open_data.utils import pair_collections
+
+        pair_collections(compacted_collections(added, prefix))
+    if tiles:
+        from disaster_data.tiles import publish_tiles
+
+        # Rendered once the items are linked, so the pyramids cover everything published
+        publish_tiles(bucket, prefix, compacted_collections(added, prefix), root_url, link=collections)
+
+@cognition_disaster_data.command(name="build-tiles")
+@click.option('--id', type=str, multiple=True, required=True, help="ID of collection.")
+@click.option('--bucket', type=str, default='cognition-disaster-data', help="Catalog bucket.")
+@click.option('--prefix', type=str, default='DGOpenData', help="Catalog prefix of the collections.")
+@click.option('--root-url', type=str, default='https://cognition-disaster-data.s3.amazonaws.com',
+              help="URL of the catalog bucket.")
+@click.option('--min-zoom', type=int, default=0)
+@click.option('--max-zoom', type=int, default=None, help="Defaults to the finest GSD of the collection.")
+@click.option('--format', 'tile_format', type=click.Choice(['png', 'jpeg']), default='png')
+@click.option('--num-processes', type=int, default=None, help="Number of render processes.")
+def build_tiles(id, bucket, prefix, root_url, min_zoom, max_zoom, tile_format, num_processes):
+    from disaster_data.tiles import publish_tiles, TILE_PROCESSES
+
+    publish_tiles(bucket, prefix, id, root_url, min_zoom=min_zoom, max_zoom=max_zoom, tile_format=tile_format,
+                  num_processes=num_processes or TILE_PROCESSES)
+
+@cognition_disaster_data.command(name="index-oam")
+@click.option('--id', type=str, multiple=True, help="ID of collection.")
+@click.option('--verbose/--quiet', default=False)
+def index_oam(id, verbose):
+    from disaster_data.sources.dg_open_data.oam import build_oam_catalog
+
+    build_oam_catalog(id, verbose=verbose)
+
+@cognition_disaster_data.command(name="index-noaa-coast")
+@click.option('--id', type=str, multiple=True, help="ID of project.")
+@click.option('--outfile', type=str, default='noaa_coast_projects.geojson', help="Output projects file.")
+@click.option('--items', 'items_dir', type=str, default=None, help="Also build project items into this directory.")
+@click.option('--num-threads', type=int, default=32, help="Concurrent raster header reads.")
+@click.option('--skip-existing/--reindex', default=True, help="Skip items already written to the items directory.")
+@click.option('--verbose/--quiet', default=False)
+def index_noaa_coast(id, outfile, items_dir, num_threads, skip_existing, verbose):
+    from disaster_data.sources.noaa_coast.catalog import build_projects
+
+    build_projects(id, outfile, verbose=verbose)
+    if items_dir:
+        from disaster_data.sources.noaa_coast.items import build_items
+
+        build_items(outfile, items_dir, num_threads=num_threads, skip_existing=skip_existing)
+
+@cognition_disaster_data.command(name="rebuild-catalog")
+@click.option('--root', type=str, required=True, help="Directory of the root catalog.")
+@click.option('--projects', type=str, multiple=True, default=('NOAA=noaa_coast_projects.geojson',),
+              help="Projects file of a datasource as datasource=path.")
+@click.option('--num-threads', type=int, default=32, help="Concurrent catalog writes.")
+def rebuild_catalog(root, projects, num_threads):
+    from disaster_data.catalog.catalog import DisasterDataCatalog
+
+    DisasterDataCatalog(root).rebuild(parse_spider_options(projects, str), num_threads=num_threads)
+
+@cognition_disaster_data.command(name="rebuild-thumbnails")
+@click.option('--collection', type=str, required=True, help="ID of DG Open Data collection.")
+@click.option('--sensor', type=str, default=None, help="Only rebuild thumbnails for this platform.")
+def rebuild_thumbnails(collection, sensor):
+    from disaster_data.sources.dg_open_data import thumbnails
+
+    if sensor:
+        thumbnails.rebuild_thumbnails(collection, sensor)
+    else:
+        thumbnails.rebuild_all_thumbnails(collection)
+
+def parse_spider_options(values, cast=int):
+    """Parse repeated ``name=value`` options into a dict"""
+    out = {}
+    for value in values:
+        name, _, setting = value.partition('=')
+        out[name] = cast(setting)
+    return out
+
+@cognition_disaster_data.command(name="load-test")
+@click.option('--flow', type=click.Choice(['noaa-storm', 'dg-open-data']), default='dg-open-data')
+@click.option('--events', type=int, default=100, help="Number of generated events.")
+@click.option('--archives-per-event', type=int, default=2, help="NOAA Storm archives per event.")
+@click.option('--tiles-per-archive', type=int, default=4, help="Images in each NOAA Storm archive.")
+@click.option('--items-per-event', type=int, default=10, help="DG Open Data images per event.")
+@click.option('--latency', type=str, multiple=True,
+              help="Mean added latency in seconds per stand-in as name=seconds (noaa, dg, dg-api, aws, bucket or *).")
+@click.option('--error-rate', type=str, multiple=True, help="Fraction of requests failed per stand-in as name=rate.")
+@click.option('--num-threads', type=int, default=10, help="Number of worker processes for the DG flow.")
+@click.option('--writer', type=click.Choice(['log', 'lambda']), default='log')
+@click.option('--cog', is_flag=True, default=False, help="Convert NOAA Storm imagery to COGs.")
+@click.option('--report', 'report_file', type=str, default=None, help="Write the report as JSON.")
+def load_test(flow, events, archives_per_event, tiles_per_archive, items_per_event, latency, error_rate,
+              num_threads, writer, cog, report_file):
+    from disaster_data.loadtest.harness import run_load_test
+
+    run_load_test(flow, events=events, archives_per_event=archives_per_event, tiles_per_archive=tiles_per_archive,
+                  items_per_event=items_per_event, latency=parse_spider_options(latency, float),
+                  error_rate=parse_spider_options(error_rate, float), num_threads=num_threads, writer=writer,
+                  cog=cog, report_file=report_file)
+
+@cognition_disaster_data.command(name="crawl")
+@click.option('--spider', type=click.Choice(['noaa-storm', 'noaa-coast', 'dg-open-data']), multiple=True,
+              required=True, help="Spider to run, may be repeated.")
+@click.option('--id', type=str, multiple=True, help="ID of collection.")
+@click.option('--outdir', type=str, default='.', help="Directory for <spider>.ndjson output.")
+@click.option('--concurrent-requests', type=int, default=32, help="Global concurrent requests per spider.")
+@click.option('--per-domain', type=int, default=8, help="Concurrent requests per domain.")
+@click.option('--spider-concurrency', type=str, multiple=True, help="Per-spider CONCURRENT_REQUESTS as spider=N.")
+@click.option('--spider-per-domain', type=str, multiple=True,
+              help="Per-spider CONCURRENT_REQUESTS_PER_DOMAIN as spider=N.")
+@click.option('--verbose/--quiet', default=False)
+def crawl(spider, id, outdir, concurrent_requests, per_domain, spider_concurrency, spider_per_domain, verbose):
+    import os
+    from disaster_data.scraping import MultiSpiderRunner, NdjsonConsumer
+
+    runner = MultiSpiderRunner({
+        'CONCURRENT_REQUESTS': concurrent_requests,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': per_domain,
+        'LOG_ENABLED': verbose,
+    })
+    concurrency = parse_spider_options(spider_concurrency)
+    domain_concurrency = parse_spider_options(spider_per_domain)
+
+    consumers = []
+    for name in spider:
+        settings = {}
+        if name in concurrency:
+            settings['CONCURRENT_REQUESTS'] = concurrency[name]
+        if name in domain_concurrency:
+            settings['CONCURRENT_REQUESTS_PER_DOMAIN'] = domain_concurrency[name]
+        consumer = NdjsonConsumer(os.path.join(outdir, name + '.ndjson'))
+        consumers.append(consumer)
+        runner.add(name, consumer, settings=settings, ids=list(id) or None, items=True)
+
+    runner.run()
+    for consumer in consumers:
+        consumer.close()
+        print("Wrote {} records to {}".format(consumer.count, consumer.outfile))
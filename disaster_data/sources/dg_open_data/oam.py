@@ -1,18 +1,16 @@
 import os
 import json
-import subprocess
 from datetime import datetime
+from functools import partial
 from multiprocessing.pool import ThreadPool
 
-import boto3
-import requests
-
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint, request
 from disaster_data.scraping import ScrapyRunner
 from disaster_data.sources.dg_open_data.spider import DGOpenDataOAM
 
-s3 = boto3.client('s3')
-dg_api_key = os.environ['DG_API_KEY']
 target_bucket = 'cognition-disaster-data'
+dg_api_url = os.environ.get('DG_API_URL', 'https://api.discover.digitalglobe.com/v1/services/ImageServer/query')
 
 def build_oam_catalog(id_list, verbose=False):
 
@@ -23,18 +21,15 @@ def build_oam_catalog(id_list, verbose=False):
         complete_oam_items(partial_items)
 
 
-def _complete_oam_item(partial_oam_item):
-    # Get additional metadata from DG api
-    # Upload oam item to S3
-    url = "https://api.discover.digitalglobe.com/v1/services/ImageServer/query"
+def query_oam_metadata(imgid):
+    """
+    Query the acquisition window and sensor of a DG image
+    """
+    url = dg_api_url
     headers = {
         "content-type": "application/x-www-form-urlencoded",
-        'x-api-key': dg_api_key,
+        'x-api-key': os.environ['DG_API_KEY'],
     }
-    splits = partial_oam_item['title'].split('_')
-    imgid = splits.pop(-1)
-    event_name = '_'.join(splits)
-
     payload = {
         'outFields': '*',
         'outSR': '4326',
@@ -42,7 +37,7 @@ def _complete_oam_item(partial_oam_item):
         'returnGeometry': 'false',
         'f': 'json'
     }
-    r = requests.post(url, headers=headers, data=payload)
+    r = request('post', url, headers=headers, data=payload)
 
     try:
         response = r.json()['features'][0]
@@ -53,11 +48,24 @@ def _complete_oam_item(partial_oam_item):
     start_date = datetime.fromtimestamp(int(str(response['attributes']['collect_time_start'])[:-3])).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
     end_date = datetime.fromtimestamp(int(str(response['attributes']['collect_time_end'])[:-3])).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
-    partial_oam_item.update({
+    return {
         'acquisition_start': start_date,
         'acquisition_end': end_date,
         'sensor': response['attributes']['vehicle_name']
-    })
+    }
+
+def _complete_oam_item(partial_oam_item, dg_metadata=None):
+    # Get additional metadata from DG api, unless the catalog pipeline already fetched it
+    # Upload oam item to S3
+    splits = partial_oam_item['title'].split('_')
+    imgid = splits.pop(-1)
+    event_name = '_'.join(splits)
+
+    metadata = (dg_metadata or {}).get(imgid) or query_oam_metadata(imgid)
+    if not metadata:
+        return None
+
+    partial_oam_item.update(metadata)
 
     final_item = {
         "scenes": [
@@ -68,13 +76,18 @@ def _complete_oam_item(partial_oam_item):
     # Upload to S3
     target_key = os.path.join('oam', event_name, imgid + '.json')
     print(f"Uploading OAM upload definition to s3://{target_bucket}/{target_key}")
-    s3.put_object(Body=json.dumps(final_item), Bucket=target_bucket, Key=target_key)
+    endpoint('s3').call(client('s3').put_object, Body=json.dumps(final_item), Bucket=target_bucket, Key=target_key)
 
-def complete_oam_items(partial_oam_items):
+def complete_oam_items(partial_oam_items, dg_metadata=None):
     m = ThreadPool()
-    m.map(_complete_oam_item, partial_oam_items)
+    m.map(partial(_complete_oam_item, dg_metadata=dg_metadata), partial_oam_items)
+    m.close()
+    m.join()
 
 
 def oam_upload(cookie, payload):
-    resp = subprocess.call(f'curl -X POST --cookie "oam-session={cookie}" -H "Content-Type: application/json" -d @{payload} https://api.openaerialmap.org/uploads', shell=True)
+    with open(payload, 'r') as f:
+        body = f.read()
+    resp = request('post', 'https://api.openaerialmap.org/uploads', cookies={'oam-session': cookie},
+                   headers={'Content-Type': 'application/json'}, data=body)
     return resp
\ No newline at end of file
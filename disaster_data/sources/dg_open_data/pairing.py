@@ -0,0 +1,115 @@
+import os
+import posixpath
+from datetime import datetime
+
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+from disaster_data.catalog.index import walk_catalog
+from disaster_data.catalog.links import put_json, link_key
+from disaster_data.sources.dg_open_data.spider import PRE_EVENT, POST_EVENT
+
+RELATED_LINKS = int(os.environ.get("RELATED_LINKS", 5))
+# Counterparts covering less of an item than this aren't linked
+MIN_OVERLAP = 0.05
+PAIRS_NAME = 'pairs.json'
+
+
+def parse_datetime(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+def query(tree, geoms, geom):
+    """Indices of the geometries whose envelopes intersect ``geom`` (Shapely 1.x returns geometries)"""
+    results = tree.query(geom)
+    if len(results) and hasattr(results[0], 'geom_type'):
+        index = {id(x): idx for idx, x in enumerate(geoms)}
+        return [index[id(x)] for x in results]
+    return [int(x) for x in results]
+
+
+def rank_counterparts(item, footprint, candidates):
+    """
+    Rank overlapping counterparts of an item by the fraction of the item they cover, then by time gap
+    """
+    when = parse_datetime(item['properties']['datetime'])
+    ranked = []
+    for other, other_footprint in candidates:
+        overlap = footprint.intersection(other_footprint).area / footprint.area if footprint.area else 0.0
+        if overlap < MIN_OVERLAP:
+            continue
+        gap = abs((parse_datetime(other['properties']['datetime']) - when).days)
+        ranked.append((round(overlap, 3), gap, other))
+    ranked.sort(key=lambda x: (-x[0], x[1]))
+    return ranked[:RELATED_LINKS]
+
+
+def pair_items(items):
+    """
+    Spatially join the pre-event and post-event items of a collection.  Returns ``{item id: [(overlap,
+    time gap in days, counterpart)]}`` for every item with overlapping counterparts.
+    """
+    phases = {PRE_EVENT: [], POST_EVENT: []}
+    for item in items:
+        phase = item['properties'].get('dg:phase')
+        if phase in phases and item.get('geometry'):
+            phases[phase].append((item, shape(item['geometry'])))
+
+    pairs = {}
+    for phase, counterpart_phase in ((PRE_EVENT, POST_EVENT), (POST_EVENT, PRE_EVENT)):
+        counterparts = phases[counterpart_phase]
+        if not counterparts:
+            continue
+        geoms = [x[1] for x in counterparts]
+        tree = STRtree(geoms)
+        for item, footprint in phases[phase]:
+            candidates = [counterparts[idx] for idx in query(tree, geoms, footprint)]
+            ranked = rank_counterparts(item, footprint, candidates)
+            if ranked:
+                pairs[item['id']] = ranked
+    return pairs
+
+
+def related_links(key, ranked, keys):
+    links = []
+    for overlap, gap, other in ranked:
+        links.append({
+            'rel': 'related',
+            'href': posixpath.relpath(keys[other['id']], posixpath.dirname(key)),
+            'title': other['properties']['dg:phase'],
+            'dg:overlap': overlap,
+            'dg:time_gap_days': gap
+        })
+    return links
+
+
+def pair_collection(bucket, collection_url):
+    """
+    Pair the pre and post-event items of a DG collection, rewriting the items whose ``related`` links
+    changed and writing a ``pairs.json`` index next to the collection.
+    """
+    collection_key = link_key('', collection_url)
+    keys = {}
+    items = []
+    for href, item in walk_catalog(collection_url):
+        keys[item['id']] = link_key(collection_key, href)
+        items.append(item)
+    pairs = pair_items(items)
+
+    updated = 0
+    for item in items:
+        key = keys[item['id']]
+        others = [x for x in item.get('links', []) if x['rel'] != 'related']
+        links = others + related_links(key, pairs.get(item['id'], []), keys)
+        if links != item.get('links', []):
+            item['links'] = links
+            put_json(bucket, key, item)
+            updated += 1
+
+    index = {
+        id: [{'id': other['id'], 'overlap': overlap, 'time_gap_days': gap} for overlap, gap, other in ranked]
+        for id, ranked in pairs.items()
+    }
+    put_json(bucket, posixpath.join(posixpath.dirname(collection_key), PAIRS_NAME), index)
+    print("Paired {} of {} items in {}, updated {}.".format(len(pairs), len(items), collection_url, updated))
+    return index
@@ -3,17 +3,34 @@ import os
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
-def items_from_imagery_table(table):
-    out_list = []
+# Overridden to crawl a local copy of the site, see disaster_data.loadtest
+DG_OPEN_DATA_URL = os.environ.get("DG_OPEN_DATA_URL", "https://www.digitalglobe.com/ecosystem/open-data")
+
+def parse_imagery_table(table):
+    """
+    Parse each row of a DG imagery table once into its date, parent image id and GeoTIFF links
+    """
+    rows = []
     for row in table.xpath('.//tbody/tr'):
-        date = row.xpath('.//td/p/text()').get()
-        assets = [x for x in row.xpath('.//td/a/@href').getall() if x.endswith('.tif')]
-        for asset in assets:
+        rows.append({
+            'date': row.xpath('.//td/p/text()').get(),
+            'parent_id': row.xpath('.//td/ul/p/text()').get(),
+            'assets': [x for x in row.xpath('.//td/a/@href').getall() if x.endswith('.tif')]
+        })
+    return rows
+
+PRE_EVENT = 'pre-event'
+POST_EVENT = 'post-event'
+
+def items_from_rows(rows, phase=None):
+    out_list = []
+    for row in rows:
+        for asset in row['assets']:
             partial_item = {
                 'type': 'Feature',
                 'id': os.path.splitext(asset)[0].split('/')[-1],
                 'properties': {
-                    'datetime': date
+                    'datetime': row['date']
                 },
                 'assets': {
                     'data': {
@@ -23,14 +40,16 @@ def items_from_imagery_table(table):
                     }
                 }
             }
+            if phase:
+                partial_item['properties']['dg:phase'] = phase
             out_list.append(partial_item)
     return out_list
 
-def oam_assets_from_imagery_table(event_name, table):
+def oam_assets_from_rows(event_name, rows):
     out_list = []
-    for row in table.xpath('.//tbody/tr'):
-        parent_id = row.xpath('.//td/ul/p/text()').get()
-        assets = [x for x in row.xpath('.//td/a/@href').getall() if x.endswith('.tif') and x.split('/')[-2] == parent_id]
+    for row in rows:
+        parent_id = row['parent_id']
+        assets = [x for x in row['assets'] if x.split('/')[-2] == parent_id]
         oam_item = {
             "title": event_name + '_' + parent_id,
             "contact": {
@@ -45,11 +64,17 @@ def oam_assets_from_imagery_table(event_name, table):
         out_list.append(oam_item)
     return out_list
 
+def items_from_imagery_table(table, phase=None):
+    return items_from_rows(parse_imagery_table(table), phase)
+
+def oam_assets_from_imagery_table(event_name, table):
+    return oam_assets_from_rows(event_name, parse_imagery_table(table))
+
 
 class DGOpenDataCatalog(scrapy.Spider):
     name = 'dg-open-data'
     start_urls = [
-        'https://www.digitalglobe.com/ecosystem/open-data',
+        DG_OPEN_DATA_URL,
     ]
     verbose = False
 
@@ -127,8 +152,8 @@ class DGOpenDataCatalog(scrapy.Spider):
         pre_event = response.xpath('//*[@id="table--pre-event"]')
         post_event = response.xpath('//*[@id="table--post-event"]')
 
-        pre_event_items = items_from_imagery_table(pre_event)
-        post_event_items = items_from_imagery_table(post_event)
+        pre_event_items = items_from_imagery_table(pre_event, PRE_EVENT)
+        post_event_items = items_from_imagery_table(post_event, POST_EVENT)
         all_items = pre_event_items + post_event_items
 
         [x.update({'collection': event_name}) for x in all_items]
@@ -193,3 +218,53 @@ class DGOpenDataOAM(DGOpenDataCatalog):
             yield item
 
 
+
+
+class DGOpenDataMultiplex(DGOpenDataCatalog):
+
+    """
+    Crawl each event page once and emit rows for any combination of the catalog, summary and OAM outputs.
+    Summary rows are yielded as ``{'type': 'summary', ...}`` and OAM definitions as ``{'type': 'oam', ...}``.
+    """
+
+    outputs = ('catalog',)
+
+    @classmethod
+    def crawl(cls, outfile='output.json', ids=None, items=False, outputs=('catalog',)):
+        cls.outputs = outputs
+        super().crawl(outfile=outfile, ids=ids, items=True)
+
+    def parse(self, response):
+        if 'catalog' in self.outputs:
+            yield from super().parse(response)
+            return
+
+        for event in response.css('.event-list__event'):
+            disaster_link = response.urljoin(event.xpath('.//div/a/@href').get())
+            event_name = disaster_link.split('/')[-1]
+
+            if self.ids:
+                if event_name not in self.ids:
+                    continue
+
+            yield scrapy.Request(disaster_link, callback=self.parse_disaster)
+
+    def parse_disaster(self, response):
+        event_name = response.url.split('/')[-1]
+
+        pre_event = parse_imagery_table(response.xpath('//*[@id="table--pre-event"]'))
+        post_event = parse_imagery_table(response.xpath('//*[@id="table--post-event"]'))
+        all_items = items_from_rows(pre_event, PRE_EVENT) + items_from_rows(post_event, POST_EVENT)
+
+        if 'catalog' in self.outputs:
+            for item in all_items:
+                item.update({'collection': event_name})
+                item['properties'].update({'collection': event_name})
+                yield item
+
+        if 'summary' in self.outputs:
+            yield {'type': 'summary', 'event_name': event_name, 'count': len(all_items)}
+
+        if 'oam' in self.outputs:
+            for scene in oam_assets_from_rows(event_name, pre_event) + oam_assets_from_rows(event_name, post_event):
+                yield {'type': 'oam', 'scene': scene}
@@ -1,13 +1,12 @@
 import os
 import json
 
-import boto3
 from satstac import Collection
 
-root_url = 'https://cognition-disaster-data.s3.amazonaws.com'
+from disaster_data.aws import client, account_id
+from disaster_data.endpoints import endpoint
 
-sqs = boto3.client('sqs')
-account_name = boto3.client('sts').get_caller_identity().get('Account')
+root_url = 'https://cognition-disaster-data.s3.amazonaws.com'
 
 def find_items(collection_name, sensor_name=None):
     col = Collection.open(os.path.join(root_url, 'DGOpenData', collection_name, 'catalog.json'))
@@ -21,14 +20,16 @@ def find_items(collection_name, sensor_name=None):
 
 def rebuild_thumbnails(collection_name, sensor_name):
     for item in find_items(collection_name, sensor_name):
-        sqs.send_message(
-            QueueUrl=f'https://sqs.us-east-1.amazonaws.com/{account_name}/newThumbnailQueue',
+        endpoint('sqs').call(
+            client('sqs').send_message,
+            QueueUrl=f'https://sqs.us-east-1.amazonaws.com/{account_id()}/newThumbnailQueue',
             MessageBody=json.dumps(item.data)
         )
 
 def rebuild_all_thumbnails(collection_name):
     for item in find_items(collection_name):
-        sqs.send_message(
-            QueueUrl=f'https://sqs.us-east-1.amazonaws.com/{account_name}/newThumbnailQueue',
+        endpoint('sqs').call(
+            client('sqs').send_message,
+            QueueUrl=f'https://sqs.us-east-1.amazonaws.com/{account_id()}/newThumbnailQueue',
             MessageBody=json.dumps(item.data)
         )
\ No newline at end of file
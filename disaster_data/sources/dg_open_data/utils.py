@@ -1,32 +1,42 @@
 import os
 import json
 import math
+import time
 from datetime import datetime
 from multiprocessing import Process, Pipe
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-import requests
 from satstac import Collection
 
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint, request, share
+from disaster_data.memory import monitor
+from disaster_data.utils import gdal_info
+from disaster_data.rangecache import vsicurl
+from disaster_data.catalog.index import ItemIndex, MANIFEST_NAME
+from disaster_data.catalog.links import LinkLog, item_key, s3_call
+from disaster_data.catalog.changes import ChangeFeed
+from disaster_data.catalog.summaries import SummaryLog, summarize
 from disaster_data.scraping import ScrapyRunner
-from disaster_data.sources.dg_open_data.spider import DGOpenDataCatalog, DGOpenDataOAM
+from disaster_data.sources.dg_open_data.spider import DGOpenDataCatalog, DGOpenDataMultiplex
+from disaster_data.sources.dg_open_data.oam import complete_oam_items, dg_api_url
+from disaster_data.sources.dg_open_data.pairing import pair_collection
 from . import band_mappings
 
-from osgeo import gdal
-
-lambda_client = boto3.client('lambda')
-s3_client = boto3.client('s3')
-
-root_url = 'https://cognition-disaster-data.s3.amazonaws.com'
+root_url = os.environ.get('CATALOG_ROOT_URL', 'https://cognition-disaster-data.s3.amazonaws.com')
+catalog_bucket = 'cognition-disaster-data'
 oam_upload_url = 'https://api.openaerialmap.org/uploads'
 thumbnail_bucket = 'cognition-disaster-data'
 thumbnail_key_prefix = 'thumbnails'
 thumbnail_kickoff_bucket = 'cognition-thumbnails-kickoff'
 stac_updater_arn = 'arn:aws:lambda:us-east-1:725820063953:function:stac-updater-dev-kickoff'
-
-oam_cookie = os.environ['OAM_COOKIE']
-dg_api_key = os.environ['DG_API_KEY']
+catalog_prefix = 'DGOpenData'
+# 'lambda' adds every item through the stac-updater Lambda, 'log' writes items and per-worker link logs which
+# are only linked into the catalogs once compact-catalog runs
+catalog_writer = os.environ.get('CATALOG_WRITER', 'lambda')
+# Seconds to wait for stac-updater to write the items it was sent before leaving them out of the manifests
+lambda_confirm_timeout = int(os.environ.get('LAMBDA_CONFIRM_TIMEOUT', 300))
 
 stac_mapping = {
     'sun_elevation_avg': 'eo:sun_elevation',
@@ -62,10 +72,10 @@ relevant_dg_keys = [
 ]
 
 def append_dg_metadata(stac_item):
-    url = "https://api.discover.digitalglobe.com/v1/services/ImageServer/query"
+    url = dg_api_url
     headers = {
         "content-type": "application/x-www-form-urlencoded",
-        'x-api-key': dg_api_key,
+        'x-api-key': os.environ['DG_API_KEY'],
     }
     imgid = stac_item['assets']['data']['href'].split('/')[-2]
 
@@ -84,7 +94,7 @@ def append_dg_metadata(stac_item):
     }
 
 
-    r = requests.post(url, headers=headers, data=payload)
+    r = request('post', url, headers=headers, data=payload)
 
     try:
         response = r.json()
@@ -157,14 +167,14 @@ def append_dg_metadata(stac_item):
     })
 
     # Updating ID to make sure items are unique across collections
-    stac_item['id'] = stac_item.properties['dg:legacy_identifier_reference'] + '_' + stac_item['id']
+    stac_item['id'] = stac_item['properties']['dg:legacy_identifier_reference'] + '_' + stac_item['id']
 
     return stac_item
 
 def append_gdal_info(partial_item):
-    file_url = os.path.join("/vsicurl/" + partial_item['assets']['data']['href'])
+    file_url = vsicurl(partial_item['assets']['data']['href'])
     try:
-        info = gdal.Info(file_url, format='json', allMetadata=True)
+        info = gdal_info(file_url, format='json', allMetadata=True)
     except:
         print("Failed to read spatial information for file: {}".format(file_url))
         return None
@@ -188,9 +198,78 @@ def append_gdal_info(partial_item):
     })
     return partial_item
 
-def _complete_stac_item(partial_stac_items, conn):
+def write_item(item, log=None):
+    """
+    Add a completed item to the catalog.  stac-updater is invoked asynchronously, an item it accepted is only
+    written once the Lambda has run (see ``confirm_written``).
+    """
+    if log:
+        log.add_item(item)
+        return
+    r = endpoint('lambda').call(
+        client('lambda').invoke,
+        FunctionName=stac_updater_arn,
+        InvocationType="Event",
+        Payload=json.dumps(item)
+    )
+    if r.get('StatusCode') != 202:
+        raise RuntimeError("stac-updater did not accept the item: {}".format(r.get('StatusCode')))
+
+def confirm_written(stac_items, timeout=lambda_confirm_timeout, interval=5):
+    """
+    Wait for stac-updater to write the items it accepted, returning those found in the catalog bucket.  Items
+    still missing after ``timeout`` seconds are left out of the manifests and change feed so the next run
+    ingests them again.
+    """
+    pending = {item_key(x, catalog_prefix): x for x in stac_items}
+    written = []
+    deadline = time.time() + timeout
+
+    def exists(key):
+        try:
+            s3_call('head_object', Bucket=catalog_bucket, Key=key)
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return False
+            raise
+        return True
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        while pending:
+            keys = list(pending)
+            for key, found in zip(keys, executor.map(exists, keys)):
+                if found:
+                    written.append(pending.pop(key))
+            if not pending or time.time() >= deadline:
+                break
+            time.sleep(interval)
+
+    if pending:
+        print("stac-updater has not written {} items after {}s, they will be ingested again by the next run."
+              .format(len(pending), timeout))
+    return written
+
+def _complete_stac_item(partial_stac_items, conn, writer=catalog_writer, processes=1):
+
+    # Endpoint limits are per process, each worker takes its share
+    share(processes)
+    log = LinkLog(catalog_bucket, catalog_prefix) if writer == 'log' else None
+    # Items are confirmed once their links are in a flushed segment of the link log
+    completed = []
+    unflushed = []
+
+    def confirm():
+        if not log or not log.buffer:
+            completed.extend(unflushed)
+            del unflushed[:]
 
     for partial_item in partial_stac_items:
+        # Write out buffered links and wait for other workers before taking the next item when memory is short
+        if log:
+            monitor().guard(log.flush)
+        else:
+            monitor().guard()
+        confirm()
         # Append metadata to stac item with GDAL and DG Browse API
         _ = append_gdal_info(partial_item)
         if _:
@@ -199,38 +278,59 @@ def _complete_stac_item(partial_stac_items, conn):
                 # Order properties keys alphabetically for nicer viewing with sat-browser
                 partial_item['properties'] = dict(sorted(partial_item['properties'].items(), key=lambda x: x[0].lower()))
 
-                # Add to stac catalog with stac-updater
-                lambda_client.invoke(
-                    FunctionName=stac_updater_arn,
-                    InvocationType="Event",
-                    Payload=json.dumps(partial_item)
-                )
+                try:
+                    write_item(partial_item, log)
+                except Exception as e:
+                    print("Failed to write item {}: {}".format(partial_item['id'], e))
+                    continue
+                unflushed.append(partial_item)
+                confirm()
 
-    conn.send([x for x in partial_stac_items if x])
+    if log:
+        try:
+            log.flush()
+        except Exception as e:
+            print("Failed to flush link log, {} items are not recorded: {}".format(len(unflushed), e))
+    confirm()
+    conn.send(completed)
     conn.close()
 
-def complete_stac_items(partial_stac_items, batch_size, num_threads):
+def complete_stac_items(partial_stac_items, batch_size, num_threads, writer=catalog_writer):
     parent_connections = []
+    child_connections = []
     processes = []
+    batches = []
     for thread in range(num_threads):
         parent_conn, child_conn = Pipe()
         parent_connections.append(parent_conn)
+        child_connections.append(child_conn)
 
-        process = Process(target=_complete_stac_item, args=(list(itertools.islice(partial_stac_items, batch_size)), child_conn))
+        batch = list(itertools.islice(partial_stac_items, batch_size))
+        batches.append(batch)
+        process = Process(target=_complete_stac_item, args=(batch, child_conn, writer, num_threads))
         processes.append(process)
 
     print("Starting processes")
-    for process in processes:
+    for process, child_conn in zip(processes, child_connections):
         process.start()
+        # Only the child holds its end now, so recv() sees EOF if the child dies before sending
+        child_conn.close()
+
+    # Receive before joining, a child blocks on send() until its results are read.
+    print("Getting results from processes")
+    completed = []
+    for parent_connection, batch in zip(parent_connections, batches):
+        try:
+            completed += parent_connection.recv()
+        except EOFError:
+            print("Worker exited without results, {} items are not recorded: {}".format(
+                len(batch), ', '.join(scene_key(x['assets']['data']['href']) for x in batch)))
 
     print("Joining processes")
     for process in processes:
         process.join()
 
-    print("Getting results from processes")
-    for parent_connection in parent_connections:
-        # Calling recv() on each item will begin passing it through pipeline.
-        parent_connection.recv()
+    return completed
 
 def create_collections(collections):
     dg_collection = Collection.open(os.path.join(root_url, 'DGOpenData', 'catalog.json'))
@@ -251,7 +351,115 @@ def create_collections(collections):
             out_d.update({coll['id']:Collection.open(os.path.join(root_url, 'DGOpenData', coll['id'], 'catalog.json'))})
     return out_d
 
-def build_stac_catalog(id_list, num_threads=10, limit=None, collections_only=False, verbose=False):
+def scene_key(href):
+    """
+    Image and scene of a DG data asset, as found in its href.  Scraped items are only given their catalog id
+    (``dg:legacy_identifier_reference + '_' + scene``) by the DG api, so items are matched on this instead.
+    """
+    parts = href.split('?')[0].rstrip('/').split('/')
+    return parts[-2] + '_' + os.path.splitext(parts[-1])[0]
+
+def indexed_scenes(index):
+    """
+    Scene keys of the items in an index.  Items which fell back on the image id as their legacy identifier
+    have an id of the same form.
+    """
+    return {scene_key(x) for x in index.hrefs} | index.ids
+
+def load_item_indexes(collection_ids):
+    """
+    Load the index of existing items for each collection.
+    """
+    indexes = {}
+    for coll_id in collection_ids:
+        indexes[coll_id] = ItemIndex.load(os.path.join(root_url, 'DGOpenData', coll_id, 'catalog.json'))
+        print("Found {} existing items in collection: {}".format(len(indexes[coll_id]), coll_id))
+    return indexes
+
+def update_manifests(indexes, stac_items):
+    """
+    Add newly ingested items to the index of their collection and upload the manifest.
+    """
+    for item in stac_items:
+        indexes[item['collection']].add(item, os.path.join(root_url, item_key(item, catalog_prefix)))
+    for coll_id, index in indexes.items():
+        endpoint('s3').call(
+            client('s3').put_object,
+            Body=json.dumps(index.to_dict()),
+            Bucket=catalog_bucket,
+            Key=os.path.join('DGOpenData', coll_id, MANIFEST_NAME),
+            ContentType='application/json'
+        )
+
+def pair_collections(collection_ids):
+    """
+    Link overlapping pre and post-event items of each collection.
+    """
+    for coll_id in collection_ids:
+        try:
+            pair_collection(catalog_bucket, os.path.join(root_url, catalog_prefix, coll_id, 'catalog.json'))
+        except Exception as e:
+            print("Failed to pair items of collection {}: {}".format(coll_id, e))
+
+def ingest_items(collections, partial_items, num_threads=10, limit=None, skip_existing=True, writer=catalog_writer):
+    """
+    Complete partial items scraped from DG Open Data and add them to the catalog, returning the new items.
+    """
+    partial_items = list(partial_items)
+    scraped_count = len(partial_items)
+    indexes = load_item_indexes([x['id'] for x in collections])
+    if skip_existing:
+        # Only new items go through GDAL, the DG api and stac-updater
+        scenes = {k: indexed_scenes(v) for k, v in indexes.items()}
+        partial_items = [x for x in partial_items
+                         if scene_key(x['assets']['data']['href']) not in scenes[x['collection']]]
+        print("Skipping {} existing items.".format(scraped_count - len(partial_items)))
+
+    if limit:
+        partial_items = partial_items[:limit]
+    item_count = len(partial_items)
+    if not item_count:
+        print("No new items to ingest.")
+        return []
+
+    batch_size = int(math.ceil(item_count / num_threads))
+    print("Item count: {}".format(item_count))
+    print("Batch size: {}".format(batch_size))
+
+    # Build and ingest stac items
+    stac_items = complete_stac_items(iter(partial_items), batch_size, num_threads, writer=writer)
+    print("Finished building STAC items.")
+    if writer != 'log':
+        # Lambda invocations are asynchronous, only record the items stac-updater has written
+        stac_items = confirm_written(stac_items)
+
+    # Reindexed items are already counted.  The summaries are merged into the collections by compact-catalog.
+    added = [x for x in stac_items if x not in indexes[x['collection']]]
+    with SummaryLog(catalog_bucket, catalog_prefix) as summary_log:
+        summary_log.add(summarize(added))
+
+    if writer == 'log':
+        # Compacting here would race with other ingests still flushing their logs.  compact-catalog links the
+        # items and records them in the manifests and change feed.
+        print("Run compact-catalog --pair --tiles to link the new items into the catalog, pair them and build "
+              "their tiles.")
+        return stac_items
+    print("Run compact-catalog --no-collections to add the new items to the summaries.")
+
+    # Items found in the index before this run were reindexed
+    feed = ChangeFeed(catalog_bucket, 'dg-open-data')
+    for item in stac_items:
+        href = os.path.join(root_url, item_key(item, catalog_prefix))
+        if item in indexes[item['collection']]:
+            feed.updated(item, href)
+        else:
+            feed.added(item, href)
+    update_manifests(indexes, stac_items)
+    feed.publish()
+    return stac_items
+
+def build_stac_catalog(id_list, num_threads=10, limit=None, collections_only=False, skip_existing=True,
+                       writer=catalog_writer, verbose=False):
 
     DGOpenDataCatalog.verbose = verbose
 
@@ -261,19 +469,77 @@ def build_stac_catalog(id_list, num_threads=10, limit=None, collections_only=Fal
         collections = next(partial_items)
         item_count = next(partial_items)
 
-        if limit:
-            item_count = limit
-
-        batch_size = int(math.ceil(item_count / num_threads))
-        print("Item count: {}".format(item_count))
-        print("Batch size: {}".format(batch_size))
-
         # Build and ingest stac collections
         create_collections(collections)
 
         if collections_only:
             return
 
-        # Build and ingest stac items
-        complete_stac_items(partial_items, batch_size, num_threads)
-        print("Finished building STAC items.")
+        ingest_items(collections, partial_items, num_threads=num_threads, limit=limit, skip_existing=skip_existing,
+                     writer=writer)
+
+def shared_oam_metadata(stac_items):
+    """
+    Acquisition metadata of each DG image, taken from completed STAC items so the OAM output doesn't query the
+    DG api again.
+    """
+    dg_metadata = {}
+    for item in stac_items:
+        props = item['properties']
+        if 'dg:collect_time_start' in props and 'eo:platform' in props:
+            dg_metadata[item['assets']['data']['href'].split('/')[-2]] = {
+                'acquisition_start': props['dg:collect_time_start'],
+                'acquisition_end': props['dg:collect_time_end'],
+                'sensor': props['eo:platform']
+            }
+    return dg_metadata
+
+def build_outputs(id_list, outputs=('catalog',), num_threads=10, limit=None, skip_existing=True,
+                  summary_file='counts.json', writer=catalog_writer, verbose=False):
+    """
+    Crawl DG Open Data once and produce any combination of the STAC catalog, the per-event summary counts, the
+    OAM upload definitions and the tile pyramids of the collections.  Items written with the ``log`` writer
+    aren't linked until compact-catalog runs, so their pyramids are built by ``compact-catalog --tiles``.
+    """
+    if writer == 'log' and 'catalog' in outputs and 'tiles' in outputs:
+        raise ValueError("Tiles can't be built from an uncompacted catalog, run compact-catalog --tiles instead")
+    DGOpenDataMultiplex.verbose = verbose
+    memory = monitor()
+
+    with ScrapyRunner(DGOpenDataMultiplex) as runner, memory.stage('crawl'):
+        rows = list(runner.execute(ids=id_list, outputs=outputs, raw=True))
+
+    collections = [x for x in rows if 'type' not in x]
+    partial_items = [x for x in rows if x.get('type') == 'Feature']
+    summary = {x['event_name']: x['count'] for x in rows if x.get('type') == 'summary'}
+    oam_items = [x['scene'] for x in rows if x.get('type') == 'oam']
+
+    stac_items = []
+    if 'catalog' in outputs:
+        with memory.stage('catalog'):
+            create_collections(collections)
+            stac_items = ingest_items(collections, partial_items, num_threads=num_threads, limit=limit,
+                                      skip_existing=skip_existing, writer=writer)
+
+    if 'summary' in outputs:
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print("Wrote item counts for {} events to {}".format(len(summary), summary_file))
+
+    if 'oam' in outputs:
+        with memory.stage('oam'):
+            complete_oam_items(oam_items, dg_metadata=shared_oam_metadata(stac_items))
+
+    if 'tiles' in outputs:
+        from disaster_data.tiles import publish_tiles
+
+        # Only collections which gained items need new pyramids, without the catalog the requested ones are built
+        if 'catalog' in outputs:
+            coll_ids = sorted({x['collection'] for x in stac_items})
+        else:
+            coll_ids = list(id_list or [])
+        with memory.stage('tiles'):
+            publish_tiles(catalog_bucket, catalog_prefix, coll_ids, root_url, link=writer == 'log',
+                          num_processes=num_threads)
+
+    memory.print_report()
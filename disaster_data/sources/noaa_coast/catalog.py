@@ -0,0 +1,22 @@
+import json
+
+from disaster_data.scraping import ScrapyRunner
+from disaster_data.sources.noaa_coast.spider import NoaaImageryCollections
+
+
+def build_projects(id_list, outfile, verbose=False):
+    """
+    Scrape NOAA Coast imagery projects into a GeoJSON feature collection of STAC collections, which is the
+    projects file consumed by ``DisasterDataCatalog.rebuild``.
+    """
+    NoaaImageryCollections.verbose = verbose
+
+    with ScrapyRunner(NoaaImageryCollections) as runner:
+        collections = []
+        for response in runner.execute(ids=id_list, raw=True):
+            collections += response.get('collections', [])
+
+    with open(outfile, 'w') as geoj:
+        json.dump({'type': 'FeatureCollection', 'features': collections}, geoj)
+    print("Wrote {} NOAA Coast projects to {}".format(len(collections), outfile))
+    return collections
@@ -0,0 +1,135 @@
+import os
+import json
+
+from disaster_data.endpoints import request
+from disaster_data.memory import monitor
+from disaster_data.utils import gdal_info_stac_stream, vsicurl_config
+
+ITEM_THREADS = int(os.environ.get("NOAA_COAST_ITEM_THREADS", 32))
+LINK_LOG = 'links.ndjson'
+
+
+def urllist_url(project):
+    return os.path.join(project['assets']['assets_http']['href'], 'urllist{}.txt'.format(project['id']))
+
+
+def iter_urllist(url):
+    """
+    Stream the GeoTIFF urls of a project's url list line by line
+    """
+    r = request('get', url, stream=True)
+    r.raise_for_status()
+    try:
+        for line in r.iter_lines(decode_unicode=True):
+            line = line.strip()
+            if line.endswith('.tif'):
+                yield line
+    finally:
+        r.close()
+
+
+def item_id(url):
+    return os.path.splitext(url.split('/')[-1])[0]
+
+
+def project_datetime(project):
+    """Datetime given to the items of a project, None when its metadata has no acquisition dates"""
+    start, end = project['extent']['temporal']
+    return start or end
+
+
+def input_item(project, url):
+    """Scraped part of a NOAA Coast item, completed by ``gdal_info_stac``"""
+    return {
+        'parent': project['id'],
+        'item': {
+            'type': 'Feature',
+            'collection': str(project['id']),
+            'properties': {
+                'datetime': project_datetime(project),
+            },
+            'assets': {
+                'data': {
+                    'href': url,
+                    'title': 'Raster data',
+                    'type': 'image/tiff'
+                }
+            },
+            'links': [
+                {'rel': 'collection', 'href': './catalog.json'},
+                {'rel': 'parent', 'href': './catalog.json'}
+            ]
+        }
+    }
+
+
+def write_collection(project, dirname):
+    """
+    Write the collection of a project, streaming its item links from the link log
+    """
+    collection = {k: v for k, v in project.items() if k != 'links'}
+    header = json.dumps(collection)[:-1]
+    with open(os.path.join(dirname, 'catalog.json'), 'w') as out, open(os.path.join(dirname, LINK_LOG)) as log:
+        out.write(header + ', "links": [')
+        for idx, line in enumerate(log):
+            out.write((', ' if idx else '') + line.strip())
+        out.write(']}')
+
+
+def build_project_items(project, outdir, num_threads=ITEM_THREADS, skip_existing=True):
+    """
+    Build the STAC items of a NOAA Coast project from its url list, writing each item as soon as it is read.
+    Neither the url list nor the items are held in memory, so projects listing tens of thousands of GeoTIFFs
+    run in constant memory.
+    """
+    dirname = os.path.join(outdir, str(project['id']))
+    os.makedirs(dirname, exist_ok=True)
+    counts = {'written': 0, 'existing': 0}
+
+    with open(os.path.join(dirname, LINK_LOG), 'w') as log:
+
+        def log_link(id):
+            log.write(json.dumps({'rel': 'item', 'href': './{}.json'.format(id)}) + '\n')
+
+        def pending():
+            if project_datetime(project) is None:
+                print("Project {} has no acquisition dates, skipping its items.".format(project['id']))
+                return
+            for url in iter_urllist(urllist_url(project)):
+                if skip_existing and os.path.exists(os.path.join(dirname, item_id(url) + '.json')):
+                    log_link(item_id(url))
+                    counts['existing'] += 1
+                    continue
+                yield input_item(project, url)
+
+        def throttle():
+            monitor().guard(log.flush)
+
+        for result in gdal_info_stac_stream(pending(), num_threads, throttle=throttle):
+            item = result['item']
+            with open(os.path.join(dirname, item['id'] + '.json'), 'w') as f:
+                json.dump(item, f)
+            log_link(item['id'])
+            counts['written'] += 1
+
+    write_collection(project, dirname)
+    print("Project {}: wrote {} items, {} already present.".format(project['id'], counts['written'], counts['existing']))
+    return counts
+
+
+def build_items(projects_file, outdir, num_threads=ITEM_THREADS, skip_existing=True):
+    """
+    Build the items of every project in a projects file written by ``build_projects``
+    """
+    with open(projects_file, 'r') as f:
+        projects = json.load(f)['features']
+
+    memory = monitor()
+    with vsicurl_config():
+        for project in projects:
+            try:
+                with memory.stage('project {}'.format(project['id'])):
+                    build_project_items(project, outdir, num_threads, skip_existing)
+            except Exception as e:
+                print("Failed to build items for project {}: {}".format(project['id'], e))
+    memory.print_report()
@@ -1,10 +1,9 @@
-import os
-
 import scrapy
 from scrapy.crawler import CrawlerProcess
-import requests
 
 from disaster_data.sources.noaa_coast.utils import get_geoinfo, get_fgdcinfo
+from disaster_data.sources.noaa_coast.items import iter_urllist, urllist_url
+from disaster_data.rangecache import vsicurl
 
 
 
@@ -14,31 +13,36 @@ class NoaaImageryCollections(scrapy.Spider):
     start_urls = [
         'https://coast.noaa.gov/htdata/raster2/index.html#imagery',
     ]
+    verbose = False
 
     @classmethod
     def crawl(cls, outfile='output.json', ids=None, items=False):
         cls.ids = ids
         cls.items = items
 
-        process = CrawlerProcess({
+        opts = {
             'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
             'FEED_FORMAT': 'json',
             'FEED_URI': outfile
-        })
+        }
+
+        if not cls.verbose:
+            opts.update({'LOG_ENABLED': False})
+
+        process = CrawlerProcess(opts)
         process.crawl(cls)
         # Blocked while crawling
         process.start()
 
     def parse(self, response):
         """
-        Generate a STAC Collection for each NOAA imagery project, optionally filtering by ID.
+        Generate a STAC Collection for each NOAA imagery project, optionally filtering by ID.  With ``items`` the
+        GeoTIFF urls of each project are yielded one record at a time as its url list is read.
         """
         dem_table, imagery_table = response.xpath('//*[@class="sortable"]')
         imagery_head = imagery_table.xpath('.//thead//tr/th//text()').getall()
 
         collections = []
-        collection_items = []
-        ret = {}
         for row in imagery_table.xpath('.//tbody//tr'):
             values = row.xpath('.//td')
             id = values[-1].xpath('.//text()').get()
@@ -101,7 +105,7 @@ class NoaaImageryCollections(scrapy.Spider):
                     feature.update({'id': int(data[0])})
 
             # Geometry handling
-            geoinfo = get_geoinfo('/vsizip//vsicurl/{}/0tileindex.shp'.format(feature['assets']['tile_index']['href']))
+            geoinfo = get_geoinfo('/vsizip/{}/0tileindex.shp'.format(vsicurl(feature['assets']['tile_index']['href'])))
             feature.update(geoinfo['geometry'])
             feature['extent'].update({'spatial': geoinfo['bbox']})
 
@@ -121,16 +125,12 @@ class NoaaImageryCollections(scrapy.Spider):
 
             # Scrape items
             if self.items:
-                items_url = os.path.join(feature['assets']['assets_http']['href'], 'urllist{}.txt'.format(feature['id']))
-                collection_items.append(self.parse_collection_items(items_url))
-
-        ret.update({'collections': collections})
-        if self.items:
-            ret.update({'items': collection_items})
+                for href in self.parse_collection_items(urllist_url(feature)):
+                    yield {'type': 'item', 'collection': feature['id'], 'href': href}
 
-        return ret
+        yield {'collections': collections}
 
     def parse_collection_items(self, file_list_url):
-        r = requests.get(file_list_url)
-        collection_items = r.content.decode('utf-8').splitlines()
-        return ['/vsicurl/'+x for x in collection_items if x.endswith('.tif')]
\ No newline at end of file
+        # Plain urls, they become asset hrefs.  /vsicurl/ is only added where GDAL opens the file.
+        for url in iter_urllist(file_list_url):
+            yield url
\ No newline at end of file
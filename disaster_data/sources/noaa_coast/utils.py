@@ -1,13 +1,15 @@
 import json
 
-from osgeo import ogr
+from osgeo import gdal, ogr
 from shapely.ops import cascaded_union
 from shapely.geometry import Polygon
 import geojson
-import requests
 import xml.etree.ElementTree as ET
 from gis_metadata.metadata_parser import get_metadata_parser
 
+from disaster_data.endpoints import endpoint, host, request, RetryableError
+from disaster_data.utils import TRANSIENT_GDAL_ERRORS
+
 gmd_tag = '{http://www.isotc211.org/2005/gmd}'
 gml_tag = '{http://www.opengis.net/gml/3.2}'
 
@@ -15,7 +17,19 @@ def get_geoinfo(fpath):
     """
     Returns the exact extent of all geometries within a vector.
     """
-    ds = ogr.Open(fpath)
+    def _open():
+        gdal.ErrorReset()
+        try:
+            ds = ogr.Open(fpath)
+        except RuntimeError:
+            ds = None
+        if ds is None:
+            message = gdal.GetLastErrorMsg()
+            if TRANSIENT_GDAL_ERRORS.search(message):
+                raise RetryableError(f"Failed to open {fpath}: {message}")
+            raise ValueError(f"Failed to open {fpath}: {message}")
+        return ds
+    ds = endpoint(host(fpath)).call(_open)
     lyr = ds.GetLayer()
 
     poly_list = []
@@ -40,7 +54,7 @@ def get_fgdcinfo(fpath):
     """
     Gathers information from FGDC metadata attached to each NOAA project.
     """
-    r = requests.get(fpath)
+    r = request('get', fpath)
 
     md_parser = get_metadata_parser(r.content)
     root = ET.fromstring(r.content)
@@ -1,29 +1,80 @@
 import os
-import subprocess
-import uuid
+import json
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
-from osgeo import gdal
-import utm
+from osgeo import gdal, ogr, osr
 
+from disaster_data.aws import client
+from disaster_data.download import download
+from disaster_data.endpoints import endpoint
 from disaster_data.sources.noaa_storm import band_mappings
+from disaster_data.sources.noaa_storm.cog import convert_to_cog, cog_href, cog_key, COG_BUCKET, COG_MEDIA_TYPE
+from disaster_data.sources.noaa_storm.worldfile import parse_world_file, jpeg_dimensions, footprints
+from disaster_data.sources.noaa_storm.raster import summarize, dataset_srs, epsg_code, extent, ground_resolution
 
 THUMBNAIL_BUCKET = 'cognition-disaster-data'
 THUMBNAIL_KEY_PREFIX = 'thumbnails'
+ASSET_THREADS = int(os.environ.get("ASSET_THREADS", multiprocessing.cpu_count()))
+
+
+class VSIFile(object):
+
+    """Minimal file object over a GDAL virtual file handle"""
+
+    def __init__(self, handle):
+        if handle is None:
+            raise ValueError("Failed to open virtual file")
+        self.handle = handle
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        gdal.VSIFCloseL(self.handle)
+
+    def read(self, size=-1):
+        if size < 0:
+            gdal.VSIFSeekL(self.handle, 0, 2)
+            end = gdal.VSIFTellL(self.handle)
+            gdal.VSIFSeekL(self.handle, 0, 0)
+            size = end
+        return gdal.VSIFReadL(1, size, self.handle) or b''
 
 
 class Archive(object):
 
-    def __init__(self, item, thumbdir):
+    # Spatial reference to assign to members which don't carry their own
+    srs = None
+    epsg = None
+
+    def __init__(self, item, thumbdir, cogdir=None, metadata='tile-index'):
         self.item = item
         self.thumbdir = thumbdir
+        self.cogdir = cogdir
+        self.cogs = {}
+        self.metadata = metadata
+        self.tile_index = None
+        # GSD of the members listed in the tile index, by extension and EPSG code
+        self.gsd = {}
 
     def download(self, out_dir):
         print("Downloading remote archive: {}".format(self.item['archive']))
-        subprocess.call(f"(cd {out_dir} && curl -O {self.item['archive']})", shell=True)
+        self.archive = download(self.item['archive'], out_dir)
         print("Finished downloading remote archive: {}".format(self.item['archive']))
-        self.archive = os.path.join(out_dir, os.path.basename(self.item['archive']))
         return 1
 
+    def remove(self, out_dir=None):
+        """Delete the local copy of the archive, including any partial download"""
+        archive = getattr(self, 'archive', None)
+        if not archive:
+            if not out_dir:
+                return
+            archive = os.path.join(out_dir, os.path.basename(self.item['archive']))
+        for path in (archive, archive + '.part', archive + '.part.json'):
+            if os.path.exists(path):
+                os.unlink(path)
+
     def listdir(self, exts=('.jpg', '.tif', '.vrt'), split_by_ext=False):
         if self.archive.endswith('.tar'):
             self.vsipath = '/vsitar/'
@@ -38,40 +89,157 @@ class Archive(object):
         else:
             return files
 
-    def spatial_resolution(self, infile, centroid):
-        """Calculate spatial resolution in UTM zone"""
-
-        utm_info = utm.from_latlon(*centroid[::-1])
-        if centroid[1] > 0:
-            utm_epsg = f'326{utm_info[2]}'
-        else:
-            utm_epsg = f'327{utm_info[2]}'
-        tempfile = f"/vsimem/{uuid.uuid4()}.vrt"
-        warped_vrt = gdal.Warp(tempfile, infile, dstSRS=f'EPSG:{utm_epsg}')
-        spatial_res = warped_vrt.GetGeoTransform()[1]
-        warped_vrt = None
-        gdal.Unlink(tempfile)
-        return spatial_res
-
-    def build_thumbnail(self, item):
+    def gdal_metadata(self, asset):
+        """
+        Read the four corner footprint, bbox, EPSG code and GSD of an archive member from its header.  The
+        footprint is refined from the pixels when the thumbnail is built.
+        """
+        ds = gdal.Open(f"{self.vsipath}/{asset}")
+        if ds is None:
+            raise ValueError("Failed to open archive member {}".format(asset))
+        srs = dataset_srs(ds, self.srs)
+        corners = extent(ds, srs)
+        xvals = [x[0] for x in corners]
+        yvals = [y[1] for y in corners]
+        md = {
+            'bbox': [min(xvals), min(yvals), max(xvals), max(yvals)],
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [corners]
+            },
+            'epsg': self.epsg or epsg_code(srs),
+            'gsd': ground_resolution(ds, srs)
+        }
+        ds = None
+        return md
+
+    def read_tile_index(self):
+        """
+        Read the footprint of every member listed in the tile index shapefile of the archive, keyed by the
+        lowercase stem of the member filename.
+        """
+        self.tile_index = {}
+        if not self.item.get('tile_index'):
+            return
+
+        tile_index = os.path.join(self.archive, self.item['tile_index'].split('/')[-1])
+        ds = ogr.Open(f"{self.vsipath}{tile_index}")
+        if ds is None:
+            print("No tile index found in archive: {}".format(self.item['archive']))
+            return
+
+        lyr = ds.GetLayer()
+        srs = lyr.GetSpatialRef()
+        if srs is None:
+            # Members are then read one by one, they may carry their own spatial reference
+            print("Tile index has no spatial reference, reading members instead: {}".format(tile_index))
+            return
+        epsg = self.epsg or epsg_code(srs)
+        if epsg is None:
+            print("No EPSG code for tile index, reading members instead: {}".format(tile_index))
+            return
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        transform = osr.CoordinateTransformation(srs, wgs84)
+
+        defn = lyr.GetLayerDefn()
+        string_fields = [x for x in range(defn.GetFieldCount()) if defn.GetFieldDefn(x).GetType() == ogr.OFTString]
+        for feat in lyr:
+            geom = feat.GetGeometryRef().Clone()
+            geom.Transform(transform)
+            minx, maxx, miny, maxy = geom.GetEnvelope()
+            md = {
+                'bbox': [minx, miny, maxx, maxy],
+                'geometry': json.loads(geom.ExportToJson()),
+                'epsg': epsg
+            }
+            # Join on whichever attribute holds the member filename
+            for field in string_fields:
+                value = feat.GetField(field)
+                if value:
+                    stem = os.path.splitext(value.replace('\\', '/').split('/')[-1])[0].lower()
+                    self.tile_index[stem] = md
+        print("Read {} footprints from tile index: {}".format(len(self.tile_index), tile_index))
+
+    def asset_metadata(self, asset):
+        """
+        Return the footprint, bbox, EPSG code and GSD of an archive member.  Members listed in the tile index
+        of the archive don't need to be opened.  Their GSD is read from the first member of each format and
+        projection and assumed for the rest: NOAA Storm archives are flown at a single resolution, archives
+        mixing resolutions should be indexed with ``--metadata gdal``.
+        """
+        if self.metadata == 'tile-index':
+            if self.tile_index is None:
+                self.read_tile_index()
+            stem = os.path.splitext(os.path.basename(asset))[0].lower()
+            if stem in self.tile_index:
+                md = self.tile_index[stem]
+                key = (os.path.splitext(asset)[1].lower(), md['epsg'])
+                if key not in self.gsd:
+                    self.gsd[key] = self.gdal_metadata(asset)['gsd']
+                return dict(md, gsd=self.gsd[key])
+        return self.gdal_metadata(asset)
+
+    def read_raster(self, item):
+        """
+        Build the thumbnail, valid-data footprint and band statistics of an item from a single decimated read.
+        The footprint excludes the black collars which the four corner extent includes.
+        """
         thumb_splits = item['assets']['thumbnail']['href'].split('/')
         infile_splits = item['assets']['data']['href'].split('/')
 
         date_dir = os.path.join(self.thumbdir, thumb_splits[-2])
-        if not os.path.exists(date_dir):
-            os.mkdir(date_dir)
+        os.makedirs(date_dir, exist_ok=True)
 
-        infile = os.path.join(self.archive, infile_splits[-1])
         outfile = os.path.join(date_dir, thumb_splits[-1])
-        gdal.Translate(outfile, f"{self.vsipath}{infile}", widthPct=15, heightPct=15, format='JPEG')
+        if item['id'] in self.cogs:
+            # Downsampling the COG reads from its overviews
+            infile = self.cogs[item['id']]
+        else:
+            infile = f"{self.vsipath}{os.path.join(self.archive, infile_splits[-1])}"
+
+        summary = summarize(infile, thumbnail=outfile, srs=self.srs)
+        if summary['geometry']:
+            item['bbox'] = summary['bbox']
+            item['geometry'] = summary['geometry']
+        item['assets']['data'].update({
+            'statistics': summary['statistics'],
+            'nodata_fraction': summary['nodata_fraction']
+        })
+
+    def build_cog(self, item):
+        """Convert an archive member into a COG and point the data asset of the item at it"""
+        basename = item['assets']['data']['href'].split('/')[-1]
+        outfile = os.path.join(self.cogdir, item['id'] + '.tif')
+        convert_to_cog(f"{self.vsipath}{os.path.join(self.archive, basename)}", outfile, srs=self.srs)
+        self.cogs[item['id']] = outfile
+
+        endpoint('s3').call(
+            client('s3').upload_file, outfile, COG_BUCKET, cog_key(item), ExtraArgs={'ContentType': COG_MEDIA_TYPE}
+        )
+        item['assets']['source'] = dict(item['assets']['data'], title="Raster data (archive member)")
+        item['assets']['data'] = dict(item['assets']['data'], href=cog_href(item), type=COG_MEDIA_TYPE)
+
+    def process_asset(self, item):
+        if self.cogdir:
+            self.build_cog(item)
+        self.read_raster(item)
+        if item['id'] in self.cogs:
+            os.unlink(self.cogs.pop(item['id']))
+        return item
+
+    def process_assets(self, items):
+        """Build COGs and thumbnails for every item of the archive in parallel"""
+        with ThreadPoolExecutor(max_workers=ASSET_THREADS) as executor:
+            return list(executor.map(self.process_asset, items))
 
     def build_items(self):
         raise NotImplementedError
 
 class ObliqueArchive(Archive):
 
-    def __init__(self, item, thumbdir):
-        super().__init__(item, thumbdir)
+    def __init__(self, item, thumbdir, **kwargs):
+        super().__init__(item, thumbdir, **kwargs)
 
     def build_items(self):
         stac_items = []
@@ -82,28 +250,21 @@ class ObliqueArchive(Archive):
             datetime = f"{acq_date[0:4]}-{acq_date[4:6]}-{acq_date[6:8]}"
 
             # Read spatial properties
-            info = gdal.Info(f"{self.vsipath}/{asset}", format='json', allMetadata=True, extraMDDomains='all')
-            geometry = info['wgs84Extent']['coordinates']
-            centroid = info['cornerCoordinates']['center']
-            xvals = [x[0] for x in geometry[0]]
-            yvals = [y[1] for y in geometry[0]]
+            md = self.asset_metadata(asset)
 
             partial_item = {
                 'type': 'Feature',
                 'id': id,
                 'collection': self.item['event_name'],
-                'bbox': [min(xvals), min(yvals), max(xvals), max(yvals)],
-                'geometry': {
-                    'type': 'Polygon',
-                    'coordinates': geometry
-                },
+                'bbox': md['bbox'],
+                'geometry': md['geometry'],
                 'properties': {
                     'datetime': datetime,
                     'eo:platform': 'aerial',
                     'eo:instrument': 'TrimbleDSS',
                     'eo:bands': band_mappings.DSS,
-                    'eo:gsd': self.spatial_resolution(f"{self.vsipath}/{asset}", centroid),
-                    'eo:epsg': int(info['coordinateSystem']['wkt'].rsplit('"EPSG","', 1)[-1].split('"')[0])
+                    'eo:gsd': md['gsd'],
+                    'eo:epsg': md['epsg']
                 },
                 'assets': {
                     "data": {
@@ -131,15 +292,14 @@ class ObliqueArchive(Archive):
             }
             stac_items.append(partial_item)
 
-            # Build thumbnail
-            self.build_thumbnail(partial_item)
-        return stac_items
+        # Build thumbnails
+        return self.process_assets(stac_items)
 
 
 class RGBArchive(Archive):
 
-    def __init__(self, item, thumbdir):
-        super().__init__(item, thumbdir)
+    def __init__(self, item, thumbdir, **kwargs):
+        super().__init__(item, thumbdir, **kwargs)
 
 
     def build_items(self):
@@ -151,28 +311,21 @@ class RGBArchive(Archive):
             datetime = f"{acq_date[0:4]}-{acq_date[4:6]}-{acq_date[6:8]}"
 
             # Read spatial properties
-            info = gdal.Info(f"{self.vsipath}/{asset}", format='json', allMetadata=True, extraMDDomains='all')
-            geometry = info['wgs84Extent']['coordinates']
-            centroid = info['cornerCoordinates']['center']
-            xvals = [x[0] for x in geometry[0]]
-            yvals = [y[1] for y in geometry[0]]
+            md = self.asset_metadata(asset)
 
             partial_item = {
                 'type': 'Feature',
                 'id': id,
                 'collection': self.item['event_name'],
-                'bbox': [min(xvals), min(yvals), max(xvals), max(yvals)],
-                'geometry': {
-                    'type': 'Polygon',
-                    'coordinates': geometry
-                },
+                'bbox': md['bbox'],
+                'geometry': md['geometry'],
                 'properties': {
                     'datetime': datetime,
                     'eo:platform': 'aerial',
                     'eo:instrument': 'TrimbleDSS',
                     'eo:bands': band_mappings.DSS,
-                    'eo:gsd': self.spatial_resolution(f"{self.vsipath}/{asset}", centroid),
-                    'eo:epsg': int(info['coordinateSystem']['wkt'].rsplit('"EPSG","', 1)[-1].split('"')[0])
+                    'eo:gsd': md['gsd'],
+                    'eo:epsg': md['epsg']
                 },
                 'assets': {
                     "data": {
@@ -200,48 +353,93 @@ class RGBArchive(Archive):
             }
             stac_items.append(partial_item)
 
-            self.build_thumbnail(partial_item)
-
-        return stac_items
+        return self.process_assets(stac_items)
 
 
 class JpegTilesArchive(Archive):
 
-    def __init__(self, item, thumbdir):
-        super().__init__(item, thumbdir)
+    srs = 'EPSG:4269'
+    epsg = 4269
+
+    def __init__(self, item, thumbdir, **kwargs):
+        super().__init__(item, thumbdir, **kwargs)
+
+    def read_member(self, path):
+        return VSIFile(gdal.VSIFOpenL(f"{self.vsipath}{path}", 'rb'))
+
+    def world_file_metadata(self, assets, world_files):
+        """
+        Compute the footprint, bbox and GSD of every JPEG with a world file in one batch.  Only the world file
+        and the JPEG header of each tile are read.
+        """
+        found = []
+        transforms = []
+        sizes = []
+        for asset in assets:
+            world_file = world_files.get(os.path.splitext(asset)[0])
+            if not world_file:
+                continue
+            try:
+                with self.read_member(world_file) as f:
+                    transform = parse_world_file(f.read().decode('utf-8', 'ignore'))
+                with self.read_member(asset) as f:
+                    size = jpeg_dimensions(f)
+            except (ValueError, AttributeError) as e:
+                print("Failed to read world file or header of {}: {}".format(asset, e))
+                continue
+            if size:
+                found.append(asset)
+                transforms.append(transform)
+                sizes.append(size)
+
+        if not found:
+            return {}
+
+        corners, bboxes, gsd = footprints(transforms, sizes)
+        return {
+            asset: {
+                'bbox': bboxes[idx].tolist(),
+                'geometry': {
+                    'type': 'Polygon',
+                    'coordinates': [corners[idx].tolist()]
+                },
+                'epsg': self.epsg,
+                'gsd': float(gsd[idx])
+            } for idx, asset in enumerate(found)
+        }
 
     def build_items(self):
         stac_items = []
         urls = self.listdir(exts=('.jpg', '.wld', '.jgw'), split_by_ext=True)
-        urls['world_files'] = urls['.jgw'] if len(urls['.jgw']) > 0 else urls['.wld']
-        for idx, asset in enumerate(urls['.jpg']):
+
+        # Pair world files with images by filename stem, preferring .jgw
+        world_files = {os.path.splitext(x)[0]: x for x in urls['.wld'] + urls['.jgw']}
+        if self.metadata == 'gdal':
+            metadata = {}
+        else:
+            metadata = self.world_file_metadata(urls['.jpg'], world_files)
+
+        for asset in urls['.jpg']:
             id = os.path.splitext(os.path.split(asset)[-1])[0]
             acq_date = asset.split('/')[-1]
             datetime = f"{acq_date[0:4]}-{acq_date[4:6]}-{acq_date[6:8]}"
 
             # Read spatial properties
-            info = gdal.Info(f"{self.vsipath}/{asset}", format='json', allMetadata=True, extraMDDomains='all')
-            geometry = info['wgs84Extent']['coordinates']
-            centroid = info['cornerCoordinates']['center']
-            xvals = [x[0] for x in geometry[0]]
-            yvals = [y[1] for y in geometry[0]]
+            md = metadata.get(asset) or self.asset_metadata(asset)
 
             partial_item = {
                 'type': 'Feature',
                 'id': id,
                 'collection': self.item['event_name'],
-                'bbox': [min(xvals), min(yvals), max(xvals), max(yvals)],
-                'geometry': {
-                    'type': 'Polygon',
-                    'coordinates': geometry
-                },
+                'bbox': md['bbox'],
+                'geometry': md['geometry'],
                 'properties': {
                     'datetime': datetime,
                     'eo:platform': 'aerial',
                     'eo:instrument': 'TrimbleDSS',
                     'eo:bands': band_mappings.DSS,
-                    'eo:gsd': self.spatial_resolution(f"{self.vsipath}/{asset}", centroid),
-                    'eo:epsg': 4269
+                    'eo:gsd': md['gsd'],
+                    'eo:epsg': md['epsg']
                 },
                 'assets': {
                     "data": {
@@ -259,14 +457,19 @@ class JpegTilesArchive(Archive):
                         ),
                         "type": "image/jpeg",
                         "title": "Thumbnail",
-                    },
+                    }
+                }
+            }
+
+            world_file = world_files.get(os.path.splitext(asset)[0])
+            if world_file:
+                partial_item['assets'].update({
                     "worldfile": {
-                        "href": os.path.join(self.item['archive'], os.path.basename(urls['world_files'][idx])),
+                        "href": os.path.join(self.item['archive'], os.path.basename(world_file)),
                         "title": "Worldfile",
                         "type": "text/plain"
                     }
-                }
-            }
+                })
 
             if len(self.item['metadata_url']) > 0:
                 partial_item['assets'].update({
@@ -278,6 +481,4 @@ class JpegTilesArchive(Archive):
                 })
             stac_items.append(partial_item)
 
-            self.build_thumbnail(partial_item)
-
-        return stac_items
\ No newline at end of file
+        return self.process_assets(stac_items)
\ No newline at end of file
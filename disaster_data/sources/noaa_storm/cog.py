@@ -0,0 +1,50 @@
+import os
+
+from osgeo import gdal
+
+COG_BUCKET = 'cognition-disaster-data'
+COG_KEY_PREFIX = 'cogs'
+COG_MEDIA_TYPE = 'image/x.geotiff; profile=cloud-optimized'
+BLOCKSIZE = 512
+
+
+def cog_key(item):
+    return os.path.join(COG_KEY_PREFIX, item['collection'], item['properties']['datetime'].split('T')[0], item['id'] + '.tif')
+
+
+def cog_href(item):
+    return "https://{}.s3.amazonaws.com/{}".format(COG_BUCKET, cog_key(item))
+
+
+def overview_levels(xsize, ysize, min_size=BLOCKSIZE // 2):
+    levels = []
+    factor = 2
+    while max(xsize, ysize) / factor >= min_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def convert_to_cog(infile, outfile, srs=None):
+    """
+    Convert a raster into a tiled GeoTIFF with internal overviews (Cloud Optimized GeoTIFF).
+
+    GDAL 2.x has no COG driver, so the raster is first written as a tiled GeoTIFF, overviews are built, and
+    the result is copied with COPY_SRC_OVERVIEWS so the overviews precede the full resolution data.
+    """
+    tempfile = outfile + '.tmp.tif'
+    tile_opts = ['TILED=YES', f'BLOCKXSIZE={BLOCKSIZE}', f'BLOCKYSIZE={BLOCKSIZE}']
+    gdal.Translate(tempfile, infile, format='GTiff', outputSRS=srs, creationOptions=tile_opts)
+
+    ds = gdal.Open(tempfile, gdal.GA_Update)
+    ds.BuildOverviews('AVERAGE', overview_levels(ds.RasterXSize, ds.RasterYSize))
+
+    # JPEG in YCbCr is by far the smallest for 8-bit RGB aerial imagery, fall back to lossless otherwise
+    if ds.RasterCount == 3 and ds.GetRasterBand(1).DataType == gdal.GDT_Byte:
+        compression = ['COMPRESS=JPEG', 'PHOTOMETRIC=YCBCR', 'JPEG_QUALITY=90']
+    else:
+        compression = ['COMPRESS=DEFLATE', 'PREDICTOR=2']
+    gdal.Translate(outfile, ds, format='GTiff', creationOptions=tile_opts + compression + ['COPY_SRC_OVERVIEWS=YES'])
+    ds = None
+    gdal.Unlink(tempfile)
+    return outfile
@@ -1,12 +1,13 @@
 from lxml import etree
-import requests
 from io import StringIO
 
+from disaster_data.endpoints import request
+
 postprocess = lambda x: x.replace("\\r\n", " ").replace("\\n", " ").replace("\\r ", "") if x != "\\n" else ''
 
 def parse_fgdc(url):
 
-    page = requests.get(url)
+    page = request('get', url)
     parser = etree.HTMLParser()
     tree = etree.parse(StringIO(str(page.content)), parser)
 
@@ -0,0 +1,143 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from disaster_data.endpoints import endpoint, host, check_response
+from disaster_data.sources.noaa_storm import band_mappings
+from disaster_data.sources.noaa_storm.worldfile import parse_world_file, jpeg_dimensions, footprints
+
+OLD_FORMAT_THREADS = int(os.environ.get("OLD_FORMAT_THREADS", 32))
+# Most JPEG headers fit in the first few KB, EXIF thumbnails can push the frame header further out
+HEADER_BYTES = (16 * 1024, 256 * 1024)
+EPSG = 4269
+
+local = threading.local()
+
+
+def session():
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+    return local.session
+
+
+def _fetch_range(url, length):
+    r = check_response(session().get(url, headers={'Range': f'bytes=0-{length - 1}'}, stream=True))
+    r.raise_for_status()
+    # Servers which ignore the range header return the whole file, stop reading once we have enough
+    data = b''
+    for block in r.iter_content(length):
+        data += block
+        if len(data) >= length:
+            break
+    r.close()
+    return data[:length]
+
+
+def fetch_range(url, length):
+    """Return the first ``length`` bytes of a remote file"""
+    return endpoint(host(url)).call(_fetch_range, url, length)
+
+
+def fetch_text(url):
+    r = endpoint(host(url)).call(lambda: check_response(session().get(url)))
+    r.raise_for_status()
+    return r.text
+
+
+def remote_jpeg_dimensions(url):
+    for length in HEADER_BYTES:
+        data = fetch_range(url, length)
+        size = jpeg_dimensions(io.BytesIO(data))
+        if size or len(data) < length:
+            return size
+    return None
+
+
+def read_georeferencing(payload):
+    """
+    Fetch the world file and JPEG header of an old-format image page, returning (transform, size).
+    """
+    try:
+        transform = parse_world_file(fetch_text(payload['world_file']))
+        size = remote_jpeg_dimensions(payload['urls'][0])
+    except Exception as e:
+        print("Failed to read georeferencing for {}: {}".format(payload['urls'][0], e))
+        return None
+    if not size:
+        print("Failed to read JPEG header for {}".format(payload['urls'][0]))
+        return None
+    return transform, size
+
+
+def build_old_item(payload, bbox, geometry, gsd):
+    url = payload['urls'][0]
+    id = os.path.splitext(url.split('/')[-1])[0]
+    item = {
+        'type': 'Feature',
+        'id': id,
+        'collection': payload['event_name'],
+        'bbox': bbox,
+        'geometry': geometry,
+        'properties': {
+            'datetime': payload['datetime'],
+            'eo:platform': 'aerial',
+            'eo:bands': band_mappings.DSS,
+            'eo:gsd': gsd,
+            'eo:epsg': EPSG
+        },
+        'assets': {
+            "data": {
+                "href": url,
+                "title": "Raster data",
+                "type": "image/jpeg",
+                "eo:bands": [
+                    3, 2, 1
+                ]
+            },
+            "worldfile": {
+                "href": payload['world_file'],
+                "title": "Worldfile",
+                "type": "text/plain"
+            }
+        }
+    }
+    if payload.get('metadata_url'):
+        item['assets'].update({
+            "metadata": {
+                "href": payload['metadata_url'],
+                "title": "FGDC metadata",
+                "type": "text/plain",
+            }
+        })
+    return item
+
+
+def build_old_items(payloads, num_threads=OLD_FORMAT_THREADS):
+    """
+    Build STAC items from old-format NOAA Storm image pages without downloading the imagery.  Only the world
+    file and the JPEG header of each image are fetched.
+    """
+    # The map index crawl can reach the same image from several pages
+    unique = {}
+    for payload in payloads:
+        unique.setdefault(payload['urls'][0], payload)
+    payloads = list(unique.values())
+    print("Reading georeferencing for {} old-format images.".format(len(payloads)))
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = [(p, r) for p, r in zip(payloads, executor.map(read_georeferencing, payloads)) if r]
+    if not results:
+        return []
+
+    corners, bboxes, gsd = footprints([r[0] for _, r in results], [r[1] for _, r in results])
+    return [
+        build_old_item(
+            payload,
+            bboxes[idx].tolist(),
+            {'type': 'Polygon', 'coordinates': [corners[idx].tolist()]},
+            float(gsd[idx])
+        ) for idx, (payload, _) in enumerate(results)
+    ]
@@ -0,0 +1,196 @@
+import json
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+import utm
+
+# Thumbnails have always been 15% of the full resolution image
+THUMBNAIL_SCALE = 0.15
+# NOAA aerial tiles rarely declare nodata, their collars are black
+COLLAR_VALUE = 0
+# Footprints are simplified to a couple of pixels of the decimated grid, specks smaller than this are dropped
+SIMPLIFY_PIXELS = 2
+MIN_AREA_PIXELS = 16
+
+
+def spatial_reference(definition):
+    srs = osr.SpatialReference()
+    if isinstance(definition, int):
+        srs.ImportFromEPSG(definition)
+    elif definition.startswith(('PROJCS', 'GEOGCS')):
+        srs.ImportFromWkt(definition)
+    else:
+        srs.SetFromUserInput(definition)
+    # GDAL 3 would otherwise swap EPSG:4326 to lat/lon
+    if hasattr(srs, 'SetAxisMappingStrategy'):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def dataset_srs(ds, default=None):
+    """Spatial reference of a dataset, or ``default`` for rasters which don't carry their own"""
+    wkt = ds.GetProjection()
+    if wkt:
+        return spatial_reference(wkt)
+    if default:
+        return spatial_reference(default)
+    return None
+
+
+def epsg_code(srs):
+    srs.AutoIdentifyEPSG()
+    code = srs.GetAuthorityCode(None)
+    return int(code) if code else None
+
+
+def utm_epsg(lon, lat):
+    zone = utm.from_latlon(lat, lon)[2]
+    return int('{}{:02d}'.format(326 if lat > 0 else 327, zone))
+
+
+def pixel_coords(geotransform, col, row):
+    return (geotransform[0] + col * geotransform[1] + row * geotransform[2],
+            geotransform[3] + col * geotransform[4] + row * geotransform[5])
+
+
+def extent(ds, srs):
+    """Four corner footprint in WGS84, in the order of gdal.Info's wgs84Extent"""
+    transform = osr.CoordinateTransformation(srs, spatial_reference(4326))
+    gt = ds.GetGeoTransform()
+    corners = [(0, 0), (0, ds.RasterYSize), (ds.RasterXSize, ds.RasterYSize), (ds.RasterXSize, 0), (0, 0)]
+    return [list(transform.TransformPoint(*pixel_coords(gt, col, row))[:2]) for col, row in corners]
+
+
+def ground_resolution(ds, srs):
+    """
+    GSD in metres, measured across the centre pixel in its UTM zone.  Equivalent to warping the raster to
+    UTM but without opening it again.
+    """
+    gt = ds.GetGeoTransform()
+    col, row = ds.RasterXSize / 2, ds.RasterYSize / 2
+    lon, lat = osr.CoordinateTransformation(srs, spatial_reference(4326)).TransformPoint(*pixel_coords(gt, col, row))[:2]
+    to_utm = osr.CoordinateTransformation(srs, spatial_reference(utm_epsg(lon, lat)))
+    x0, y0 = to_utm.TransformPoint(*pixel_coords(gt, col, row))[:2]
+    x1, y1 = to_utm.TransformPoint(*pixel_coords(gt, col + 1, row))[:2]
+    x2, y2 = to_utm.TransformPoint(*pixel_coords(gt, col, row + 1))[:2]
+    return float((np.hypot(x1 - x0, y1 - y0) + np.hypot(x2 - x0, y2 - y0)) / 2)
+
+
+def decimated_read(ds, scale=THUMBNAIL_SCALE):
+    """
+    Read every band at a fraction of full resolution in one call.  GDAL reads from overviews (or JPEG DCT
+    scaling) where it can, so the full resolution image is never decoded.
+    """
+    xsize = max(1, int(round(ds.RasterXSize * scale)))
+    ysize = max(1, int(round(ds.RasterYSize * scale)))
+    data = ds.ReadAsArray(buf_xsize=xsize, buf_ysize=ysize)
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    return data
+
+
+def valid_mask(data, nodata):
+    """A pixel is nodata when every band holds the nodata value"""
+    return np.any(data != nodata, axis=0)
+
+
+def band_statistics(data, mask):
+    valid = data[:, mask]
+    if not valid.size:
+        return []
+    return [
+        {
+            'minimum': float(band.min()),
+            'maximum': float(band.max()),
+            'mean': float(band.mean()),
+            'stddev': float(band.std())
+        } for band in valid
+    ]
+
+
+def mask_footprint(mask, geotransform, srs):
+    """
+    Polygonize the valid-data mask of a decimated read into a WGS84 footprint.  Holes left by dark pixels
+    inside the image are filled.
+    """
+    ysize, xsize = mask.shape
+    mem = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+    mem.SetGeoTransform(geotransform)
+    band = mem.GetRasterBand(1)
+    band.WriteArray(mask.astype(np.uint8))
+
+    source = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = source.CreateLayer('footprint', srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('valid', ogr.OFTInteger))
+    # Using the band as its own mask only polygonizes valid pixels
+    gdal.Polygonize(band, band, layer, 0)
+
+    pixel_size = abs(geotransform[1])
+    shells = ogr.Geometry(ogr.wkbMultiPolygon)
+    for feat in layer:
+        shell = ogr.Geometry(ogr.wkbPolygon)
+        shell.AddGeometry(feat.GetGeometryRef().GetGeometryRef(0))
+        if shell.GetArea() >= MIN_AREA_PIXELS * pixel_size ** 2:
+            shells.AddGeometry(shell)
+    if shells.IsEmpty():
+        return None
+
+    geom = shells.UnionCascaded().SimplifyPreserveTopology(pixel_size * SIMPLIFY_PIXELS)
+    geom.AssignSpatialReference(srs)
+    geom.TransformTo(spatial_reference(4326))
+    return geom
+
+
+def to_byte(data, mask):
+    if data.dtype == np.uint8:
+        return data
+    valid = data[:, mask] if mask.any() else data.reshape(len(data), -1)
+    low, high = float(valid.min()), float(valid.max())
+    scaled = (data.astype(np.float64) - low) * 255.0 / max(high - low, 1e-9)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def write_thumbnail(data, mask, outfile):
+    bands = to_byte(data[:3] if len(data) >= 3 else data[:1], mask)
+    mem = gdal.GetDriverByName('MEM').Create('', bands.shape[2], bands.shape[1], len(bands), gdal.GDT_Byte)
+    for idx, band in enumerate(bands):
+        mem.GetRasterBand(idx + 1).WriteArray(band)
+    gdal.GetDriverByName('JPEG').CreateCopy(outfile, mem)
+
+
+def summarize(infile, thumbnail=None, srs=None, scale=THUMBNAIL_SCALE):
+    """
+    Open a raster once and build its thumbnail, valid-data footprint and per-band statistics from a single
+    decimated read.  ``srs`` is used for rasters without an embedded spatial reference.  The footprint is None
+    when the raster isn't georeferenced or has no valid pixels.
+    """
+    ds = gdal.Open(infile)
+    if ds is None:
+        raise ValueError("Failed to open {}".format(infile))
+    data = decimated_read(ds, scale)
+
+    nodata = ds.GetRasterBand(1).GetNoDataValue()
+    mask = valid_mask(data, COLLAR_VALUE if nodata is None else nodata)
+    if thumbnail:
+        write_thumbnail(data, mask, thumbnail)
+
+    summary = {
+        'statistics': band_statistics(data, mask),
+        'nodata_fraction': round(1.0 - float(mask.mean()), 4),
+        'bbox': None,
+        'geometry': None
+    }
+
+    ds_srs = dataset_srs(ds, srs)
+    gt = ds.GetGeoTransform(can_return_null=True)
+    if ds_srs and gt:
+        xscale = ds.RasterXSize / data.shape[2]
+        yscale = ds.RasterYSize / data.shape[1]
+        decimated_gt = (gt[0], gt[1] * xscale, gt[2] * yscale, gt[3], gt[4] * xscale, gt[5] * yscale)
+        geom = mask_footprint(mask, decimated_gt, ds_srs)
+        if geom:
+            minx, maxx, miny, maxy = geom.GetEnvelope()
+            summary['bbox'] = [minx, miny, maxx, maxy]
+            summary['geometry'] = json.loads(geom.ExportToJson())
+    ds = None
+    return summary
@@ -0,0 +1,180 @@
+import os
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from disaster_data.download import remote_size
+from disaster_data.memory import monitor
+
+# Leave headroom on the 250 GB /data volume for thumbnails and the local catalog
+DISK_BUDGET = int(float(os.environ.get("DISK_BUDGET_GB", 200)) * 1024 ** 3)
+MAX_DOWNLOADS = int(os.environ.get("MAX_DOWNLOADS", 4))
+HEAD_THREADS = 16
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} TB".format(size)
+
+
+class ArchiveScheduler(object):
+
+    """
+    Download archives while keeping the projected disk footprint under a budget.
+
+    Every archive is sized with a HEAD request up front.  Downloads are admitted largest-first while they fit
+    in the budget (the smallest archive goes first so processing can start quickly), and each archive is
+    deleted as soon as the consumer has finished with it.  No further downloads are admitted while memory is
+    over the soft limit.
+    """
+
+    def __init__(self, archives, out_dir, budget=DISK_BUDGET, max_downloads=MAX_DOWNLOADS):
+        self.archives = archives
+        self.out_dir = out_dir
+        self.budget = budget
+        self.max_downloads = max_downloads
+        self.sizes = {}
+        self.used = 0
+
+    def _head(self, archive):
+        try:
+            size, _ = remote_size(archive.item['archive'])
+        except Exception as e:
+            print("Failed to size remote archive {}: {}".format(archive.item['archive'], e))
+            size = None
+        return archive, size
+
+    def size_archives(self):
+        with ThreadPoolExecutor(max_workers=HEAD_THREADS) as executor:
+            for archive, size in executor.map(self._head, self.archives):
+                # Archives of unknown size are only admitted when nothing else is on disk
+                self.sizes[id(archive)] = size if size is not None else self.budget
+        free = shutil.disk_usage(self.out_dir).free
+        if free < self.budget:
+            print("Reducing disk budget to the {} free on {}".format(format_bytes(free), self.out_dir))
+            self.budget = free
+
+    def size(self, archive):
+        return self.sizes[id(archive)]
+
+    def order(self):
+        ordered = sorted(self.archives, key=self.size, reverse=True)
+        if ordered:
+            ordered.insert(0, ordered.pop(-1))
+        return ordered
+
+    def next_admission(self, pending):
+        for archive in pending:
+            if self.used + self.size(archive) <= self.budget:
+                return archive
+        if self.used == 0 and pending:
+            print("Archive {} exceeds the disk budget, downloading on its own".format(pending[0].item['archive']))
+            return pending[0]
+        return None
+
+    def plan(self):
+        """
+        Simulate the schedule assuming archives are processed in the order they are admitted.
+        """
+        if not self.sizes:
+            self.size_archives()
+
+        pending = self.order()
+        on_disk = []
+        schedule = []
+        peak = 0
+        while pending:
+            archive = self.next_admission(pending)
+            if archive is None:
+                released = on_disk.pop(0)
+                self.used -= self.size(released)
+                continue
+            pending.remove(archive)
+            on_disk.append(archive)
+            self.used += self.size(archive)
+            peak = max(peak, self.used)
+            schedule.append({
+                'archive': archive.item['archive'],
+                'event_name': archive.item['event_name'],
+                'bytes': self.size(archive),
+                'footprint': self.used
+            })
+        self.used = 0
+        return {
+            'total_bytes': sum(self.size(x) for x in self.archives),
+            'peak_bytes': peak,
+            'budget': self.budget,
+            'schedule': schedule
+        }
+
+    def print_plan(self):
+        plan = self.plan()
+        print("Archives: {}".format(len(plan['schedule'])))
+        print("Expected download: {}".format(format_bytes(plan['total_bytes'])))
+        print("Peak disk footprint: {} (budget {})".format(format_bytes(plan['peak_bytes']), format_bytes(plan['budget'])))
+        for idx, entry in enumerate(plan['schedule']):
+            print("{:>4}  {:>10}  {:>10}  {}".format(
+                idx, format_bytes(entry['bytes']), format_bytes(entry['footprint']), entry['archive'])
+            )
+        return plan
+
+    def _download(self, archive, completed):
+        try:
+            archive.download(self.out_dir)
+            completed.put((archive, None))
+        except Exception as e:
+            completed.put((archive, e))
+
+    def release(self, archive):
+        archive.remove(self.out_dir)
+        self.used -= self.size(archive)
+
+    def run(self):
+        """
+        Yield archives as their downloads complete.  Each archive is removed from disk once the consumer asks
+        for the next one, or stops iterating.  Downloads still in flight when the consumer stops are removed as
+        they finish, so no archive keeps its share of the budget reserved.
+        """
+        if not self.sizes:
+            self.size_archives()
+
+        pending = self.order()
+        completed = queue.Queue()
+        downloading = 0
+        with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
+            try:
+                while pending or downloading:
+                    while pending and downloading < self.max_downloads:
+                        if downloading and monitor().over_limit():
+                            break
+                        archive = self.next_admission(pending)
+                        if archive is None:
+                            break
+                        pending.remove(archive)
+                        self.used += self.size(archive)
+                        downloading += 1
+                        executor.submit(self._download, archive, completed)
+
+                    if not downloading:
+                        break
+
+                    archive, error = completed.get()
+                    downloading -= 1
+                    if error:
+                        print("Failed to download {}: {}".format(archive.item['archive'], error))
+                        self.release(archive)
+                        continue
+
+                    try:
+                        yield archive
+                    finally:
+                        self.release(archive)
+                    monitor().guard(timeout=0)
+            finally:
+                while downloading:
+                    archive, _ = completed.get()
+                    downloading -= 1
+                    self.release(archive)
@@ -4,14 +4,20 @@ from urllib.parse import urljoin
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
+# Overridden to crawl a local copy of the site, see disaster_data.loadtest
+NOAA_STORM_URL = os.environ.get("NOAA_STORM_URL", "https://storms.ngs.noaa.gov/")
 
 class NoaaStormCatalog(scrapy.Spider):
     name = 'noaa-storm'
     start_urls = [
-        "https://storms.ngs.noaa.gov/"
+        NOAA_STORM_URL
     ]
     verbose = True
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen_images = set()
+
     @classmethod
     def crawl(cls, outfile='output.json', ids=None, items=False):
         cls.ids = ids
@@ -121,16 +127,17 @@ class NoaaStormCatalog(scrapy.Spider):
             yield scrapy.Request(os.path.join(os.path.dirname(response.url), index), callback=self.parse_map_index, meta=response.meta)
 
     def parse_map_index(self, response):
+        # urljoin normalizes relative links so Scrapy's duplicate filter catches pages reached from several maps
         map = response.xpath("//map/div/area/@href")
         for url in map:
-            yield scrapy.Request(os.path.join(os.path.dirname(response.url), url.get()), callback=self.parse_image_index, meta=response.meta)
+            yield scrapy.Request(response.urljoin(url.get()), callback=self.parse_image_index, meta=response.meta)
 
     def parse_image_index(self, response):
         map = response.xpath("//map/div/area/@href")
         for item in map:
             url = item.get()
             if url.endswith('.htm'):
-                yield scrapy.Request(os.path.join(os.path.dirname(response.url), url), callback=self.parse_image_page, meta=response.meta)
+                yield scrapy.Request(response.urljoin(url), callback=self.parse_image_page, meta=response.meta)
             else:
                 # There is no image page, just a JPG.  No world file either.
                 # Could potentially rebuild a world file but ignoring for now.
@@ -167,6 +174,9 @@ class NoaaStormCatalog(scrapy.Spider):
             elif rel == 'Metadata File':
                 payload.update({'metadata_url': urljoin(response.url, link[1:])})
 
-        # Only return the image if it has a world file
-        if 'world_file' in payload:
+        # Only return the image if it has a world file, and only once per image
+        if 'world_file' in payload and 'urls' in payload:
+            if payload['urls'][0] in self.seen_images:
+                return
+            self.seen_images.add(payload['urls'][0])
             yield payload
\ No newline at end of file
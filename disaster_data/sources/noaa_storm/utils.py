@@ -1,21 +1,35 @@
 import os
+import json
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-import multiprocessing
 import tempfile
 import subprocess
 import shutil
 
 from satstac import Collection, Catalog, Item
 
+from disaster_data.catalog.index import ItemIndex, MANIFEST_NAME
+from disaster_data.catalog.changes import ChangeFeed
+from disaster_data.catalog.links import item_key
+from disaster_data.catalog.summaries import Summary, SUMMARIES_NAME
+from disaster_data.catalog.publish import publish
+from disaster_data.memory import monitor
 from disaster_data.scraping import ScrapyRunner
 from disaster_data.sources.noaa_storm.spider import NoaaStormCatalog
 from disaster_data.sources.noaa_storm.fgdc import parse_fgdc, temporal_window
 from disaster_data.sources.noaa_storm.assets import ObliqueArchive, RGBArchive, JpegTilesArchive
+from disaster_data.sources.noaa_storm.scheduler import ArchiveScheduler, DISK_BUDGET
+from disaster_data.sources.noaa_storm.old_format import build_old_items
 
-ROOT_URL = 'https://cognition-disaster-data.s3.amazonaws.com'
-NOAA_STORM_ROOT = 'https://cognition-disaster-data.s3.amazonaws.com/NOAAStorm'
-MAX_THREADS = int(os.environ.get("MAX_THREADS", multiprocessing.cpu_count() * 5))
+ROOT_URL = os.environ.get("CATALOG_ROOT_URL", 'https://cognition-disaster-data.s3.amazonaws.com')
+NOAA_STORM_ROOT = ROOT_URL + '/NOAAStorm'
+CATALOG_BUCKET = 'cognition-disaster-data'
+# Scratch space for catalogs, thumbnails and archives, emptied at the end of a run
+DATA_DIR = os.environ.get("DATA_DIR", '/data/')
+ARCHIVE_TYPES = {
+    'rgb': RGBArchive,
+    'jpeg-tiles': JpegTilesArchive,
+    'oblique': ObliqueArchive,
+}
 
 def cleanup(folder):
     for the_file in os.listdir(folder):
@@ -27,30 +41,29 @@ def cleanup(folder):
         except Exception as e:
             print(e)
 
+def archive_type(item):
+    """Type of archive a scraped item points at, None for anything which isn't a supported archive"""
+    archive = item.get('archive', '')
+    if archive.endswith('_RGB.tar'):
+        return 'rgb'
+    elif archive.endswith(('GCS_NAD83.tar', 'GCS_NAD83.zip')):
+        return 'jpeg-tiles'
+    elif archive.endswith(('Oblique.tar', 'Oblique.zip')):
+        return 'oblique'
+    return None
+
+def s3_sync(src, dest):
+    # The AWS CLI doesn't read the endpoint overrides of disaster_data.aws
+    endpoint_url = os.environ.get("S3_ENDPOINT_URL", os.environ.get("AWS_ENDPOINT_URL"))
+    flags = f" --endpoint-url {endpoint_url}" if endpoint_url else ""
+    subprocess.call(f"aws s3 sync {src} {dest}{flags}", shell=True)
+
 def load_datetime(date_str):
     try:
         return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ")
     except:
         return datetime.strptime(date_str, "%Y-%m-%d")
 
-def download_archives(archives, out_dir):
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        [executor.submit(x.download(out_dir=out_dir), x) for x in archives]
-    return
-
-def _build_stac_items(asset):
-    return asset.build_items()
-
-def build_stac_items(assets):
-    for asset in assets:
-        for stac_item in asset.build_items():
-            yield stac_item
-
-def build_thumbnails(archives, thumbdir):
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        [executor.submit(x.build_thumbnails(dir=os.path.join(thumbdir, x.item['event_name'])), x) for x in archives]
-    return
-
 def create_collections(collections, items, id_list):
     id_list = [x+'@storm' for x in id_list]
     out_collections = []
@@ -96,7 +109,10 @@ def create_collections(collections, items, id_list):
         # If this happens, use the date from a stac item as the starting extent.
         # Extent will be updated automatic ally as items are ingested with sat-stac
         if coll['extent']['temporal'][0].endswith('-') or coll['extent']['temporal'][1].endswith('-'):
-            if val['archive'].endswith('GCS_NAD83.tar'):
+            if 'archive' not in val:
+                # Old-format image pages carry their own acquisition time
+                coll['extent']['temporal'] = [val['datetime'], val['datetime']]
+            elif val['archive'].endswith('GCS_NAD83.tar'):
                 coll['extent']['temporal'][0] += val['archive'].split('/')[-1].split('_')[0][6:8]
                 coll['extent']['temporal'][1] += val['archive'].split('/')[-1].split('_')[0][6:8]
             elif val['archive'].endswith('Oblique.tar'):
@@ -108,19 +124,61 @@ def create_collections(collections, items, id_list):
         out_collections.append(coll)
     return out_collections
 
-def build_stac_catalog(id_list=None, verbose=False):
-    prefix = '/data/'
+def add_item(collections, item):
+    """
+    Add a STAC item to its collection and update the extent of the collection.
+    """
+    collection = collections[item['collection']]
+    collection.add_item(Item(item), path='${date}', filename='${id}')
+
+    # Update spatial extent of collection
+    try:
+        if item['bbox'][0] < collection.extent['spatial'][0]:
+            collection.extent['spatial'][0] = item['bbox'][0]
+        if item['bbox'][1] < collection.extent['spatial'][1]:
+            collection.extent['spatial'][1] = item['bbox'][1]
+        if item['bbox'][2] > collection.extent['spatial'][2]:
+            collection.extent['spatial'][2] = item['bbox'][2]
+        if item['bbox'][3] > collection.extent['spatial'][3]:
+            collection.extent['spatial'][3] = item['bbox'][3]
+    except:
+        collection.extent['spatial'] = item['bbox']
+
+    # Update temporal extent of collection
+    try:
+        item_dt = load_datetime(item['properties']['datetime'])
+        min_dt = load_datetime(collection.extent['temporal'][0])
+        max_dt = load_datetime(collection.extent['temporal'][1])
+        if item_dt < min_dt:
+            collection.extent['temporal'][0] = item['properties']['datetime']
+        if item_dt > max_dt:
+            collection.extent['temporal'][1] = item['properties']['datetime']
+    except:
+        collection.extent['temporal'] = [item['properties']['datetime'], item['properties']['datetime']]
+
+def item_href(item):
+    """Published location of an item, matching the ${date}/${id} layout used by add_item"""
+    date = item['properties']['datetime'].split('T')[0]
+    return os.path.join(NOAA_STORM_ROOT, item['collection'], date, item['id'] + '.json')
+
+def build_stac_catalog(id_list=None, verbose=False, disk_budget=None, plan=False, cog=False, metadata='tile-index',
+                       tiles=False, publish_mode='diff'):
+    prefix = DATA_DIR
     tempdir = tempfile.mkdtemp(prefix=prefix)
     tempthumbs = tempfile.mkdtemp(prefix=prefix)
+    # COGs are uploaded and removed as soon as they are built
+    cogdir = tempfile.mkdtemp(prefix=prefix) if cog else None
 
     print("Catalog tempdir: {}".format(tempdir))
     print("Thumbnails tempdir: {}".format(tempthumbs))
 
     NoaaStormCatalog.verbose = verbose
+    memory = monitor()
 
     print("Running web scraper.")
     with ScrapyRunner(NoaaStormCatalog) as runner:
-        scraped_items = list(runner.execute(ids=id_list))
+        with memory.stage('scrape'):
+            scraped_items = list(runner.execute(ids=id_list))
         collections = scraped_items.pop(0)
         item_count = scraped_items.pop(0)
 
@@ -154,56 +212,98 @@ def build_stac_catalog(id_list=None, verbose=False):
 
         # Sort assets
         archive_assets = []
+        old_format_items = []
         for item in scraped_items:
             if 'archive' in item:
-                if item['archive'].endswith('_RGB.tar'):
-                    archive_assets.append(RGBArchive(item, os.path.join(thumbdir, d[item['event_name']].id)))
-                elif item['archive'].endswith(('GCS_NAD83.tar', 'GCS_NAD83.zip')):
-                    archive_assets.append(JpegTilesArchive(item, os.path.join(thumbdir, d[item['event_name']].id)))
-                elif item['archive'].endswith(('Oblique.tar', 'Oblique.zip')):
-                    archive_assets.append(ObliqueArchive(item, os.path.join(thumbdir, d[item['event_name']].id)))
+                kind = archive_type(item)
+                if kind:
+                    archive_assets.append(ARCHIVE_TYPES[kind](item, os.path.join(thumbdir, d[item['event_name']].id), cogdir=cogdir, metadata=metadata))
+            elif item.get('type') == 'old':
+                old_format_items.append(item)
+
+        scheduler = ArchiveScheduler(archive_assets, prefix, budget=disk_budget or DISK_BUDGET)
+        if plan:
+            print("Old-format images (not downloaded): {}".format(len(old_format_items)))
+            scheduler.print_plan()
+            for folder in (tempdir, tempthumbs, cogdir):
+                if folder:
+                    shutil.rmtree(folder)
+            return
+
+        # Collections are rebuilt from scratch: items of the last run which aren't built again are removed, and
+        # items built again are only reported as updated if their content changed
+        previous = {coll: ItemIndex.load(os.path.join(NOAA_STORM_ROOT, coll, 'catalog.json')) for coll in d}
+        indexes = {coll: ItemIndex() for coll in d}
+        feed = ChangeFeed(CATALOG_BUCKET, 'noaa-storm')
+        reindexed = []
+        # Summaries are rebuilt along with the collections, so nothing published before is merged in
+        summaries = {coll: Summary() for coll in d}
+
+        def ingest(item):
+            add_item(d, item)
+            if item in previous[item['collection']]:
+                reindexed.append({k: item.get(k) for k in ('id', 'collection', 'bbox', 'properties')})
             else:
-                print("Found a JPG with disconnected world file")
+                feed.added(item, item_href(item))
+            summaries[item['collection']].add(item)
+            indexes[item['collection']].add(item, item_href(item))
 
-        # Download archives
-        download_archives(archive_assets, prefix)
+        if old_format_items:
+            print("Creating old-format items.")
+            with memory.stage('old-format items'):
+                for item in build_old_items(old_format_items):
+                    ingest(item)
+        # Scraped pages are no longer needed once the assets are sorted
+        del scraped_items, old_format_items
 
         print("Creating items and thumbnails.")
-        # Add items
-        for item in build_stac_items(archive_assets):
-            d[item['collection']].add_item(Item(item), path='${date}', filename='${id}')
-
-            # Update spatial extent of collection
-            try:
-                if item['bbox'][0] < d[item['collection']].extent['spatial'][0]:
-                    d[item['collection']].extent['spatial'][0] = item['bbox'][0]
-                if item['bbox'][1] < d[item['collection']].extent['spatial'][1]:
-                    d[item['collection']].extent['spatial'][1] = item['bbox'][1]
-                if item['bbox'][2] < d[item['collection']].extent['spatial'][2]:
-                    d[item['collection']].extent['spatial'][2] = item['bbox'][2]
-                if item['bbox'][3] < d[item['collection']].extent['spatial'][3]:
-                    d[item['collection']].extent['spatial'][3] = item['bbox'][3]
-            except:
-                d[item['collection']].extent['spatial'] =  item['bbox']
-
-            # Update temporal extent of collection
-            try:
-                item_dt = load_datetime(item['properties']['datetime'])
-                min_dt = load_datetime(d[item['collection']].extent['temporal'][0])
-                max_dt = load_datetime(d[item['collection']].extent['temporal'][1])
-                if item_dt < min_dt:
-                    d[item['collection']].extent['temporal'][0] = item['properties']['datetime']
-                if item_dt > max_dt:
-                    d[item['collection']].extent['temporal'][1] = item['properites']['datetime']
-            except:
-                d[item['collection']].extent['temporal'] = [item['properties']['datetime'], item['properties']['datetime']]
-
-    # Upload catalog to S3
-    print("Uploading catalog to S3.")
-    subprocess.call(f"aws s3 sync {tempdir} s3://cognition-disaster-data/", shell=True)
-
-    print("Uploading thumbnails to S3.")
-    # Upload thumbnails to S3
-    subprocess.call(f"aws s3 sync {thumbdir} s3://cognition-disaster-data/thumbnails/", shell=True)
+        # Archives are downloaded within the disk budget and removed once their items are built
+        with memory.stage('archives'):
+            for archive in scheduler.run():
+                for item in archive.build_items():
+                    ingest(item)
+
+        # Manifests let the next run load the previous state without walking the collections
+        for coll, index in indexes.items():
+            for id in sorted(previous[coll].ids - index.ids):
+                feed.removed({'id': id, 'collection': coll}, previous[coll].items.get(id))
+            os.makedirs(os.path.join(tempdir, 'NOAAStorm', coll), exist_ok=True)
+            index.save(os.path.join(tempdir, 'NOAAStorm', coll, MANIFEST_NAME))
+
+        for coll, summary in summaries.items():
+            summary_path = os.path.join(tempdir, 'NOAAStorm', coll, SUMMARIES_NAME)
+            with open(summary_path, 'w') as f:
+                json.dump(summary.to_dict(), f)
+            d[coll].data['summaries'] = summary.stac_summaries()
+            d[coll].save()
+
+    with memory.stage('upload'):
+        print("Uploading catalog and thumbnails to S3.")
+        if publish_mode == 'diff':
+            # Only objects whose content changed since the last run are uploaded.  The root catalog was read from
+            # the bucket and is left to the flows which add sources to it.
+            changed = set(publish([(os.path.join(tempdir, 'NOAAStorm'), 'NOAAStorm'), (thumbdir, 'thumbnails')],
+                                  CATALOG_BUCKET))
+        else:
+            s3_sync(tempdir, f"s3://{CATALOG_BUCKET}/")
+            s3_sync(thumbdir, f"s3://{CATALOG_BUCKET}/thumbnails/")
+            # Without content hashes every reindexed item is reported
+            changed = None
+
+        for item in reindexed:
+            if changed is None or item_key(item, 'NOAAStorm') in changed:
+                feed.updated(item, item_href(item))
+
+        # Published last so consumers never see changes before the objects exist
+        feed.publish()
+
+    if tiles:
+        from disaster_data.tiles import publish_tiles
+
+        # Pyramids are rendered from the published COGs, archive members can't be read once removed
+        with memory.stage('tiles'):
+            publish_tiles(CATALOG_BUCKET, 'NOAAStorm', [coll for coll, x in summaries.items() if len(x)], ROOT_URL)
+
+    memory.print_report()
 
     cleanup(prefix)
\ No newline at end of file
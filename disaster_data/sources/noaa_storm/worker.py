@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import posixpath
+
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint
+from disaster_data.queues import open_queue, Heartbeat, VISIBILITY_TIMEOUT
+from disaster_data.catalog.index import ItemIndex
+from disaster_data.catalog.links import LinkLog, put_json, get_json
+from disaster_data.catalog.summaries import SummaryLog, summarize
+from disaster_data.scraping import ScrapyRunner
+from disaster_data.sources.noaa_storm.spider import NoaaStormCatalog
+from disaster_data.sources.noaa_storm.assets import THUMBNAIL_BUCKET, THUMBNAIL_KEY_PREFIX
+from disaster_data.sources.noaa_storm.old_format import build_old_items
+from disaster_data.sources.noaa_storm.utils import (create_collections, archive_type, ARCHIVE_TYPES, CATALOG_BUCKET,
+                                                   NOAA_STORM_ROOT)
+
+CATALOG_PREFIX = 'NOAAStorm'
+# Seconds a worker waits on an empty queue before exiting
+IDLE_TIMEOUT = int(os.environ.get("WORKER_IDLE_TIMEOUT", 60))
+
+
+def write_collection(collection):
+    """Write a collection which isn't published yet and log its link from the NOAA Storm catalog"""
+    key = posixpath.join(CATALOG_PREFIX, collection['id'], 'catalog.json')
+    if get_json(CATALOG_BUCKET, key) is None:
+        put_json(CATALOG_BUCKET, key, dict(collection, links=[
+            {'rel': 'self', 'href': 'https://{}.s3.amazonaws.com/{}'.format(CATALOG_BUCKET, key)},
+            {'rel': 'parent', 'href': '../catalog.json'},
+            {'rel': 'root', 'href': '../../catalog.json'},
+        ]))
+    return key
+
+
+def new_items(items, indexes):
+    """
+    Items missing from the manifest of their collection.  Items already published are counted in its summary,
+    so only these are summarized.  The manifests are updated by compact-catalog as it links the items.
+    ``indexes`` caches the loaded manifests by collection id.
+    """
+    for item in items:
+        coll = item['collection']
+        if coll not in indexes:
+            indexes[coll] = ItemIndex.load(os.path.join(NOAA_STORM_ROOT, coll, 'catalog.json'))
+        if item not in indexes[coll]:
+            yield item
+
+
+def enqueue(id_list, queue_url, verbose=False):
+    """
+    Crawl NOAA Storm and fan the archives out as one job each.  Collections and old-format items, which
+    don't need any downloads, are written here.
+    """
+    queue = open_queue(queue_url)
+    NoaaStormCatalog.verbose = verbose
+
+    print("Running web scraper.")
+    with ScrapyRunner(NoaaStormCatalog) as runner:
+        scraped_items = list(runner.execute(ids=id_list))
+    collections = scraped_items.pop(0)
+    scraped_items.pop(0)
+    collections = create_collections(collections, scraped_items, id_list)
+
+    jobs = []
+    old_format_items = []
+    for item in scraped_items:
+        kind = archive_type(item)
+        if kind:
+            jobs.append(json.dumps({'type': kind, 'archive': item['archive'], 'event_name': item['event_name'],
+                                    'item': item}))
+        elif item.get('type') == 'old':
+            old_format_items.append(item)
+
+    with LinkLog(CATALOG_BUCKET, CATALOG_PREFIX) as log:
+        for collection in collections:
+            log.add_link(posixpath.join(CATALOG_PREFIX, 'catalog.json'),
+                         {'rel': 'child', 'href': './{}/catalog.json'.format(collection['id'])},
+                         key=write_collection(collection))
+        if old_format_items:
+            print("Creating old-format items.")
+            old_items = list(build_old_items(old_format_items))
+            for item in old_items:
+                log.add_item(item)
+            with SummaryLog(CATALOG_BUCKET, CATALOG_PREFIX) as summary_log:
+                summary_log.add(summarize(new_items(old_items, {})))
+
+    queue.send(jobs)
+    print("Enqueued {} archives from {} collections.".format(len(jobs), len(collections)))
+    return len(jobs)
+
+
+def upload_thumbnails(thumbdir, event_name):
+    for dirpath, _, filenames in os.walk(thumbdir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            key = posixpath.join(THUMBNAIL_KEY_PREFIX, event_name, os.path.relpath(path, thumbdir).replace(os.sep, '/'))
+            endpoint('s3').call(client('s3').upload_file, path, THUMBNAIL_BUCKET, key,
+                                ExtraArgs={'ContentType': 'image/jpeg'})
+
+
+def job_name(job):
+    return hashlib.sha1(job['archive'].encode('utf-8')).hexdigest()
+
+
+def process_job(job, out_dir, log, summary_log, indexes, cog=False, metadata='tile-index'):
+    """Download one archive, write its items, summary and thumbnails, and remove everything local again"""
+    thumbdir = tempfile.mkdtemp(dir=out_dir)
+    cogdir = tempfile.mkdtemp(dir=out_dir) if cog else None
+    archive = ARCHIVE_TYPES[job['type']](job['item'], thumbdir, cogdir=cogdir, metadata=metadata)
+    try:
+        archive.download(out_dir)
+        items = []
+        for item in archive.build_items():
+            log.add_item(item)
+            items.append(item)
+        upload_thumbnails(thumbdir, job['event_name'])
+        # The job is acknowledged after this, so its links and summary must be written first
+        log.flush()
+        summary_log.add(summarize(new_items(items, indexes)))
+        summary_log.flush(name=job_name(job))
+        return len(items)
+    finally:
+        archive.remove(out_dir)
+        for folder in (thumbdir, cogdir):
+            if folder:
+                shutil.rmtree(folder, ignore_errors=True)
+
+
+def run_worker(queue_url, out_dir='/data/', max_jobs=None, idle_timeout=IDLE_TIMEOUT, cog=False,
+               metadata='tile-index', visibility=VISIBILITY_TIMEOUT):
+    """
+    Process archive jobs until the queue stays empty for ``idle_timeout`` seconds.  A job is acknowledged only
+    once its items, links, summary and thumbnails are written.  Failed jobs are left on the queue to be retried by
+    another worker once their visibility timeout lapses.
+    """
+    queue = open_queue(queue_url)
+    os.makedirs(out_dir, exist_ok=True)
+    processed = 0
+    failed = 0
+    idle_since = time.monotonic()
+    summary_log = SummaryLog(CATALOG_BUCKET, CATALOG_PREFIX)
+    indexes = {}
+    with LinkLog(CATALOG_BUCKET, CATALOG_PREFIX) as log:
+        while max_jobs is None or processed < max_jobs:
+            messages = queue.receive(max_messages=1, wait=min(20, idle_timeout), visibility=visibility)
+            if not messages:
+                if time.monotonic() - idle_since >= idle_timeout:
+                    break
+                continue
+            message = messages[0]
+            job = json.loads(message.body)
+            started = time.monotonic()
+            try:
+                with Heartbeat(queue, message, visibility):
+                    count = process_job(job, out_dir, log, summary_log, indexes, cog=cog, metadata=metadata)
+            except Exception as e:
+                print("Failed to process {}: {}".format(job['archive'], e))
+                failed += 1
+            else:
+                queue.ack(message)
+                processed += 1
+                print("Processed {} ({} items) in {:.0f}s.".format(job['archive'], count, time.monotonic() - started))
+            idle_since = time.monotonic()
+
+    print("Worker finished: {} archives processed, {} failed.".format(processed, failed))
+    return processed
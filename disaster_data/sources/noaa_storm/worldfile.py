@@ -0,0 +1,92 @@
+import struct
+
+import numpy as np
+
+# Start of frame markers carry the image dimensions (DHT, JPG and DAC share the range but don't)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+# Metres per degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE_LAT = 110574.0
+METERS_PER_DEGREE_LON = 111320.0
+
+
+def parse_world_file(text):
+    """
+    Return the six affine coefficients (A, D, B, E, C, F) of a world file.
+    """
+    values = [float(x) for x in text.split()]
+    if len(values) != 6:
+        raise ValueError("World file must contain six coefficients, found {}".format(len(values)))
+    return values
+
+
+def jpeg_dimensions(f):
+    """
+    Return the (width, height) of a JPEG by reading markers up to the start of frame header.  Returns None if
+    the stream ends before the header is found.
+    """
+    if f.read(2) != b'\xff\xd8':
+        raise ValueError("Not a JPEG file")
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2:
+            return None
+        # Markers may be preceded by any number of 0xFF fill bytes
+        while marker == b'\xff\xff':
+            marker = b'\xff' + f.read(1)
+        if len(marker) < 2:
+            return None
+        if marker[0] != 0xFF:
+            raise ValueError("Invalid JPEG marker")
+        code = marker[1]
+        if code in STANDALONE_MARKERS:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack('>H', length)[0]
+        if code in SOF_MARKERS:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            _, height, width = struct.unpack('>BHH', header)
+            return width, height
+        if code == 0xDA:
+            # Start of scan without a frame header
+            return None
+        if len(f.read(length - 2)) < length - 2:
+            return None
+
+
+def footprints(transforms, sizes):
+    """
+    Compute footprints, bounding boxes and GSD (metres) for a batch of geographic images.
+
+    ``transforms`` is an (n, 6) array of world file coefficients and ``sizes`` an (n, 2) array of
+    (width, height).  Returns ``(corners, bboxes, gsd)`` where corners is (n, 5, 2) in the order of
+    gdal.Info's wgs84Extent (upper-left, lower-left, lower-right, upper-right, upper-left).
+    """
+    transforms = np.asarray(transforms, dtype=np.float64).reshape(-1, 6)
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    a, d, b, e, c, f = transforms.T
+    width, height = sizes.T
+
+    # World files reference the centre of the upper-left pixel
+    x0 = c - (a + b) / 2
+    y0 = f - (d + e) / 2
+
+    cols = np.array([0, 0, 1, 1, 0], dtype=np.float64)
+    rows = np.array([0, 1, 1, 0, 0], dtype=np.float64)
+    xs = x0[:, None] + a[:, None] * cols * width[:, None] + b[:, None] * rows * height[:, None]
+    ys = y0[:, None] + d[:, None] * cols * width[:, None] + e[:, None] * rows * height[:, None]
+    corners = np.stack([xs, ys], axis=-1)
+
+    bboxes = np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=-1)
+
+    # Convert the pixel size from degrees to metres at the centre of each image
+    lat = np.radians((bboxes[:, 1] + bboxes[:, 3]) / 2)
+    xres = np.hypot(a, d) * METERS_PER_DEGREE_LON * np.cos(lat)
+    yres = np.hypot(b, e) * METERS_PER_DEGREE_LAT
+    gsd = (xres + yres) / 2
+    return corners, bboxes, gsd
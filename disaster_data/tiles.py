@@ -0,0 +1,245 @@
+import os
+import math
+import tempfile
+import posixpath
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+from osgeo import gdal
+
+from disaster_data.aws import client
+from disaster_data.endpoints import endpoint
+from disaster_data.utils import VSICURL_OPTIONS
+from disaster_data.rangecache import vsicurl
+from disaster_data.pmtiles import PMTilesWriter, MEDIA_TYPE
+from disaster_data.catalog.index import walk_catalog
+from disaster_data.catalog.links import get_json, put_json
+
+TILES_NAME = 'tiles.pmtiles'
+TILE_SIZE = 256
+MAX_ZOOM = int(os.environ.get("TILES_MAX_ZOOM", 18))
+TILE_PROCESSES = int(os.environ.get("TILE_PROCESSES", multiprocessing.cpu_count()))
+# Half the circumference of the earth in web mercator metres
+ORIGIN = 20037508.342789244
+MAX_LAT = 85.0511287798
+# Datasets kept open by each render process, so consecutive tiles of a raster reuse its headers
+OPEN_DATASETS = 64
+# NOAA and DG imagery rarely declares nodata, their collars are black
+COLLAR_VALUE = 0
+JPEG_OPTIONS = ['QUALITY=85']
+PNG_OPTIONS = ['ZLEVEL=6']
+
+
+def lonlat_to_tile(lon, lat, z):
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    n = 1 << z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(z, x, y):
+    """Web mercator bounds of a tile as ``(minx, miny, maxx, maxy)``"""
+    size = 2 * ORIGIN / (1 << z)
+    return -ORIGIN + x * size, ORIGIN - (y + 1) * size, -ORIGIN + (x + 1) * size, ORIGIN - y * size
+
+
+def tiles_for_bbox(bbox, z):
+    x0, y0 = lonlat_to_tile(bbox[0], bbox[3], z)
+    x1, y1 = lonlat_to_tile(bbox[2], bbox[1], z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def zoom_for_gsd(gsd, lat=0):
+    """First zoom level whose pixels are at least as fine as ``gsd`` metres at latitude ``lat``"""
+    resolution = 2 * ORIGIN * math.cos(math.radians(lat)) / TILE_SIZE
+    return max(0, int(math.ceil(math.log2(resolution / gsd))))
+
+
+def collection_sources(collection_url):
+    """
+    GeoTIFF data assets of the items below a collection, oldest first so newer imagery is drawn on top.  Data
+    assets inside archives (NOAA Storm items indexed without ``--cog``) can't be read remotely and are skipped.
+    """
+    sources = []
+    for _, item in walk_catalog(collection_url):
+        data = item.get('assets', {}).get('data', {})
+        if not data.get('type', '').startswith('image/x.geotiff') or not item.get('bbox'):
+            continue
+        sources.append({
+            'href': data['href'],
+            'bbox': item['bbox'],
+            'datetime': item['properties'].get('datetime', ''),
+            'gsd': item['properties'].get('eo:gsd'),
+        })
+    return sorted(sources, key=lambda x: x['datetime'])
+
+
+def tile_jobs(sources, min_zoom, max_zoom):
+    """``(z, x, y, source indices)`` of every tile covered by a source, zoom level by zoom level"""
+    for z in range(min_zoom, max_zoom + 1):
+        tiles = {}
+        for idx, source in enumerate(sources):
+            for x, y in tiles_for_bbox(source['bbox'], z):
+                tiles.setdefault((x, y), []).append(idx)
+        for (x, y), indices in sorted(tiles.items()):
+            yield z, x, y, indices
+        del tiles
+
+
+# State of each render process, set once by init_renderer rather than pickled with every tile
+_hrefs = []
+_tile_format = 'png'
+_datasets = OrderedDict()
+
+
+def init_renderer(hrefs, tile_format):
+    global _hrefs, _tile_format
+    _hrefs = hrefs
+    _tile_format = tile_format
+    for k, v in VSICURL_OPTIONS.items():
+        gdal.SetConfigOption(k, v)
+
+
+def open_source(href):
+    if href not in _datasets:
+        _datasets[href] = gdal.Open(vsicurl(href))
+        if len(_datasets) > OPEN_DATASETS:
+            _datasets.popitem(last=False)
+    _datasets.move_to_end(href)
+    return _datasets[href]
+
+
+def warp_tile(ds, z, x, y):
+    """
+    RGB and alpha of a source within a tile.  gdal.Warp reads from the source's overviews whenever the tile is
+    coarser than the full resolution, so low zooms of COGs only touch a few blocks.
+    """
+    warped = gdal.Warp('', ds, format='MEM', outputBounds=tile_bounds(z, x, y), width=TILE_SIZE, height=TILE_SIZE,
+                       dstSRS='EPSG:3857', resampleAlg='bilinear', srcNodata=COLLAR_VALUE, dstAlpha=True,
+                       outputType=gdal.GDT_Byte, warpOptions=['UNIFIED_SRC_NODATA=YES'])
+    bands = warped.ReadAsArray()
+    alpha = bands[-1]
+    rgb = bands[:3] if len(bands) > 3 else np.repeat(bands[:1], 3, axis=0)
+    return rgb, alpha
+
+
+def encode_tile(tile):
+    opaque = tile[3].min() == 255
+    bands = 3 if opaque or _tile_format == 'jpeg' else 4
+    mem = gdal.GetDriverByName('MEM').Create('', TILE_SIZE, TILE_SIZE, bands, gdal.GDT_Byte)
+    for idx in range(bands):
+        mem.GetRasterBand(idx + 1).WriteArray(tile[idx])
+
+    path = '/vsimem/tile_{}.{}'.format(os.getpid(), _tile_format)
+    driver, options = ('JPEG', JPEG_OPTIONS) if _tile_format == 'jpeg' else ('PNG', PNG_OPTIONS)
+    gdal.GetDriverByName(driver).CreateCopy(path, mem, options=options)
+    f = gdal.VSIFOpenL(path, 'rb')
+    gdal.VSIFSeekL(f, 0, 2)
+    length = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    data = gdal.VSIFReadL(1, length, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(path)
+    gdal.Unlink(path + '.aux.xml')
+    return data
+
+
+def render_tile(job):
+    """Composite the sources of a tile, returning ``(z, x, y, data)`` with no data for blank tiles"""
+    z, x, y, indices = job
+    tile = np.zeros((4, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    for idx in indices:
+        try:
+            rgb, alpha = warp_tile(open_source(_hrefs[idx]), z, x, y)
+        except Exception as e:
+            print("Failed to render {} into {}/{}/{}: {}".format(_hrefs[idx], z, x, y, e))
+            continue
+        mask = alpha > 0
+        tile[:3, mask] = rgb[:, mask]
+        tile[3][mask] = alpha[mask]
+    if not tile[3].any():
+        return z, x, y, None
+    return z, x, y, encode_tile(tile)
+
+
+def build_pyramid(sources, path, min_zoom=0, max_zoom=None, tile_format='png', num_processes=TILE_PROCESSES,
+                  metadata=None):
+    """
+    Render sources into a web mercator tile pyramid packed into a single PMTiles archive at ``path``.  Tiles are
+    rendered in parallel processes, each warping only the sources whose bbox overlaps the tile.  Returns the
+    number of tiles written.
+    """
+    if max_zoom is None:
+        lat = sum(x['bbox'][1] + x['bbox'][3] for x in sources) / (2 * len(sources))
+        gsd = min([x['gsd'] for x in sources if x['gsd']] or [1])
+        max_zoom = min(MAX_ZOOM, zoom_for_gsd(gsd, lat))
+    bounds = [min(x['bbox'][0] for x in sources), min(x['bbox'][1] for x in sources),
+              max(x['bbox'][2] for x in sources), max(x['bbox'][3] for x in sources)]
+    print("Rendering zooms {}-{} from {} rasters.".format(min_zoom, max_zoom, len(sources)))
+
+    writer = PMTilesWriter(path, tile_format)
+    try:
+        with multiprocessing.Pool(num_processes, initializer=init_renderer,
+                                  initargs=([x['href'] for x in sources], tile_format)) as pool:
+            for z, x, y, data in pool.imap_unordered(render_tile, tile_jobs(sources, min_zoom, max_zoom),
+                                                     chunksize=16):
+                if data:
+                    writer.add(z, x, y, data)
+        if not len(writer):
+            writer.close()
+            return 0
+        # The zoom at which the whole event fits a couple of tiles
+        span = max(bounds[2] - bounds[0], bounds[3] - bounds[1], 1e-6)
+        center_zoom = min(max_zoom, max(min_zoom, int(math.log2(360 / span))))
+        writer.finish(bounds, dict(metadata or {}, format=tile_format, bounds=bounds, minzoom=min_zoom,
+                                   maxzoom=max_zoom, sources=len(sources)), center_zoom=center_zoom)
+    except Exception:
+        writer.close()
+        raise
+    return len(writer)
+
+
+def add_tiles_link(bucket, collection_key):
+    """Link the tile archive from its collection, once"""
+    collection = get_json(bucket, collection_key)
+    if collection is None or any(x['rel'] == 'tiles' for x in collection['links']):
+        return
+    collection['links'].append({
+        'rel': 'tiles', 'href': './' + TILES_NAME, 'type': MEDIA_TYPE, 'title': 'Web mercator tile pyramid'
+    })
+    put_json(bucket, collection_key, collection)
+
+
+def publish_tiles(bucket, prefix, collection_ids, root_url, link=True, out_dir=None, **kwargs):
+    """
+    Build the tile archive of each collection from the items already published, upload it next to the
+    collection and link it from there.  ``link`` is off when another writer owns the collection documents.
+    """
+    published = {}
+    for coll_id in collection_ids:
+        collection_key = posixpath.join(prefix, coll_id, 'catalog.json')
+        sources = collection_sources(posixpath.join(root_url, collection_key))
+        if not sources:
+            print("No GeoTIFF data assets in {}, skipping tiles.".format(coll_id))
+            continue
+
+        fd, path = tempfile.mkstemp(suffix='.pmtiles', dir=out_dir)
+        os.close(fd)
+        try:
+            count = build_pyramid(sources, path, metadata={'name': coll_id}, **kwargs)
+            if not count:
+                print("No tiles rendered for {}.".format(coll_id))
+                continue
+            key = posixpath.join(prefix, coll_id, TILES_NAME)
+            endpoint('s3').call(client('s3').upload_file, path, bucket, key, ExtraArgs={'ContentType': MEDIA_TYPE})
+        finally:
+            os.unlink(path)
+        if link:
+            add_tiles_link(bucket, collection_key)
+        published[coll_id] = count
+        print("Published {} tiles for {}.".format(count, coll_id))
+    return published
@@ -1,15 +1,92 @@
 import os
+import re
+import itertools
+from contextlib import contextmanager
 from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from osgeo import gdal
 
+from disaster_data.endpoints import endpoint, host, RetryableError
+from disaster_data.rangecache import vsicurl
+
+# GDAL configuration for reading raster headers over /vsicurl/ without listing directories or probing for
+# sidecar files, each of which is an extra request per raster
+VSICURL_OPTIONS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.TIF,.tiff,.TIFF',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'VSI_CACHE': 'TRUE',
+    'GDAL_PAM_ENABLED': 'NO',
+}
+
+# GDAL errors of remote reads worth retrying, anything else (404, not a raster) fails for good
+TRANSIENT_GDAL_ERRORS = re.compile(r"HTTP (response|error) code ?: ?(429|5\d\d)|[Tt]imeout|timed out|"
+                                   r"Connection (reset|refused)|[Cc]ould(n't| not) (connect|resolve)")
+
+
+@contextmanager
+def vsicurl_config(options=VSICURL_OPTIONS):
+    """
+    Apply GDAL config options for the duration of the block, restoring the previous values afterwards.  Config
+    options are process wide so this should wrap whole pipelines rather than individual reads.
+    """
+    previous = {k: gdal.GetConfigOption(k) for k in options}
+    for k, v in options.items():
+        gdal.SetConfigOption(k, v)
+    try:
+        yield
+    finally:
+        for k, v in previous.items():
+            gdal.SetConfigOption(k, v)
+
+
+def imap_bounded(fn, iterable, num_threads=10, max_pending=None, throttle=None):
+    """
+    Like ``ThreadPool.imap_unordered`` but only reads ``max_pending`` inputs ahead of the results, so memory
+    stays constant for arbitrarily long input streams.  ``throttle`` is called before more inputs are read.
+    """
+    max_pending = max_pending or num_threads * 4
+    iterator = iter(iterable)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = {executor.submit(fn, x) for x in itertools.islice(iterator, max_pending)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if throttle:
+                throttle()
+            for x in itertools.islice(iterator, len(done)):
+                pending.add(executor.submit(fn, x))
+            for future in done:
+                yield future.result()
+
+
+def gdal_info(path, **kwargs):
+    """
+    Call gdal.Info on a remote (/vsicurl/) path through the controller of the remote host.  Only throttling,
+    server errors and timeouts are retried.
+    """
+    def _info():
+        gdal.ErrorReset()
+        try:
+            info = gdal.Info(path, **kwargs)
+        except RuntimeError:
+            info = None
+        if info is None:
+            message = gdal.GetLastErrorMsg()
+            if TRANSIENT_GDAL_ERRORS.search(message):
+                raise RetryableError(f"Failed to read {path}: {message}")
+            raise ValueError(f"Failed to read {path}: {message}")
+        return info
+    return endpoint(host(path)).call(_info)
+
 
 def gdal_info_stac(input_item):
     """
     Return incomplete STAC item from call to gdal.Info
     """
-    file_url = os.path.join("/vsicurl/" + input_item['item']['assets']['data']['href'])
-    info = gdal.Info(file_url, format='json', allMetadata=True)
+    file_url = vsicurl(input_item['item']['assets']['data']['href'])
+    info = gdal_info(file_url, format='json', allMetadata=True)
 
     # Calculating geometry and bbox
     geometry = info['wgs84Extent']['coordinates']
@@ -46,6 +123,23 @@ def gdal_info_stac(input_item):
 
     return {'parent': input_item['parent'], 'item': merged}
 
+def _gdal_info_stac(input_item):
+    try:
+        return gdal_info_stac(input_item)
+    except Exception as e:
+        print("Failed to read {}: {}".format(input_item['item']['assets']['data']['href'], e))
+        return None
+
+
+def gdal_info_stac_stream(input_items, num_threads=10, throttle=None):
+    """
+    Stream ``gdal_info_stac`` results in completion order, skipping rasters which can't be read
+    """
+    for result in imap_bounded(_gdal_info_stac, input_items, num_threads, throttle=throttle):
+        if result:
+            yield result
+
+
 def gdal_info_stac_multi(filelist, num_threads=10):
     m = ThreadPool(num_threads)
     response = m.map(gdal_info_stac, filelist)
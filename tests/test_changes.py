@@ -0,0 +1,122 @@
+import re
+import json
+
+import pytest
+
+from disaster_data.catalog import changes
+from disaster_data.catalog.changes import ChangeFeed
+from disaster_data.catalog.index import ItemIndex
+
+
+class Bucket(object):
+
+    """In-memory stand-in for the S3 calls of the change feed"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def s3_call(self, method, Bucket, Key, Body=None, ContentType=None):
+        assert method == 'put_object'
+        self.objects[Key] = Body
+
+    def get_json(self, bucket, key):
+        return json.loads(self.objects[key]) if key in self.objects else None
+
+    def list_segments(self, bucket, prefix, log_prefix):
+        start = (prefix + '/' if prefix else '') + log_prefix + '/'
+        return [k for k in self.objects if k.startswith(start)]
+
+    def read_segment(self, bucket, key):
+        return [json.loads(line) for line in self.objects[key].splitlines()]
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    store = Bucket()
+    for name in ('s3_call', 'get_json', 'list_segments', 'read_segment'):
+        monkeypatch.setattr(changes, name, getattr(store, name))
+    return store
+
+
+def item(id, collection='florence'):
+    return {'id': id, 'collection': collection, 'bbox': [0, 0, 1, 1],
+            'properties': {'datetime': '2018-09-14T00:00:00Z'}}
+
+
+def test_segment_format(bucket):
+    feed = ChangeFeed('bucket', 'noaa-storm')
+    feed.added(item('a'), 'https://host/NOAAStorm/florence/2018-09-14/a.json')
+    feed.updated(item('b'), 'https://host/NOAAStorm/florence/2018-09-14/b.json')
+    feed.removed({'id': 'c', 'collection': 'florence'}, None)
+    href = feed.publish()
+
+    key = href[2:]
+    assert re.match(r'changes/\d{8}T\d{6}\.\d{6}Z-noaa-storm-[0-9a-f]{8}\.ndjson$', key)
+    entries = bucket.read_segment('bucket', key)
+    assert [(x['op'], x['id']) for x in entries] == [('added', 'a'), ('updated', 'b'), ('removed', 'c')]
+    assert entries[0] == {'op': 'added', 'id': 'a', 'collection': 'florence',
+                          'href': 'https://host/NOAAStorm/florence/2018-09-14/a.json', 'bbox': [0, 0, 1, 1],
+                          'datetime': '2018-09-14T00:00:00Z'}
+    assert entries[2]['bbox'] is None and entries[2]['datetime'] is None
+
+
+def test_cursor_lists_segments_in_publish_order(bucket):
+    first = ChangeFeed('bucket', 'noaa-storm')
+    first.added(item('a'), 'a.json')
+    first_href = first.publish()
+
+    second = ChangeFeed('bucket', 'dg-open-data')
+    second.added(item('b'), 'b.json')
+    second.removed(item('a'), 'a.json')
+    second_href = second.publish()
+
+    cursor = bucket.get_json('bucket', 'changes.json')
+    assert cursor['sequence'] == 2
+    assert [x['href'] for x in cursor['segments']] == [first_href, second_href]
+    assert cursor['segments'][1] == {'href': second_href, 'source': 'dg-open-data', 'started': second.started,
+                                     'added': 1, 'updated': 0, 'removed': 1}
+
+
+def test_cursor_counts_segments_it_missed(bucket):
+    feed = ChangeFeed('bucket', 'noaa-storm')
+    feed.updated(item('a'), 'a.json')
+    feed.updated(item('b'), 'b.json')
+    missed = feed.publish()
+    # A concurrent run whose cursor update was overwritten
+    bucket.objects['changes.json'] = json.dumps({'sequence': 0, 'segments': []})
+
+    other = ChangeFeed('bucket', 'dg-open-data')
+    other.added(item('c'), 'c.json')
+    other.publish()
+
+    segments = bucket.get_json('bucket', 'changes.json')['segments']
+    assert segments[0] == {'href': missed, 'source': 'noaa-storm', 'added': 0, 'updated': 2, 'removed': 0}
+
+
+def test_cursor_below_a_root(bucket):
+    feed = ChangeFeed('bucket', 'noaa-storm', root='staging')
+    feed.added(item('a'), 'a.json')
+    href = feed.publish()
+
+    assert href.startswith('./changes/')
+    assert 'staging/' + href[2:] in bucket.objects
+    assert bucket.get_json('bucket', 'staging/changes.json')['segments'][0]['href'] == href
+
+
+def test_nothing_to_publish(bucket):
+    assert ChangeFeed('bucket', 'noaa-storm').publish() is None
+    assert bucket.objects == {}
+
+
+def test_index_records_published_hrefs(tmpdir):
+    index = ItemIndex()
+    index.add({'id': 'a', 'assets': {'data': {'href': 'https://host/a.tif'}}}, 'https://host/florence/a.json')
+    index.add({'id': 'b'})
+    path = str(tmpdir.join('manifest.json'))
+    index.save(path)
+
+    loaded = ItemIndex.from_manifest(path)
+    assert loaded.ids == {'a', 'b'}
+    assert loaded.hrefs == {'https://host/a.tif'}
+    assert loaded.items == {'a': 'https://host/florence/a.json'}
+    assert {'id': 'c', 'assets': {'data': {'href': 'https://host/a.tif'}}} in loaded
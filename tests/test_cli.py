@@ -0,0 +1,45 @@
+import os
+import sys
+import shutil
+import subprocess
+
+# Microseconds `import disaster_data.scripts.cli` may take, click included
+IMPORT_BUDGET = 250000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('boto3', 'botocore', 'osgeo', 'scrapy', 'satstac', 'numpy', 'requests')
+
+
+def clean_env():
+    """Environment without AWS credentials, region or profile"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith('AWS_')}
+    env['AWS_CONFIG_FILE'] = os.devnull
+    env['AWS_SHARED_CREDENTIALS_FILE'] = os.devnull
+    return env
+
+
+def test_import_time():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import disaster_data.scripts.cli'],
+                            stderr=subprocess.PIPE, universal_newlines=True, env=clean_env(), cwd=ROOT, check=True)
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = int(cumulative)
+
+    assert imported['disaster_data.scripts.cli'] < IMPORT_BUDGET
+    for name in imported:
+        assert name.split('.')[0] not in HEAVY_MODULES, "{} imported by the CLI".format(name)
+
+
+def test_help_without_aws_environment():
+    executable = shutil.which('cognition-disaster-data')
+    if executable:
+        cmd = [executable, '--help']
+    else:
+        cmd = [sys.executable, '-c', 'from disaster_data.scripts.cli import cognition_disaster_data; '
+                                     'cognition_disaster_data()', '--help']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            env=clean_env(), cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+    assert 'index-noaa-storm' in result.stdout
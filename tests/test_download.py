@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from disaster_data.download import Download, DownloadError, Bandwidth, download
+
+DATA = os.urandom(10 * 1024 + 123)
+CHUNK_SIZE = 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+
+    """Serves ``DATA`` with byte ranges, recording each range requested and truncating those in ``truncate``"""
+
+    protocol_version = 'HTTP/1.1'
+    ranges = True
+    requested = []
+    truncate = set()
+    lock = threading.Lock()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA)))
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        if not self.ranges or not header:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        start, end = [int(x) for x in header.split('=')[1].split('-')]
+        with self.lock:
+            self.requested.append((start, end))
+        body = DATA[start:end + 1]
+        if start in self.truncate:
+            body = body[:len(body) // 2]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(DATA)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def remote(http_server):
+    RangeHandler.ranges = True
+    RangeHandler.requested = []
+    RangeHandler.truncate = set()
+    return http_server(RangeHandler) + '/archive.zip'
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def chunk_range(index):
+    return index * CHUNK_SIZE, min((index + 1) * CHUNK_SIZE, len(DATA)) - 1
+
+
+def test_downloads_in_ranges(tmpdir, remote):
+    outfile = Download(remote, str(tmpdir.join('archive.zip')), connections=4, chunk_size=CHUNK_SIZE).run()
+
+    assert read(outfile) == DATA
+    assert sorted(RangeHandler.requested) == [chunk_range(x) for x in range(11)]
+    # Nothing of the partial download is left behind
+    assert os.listdir(str(tmpdir)) == ['archive.zip']
+
+
+def test_resumes_from_completed_chunks(tmpdir, remote):
+    outfile = str(tmpdir.join('archive.zip'))
+    dl = Download(remote, outfile, chunk_size=CHUNK_SIZE)
+    completed = [0, 1, 5]
+    with open(dl.partfile, 'wb') as f:
+        f.truncate(len(DATA))
+        for idx in completed:
+            start, end = chunk_range(idx)
+            f.seek(start)
+            f.write(DATA[start:end + 1])
+    dl.save_state({'url': remote, 'size': len(DATA), 'chunk_size': CHUNK_SIZE, 'completed': completed})
+
+    dl.run()
+
+    assert read(outfile) == DATA
+    assert sorted(RangeHandler.requested) == [chunk_range(x) for x in range(11) if x not in completed]
+
+
+def test_state_of_another_chunk_size_restarts(tmpdir, remote):
+    dl = Download(remote, str(tmpdir.join('archive.zip')), chunk_size=CHUNK_SIZE)
+    with open(dl.partfile, 'wb') as f:
+        f.write(b'\0' * len(DATA))
+    dl.save_state({'url': remote, 'size': len(DATA), 'chunk_size': 2048, 'completed': [0, 1]})
+
+    assert dl.load_state(len(DATA))['completed'] == []
+    assert read(dl.run()) == DATA
+    assert len(RangeHandler.requested) == 11
+
+
+def test_truncated_chunk_is_not_recorded(tmpdir, remote):
+    RangeHandler.truncate = {3 * CHUNK_SIZE}
+    dl = Download(remote, str(tmpdir.join('archive.zip')), connections=1, chunk_size=CHUNK_SIZE)
+
+    with pytest.raises(DownloadError):
+        dl.run()
+    with open(dl.statefile) as f:
+        completed = json.load(f)['completed']
+    assert 3 not in completed
+    assert not os.path.exists(dl.outfile)
+
+    # The next attempt only fetches what's missing
+    RangeHandler.truncate = set()
+    RangeHandler.requested = []
+    assert read(dl.run()) == DATA
+    assert chunk_range(3) in RangeHandler.requested
+    assert len(RangeHandler.requested) == 11 - len(completed)
+
+
+def test_streams_without_range_support(tmpdir, remote):
+    RangeHandler.ranges = False
+    outfile = download(remote, str(tmpdir))
+
+    assert read(outfile) == DATA
+    assert RangeHandler.requested == []
+
+
+def test_bandwidth_unlimited():
+    started = time.monotonic()
+    Bandwidth(0).consume(10 ** 9)
+    assert time.monotonic() - started < 0.1
+
+
+def test_bandwidth_waits_for_tokens():
+    bandwidth = Bandwidth(1000)
+    started = time.monotonic()
+    # The bucket starts full
+    bandwidth.consume(1000)
+    assert time.monotonic() - started < 0.1
+    bandwidth.consume(500)
+    assert time.monotonic() - started >= 0.45
+
+
+def test_bandwidth_allows_reads_larger_than_the_rate():
+    bandwidth = Bandwidth(1000)
+    started = time.monotonic()
+    # A full bucket lets a single oversized read through, the debt is paid by later reads
+    bandwidth.consume(1500)
+    assert time.monotonic() - started < 0.1
+    bandwidth.consume(1)
+    assert time.monotonic() - started >= 0.45
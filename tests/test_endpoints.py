@@ -0,0 +1,165 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from disaster_data import endpoints
+from disaster_data.endpoints import EndpointController, CircuitOpenError, RetryableError, request
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+
+    """Answers each request with the next scripted response: a status code, or ``'timeout'`` to stall"""
+
+    script = []
+    hits = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            type(self).hits += 1
+            action = self.script.pop(0) if self.script else 200
+        if action == 'timeout':
+            time.sleep(0.5)
+            action = 200
+        body = b'ok'
+        self.send_response(action)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def flaky(http_server):
+    FlakyHandler.script = []
+    FlakyHandler.hits = 0
+    url = http_server(FlakyHandler)
+    yield url
+    endpoints.controllers.pop(endpoints.host(url), None)
+
+
+def install(url, **kwargs):
+    """Replace the shared controller of the server with one using short backoffs"""
+    config = dict({'backoff_base': 0.01, 'backoff_max': 0.05, 'reset_timeout': 0.2}, **kwargs)
+    controller = EndpointController(endpoints.host(url), **config)
+    endpoints.controllers[endpoints.host(url)] = controller
+    return controller
+
+
+@pytest.mark.parametrize('failures', [[503, 503], [429], ['timeout', 503]])
+def test_retries_transient_failures(flaky, failures):
+    controller = install(flaky)
+    FlakyHandler.script = list(failures)
+
+    r = request('get', flaky + '/data', timeout=0.2)
+
+    assert r.status_code == 200
+    assert FlakyHandler.hits == len(failures) + 1
+    assert controller.stats == {'calls': 1, 'errors': len(failures), 'retries': len(failures)}
+
+
+def test_gives_up_after_retries(flaky):
+    controller = install(flaky, retries=2)
+    FlakyHandler.script = [503] * 5
+
+    with pytest.raises(RetryableError):
+        request('get', flaky + '/data')
+    assert FlakyHandler.hits == 3
+    assert controller.stats['retries'] == 2
+
+
+def test_permanent_errors_are_not_retried(flaky):
+    controller = install(flaky)
+    FlakyHandler.script = [404]
+
+    r = request('get', flaky + '/missing')
+
+    assert r.status_code == 404
+    assert FlakyHandler.hits == 1
+    assert controller.stats['retries'] == 0
+
+
+def test_backoff_is_bounded():
+    controller = EndpointController('test', backoff_base=0.5, backoff_max=2.0)
+    for attempt in range(10):
+        assert 0 <= controller.backoff(attempt) <= min(2.0, 0.5 * 2 ** attempt)
+
+
+def test_aimd_decrease_and_recovery(flaky):
+    controller = install(flaky, initial_concurrency=8, max_concurrency=8, failure_threshold=100)
+    FlakyHandler.script = [503, 503]
+
+    request('get', flaky + '/data')
+    # Each failed attempt halves the limit
+    assert controller.limit < 8
+    assert controller.limit >= controller.config['min_concurrency']
+
+    decreased = controller.limit
+    for _ in range(50):
+        request('get', flaky + '/data')
+    # Healthy calls add one slot per window, up to max_concurrency
+    assert controller.limit > decreased
+    assert controller.limit == 8
+
+
+def test_slow_calls_decrease_concurrency():
+    controller = EndpointController('test', initial_concurrency=8, target_latency=0.01)
+    controller.call(time.sleep, 0.05)
+    assert controller.limit == 4
+
+
+def test_circuit_breaker_cycle(flaky):
+    controller = install(flaky, retries=0, failure_threshold=3)
+    FlakyHandler.script = [503] * 4
+
+    for _ in range(3):
+        with pytest.raises(RetryableError):
+            request('get', flaky + '/data')
+    # Open: calls fail fast without reaching the server
+    with pytest.raises(CircuitOpenError):
+        request('get', flaky + '/data')
+    assert FlakyHandler.hits == 3
+
+    # Half open: one trial call, which fails and re-opens the circuit
+    time.sleep(0.25)
+    with pytest.raises(RetryableError):
+        request('get', flaky + '/data')
+    with pytest.raises(CircuitOpenError):
+        request('get', flaky + '/data')
+    assert FlakyHandler.hits == 4
+
+    # Half open again, the trial succeeds and closes the circuit
+    time.sleep(0.25)
+    assert request('get', flaky + '/data').status_code == 200
+    assert controller.breaker.opened is None
+    for _ in range(3):
+        assert request('get', flaky + '/data').status_code == 200
+    assert FlakyHandler.hits == 8
+
+
+def test_stats_are_consistent_across_threads():
+    controller = EndpointController('test', rate=10000.0, burst=10000, initial_concurrency=32)
+    threads = [threading.Thread(target=lambda: [controller.call(lambda: None) for _ in range(200)])
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert controller.stats['calls'] == 1600
+
+
+def test_share_splits_limits_between_processes(monkeypatch):
+    monkeypatch.setattr(endpoints, 'controllers', {'s3': EndpointController('s3')})
+    monkeypatch.setattr(endpoints, 'processes', 1)
+    endpoints.share(10)
+
+    # Controllers inherited from the parent are replaced by ones with a tenth of the limits
+    assert endpoints.controllers == {}
+    s3 = endpoints.endpoint('s3').config
+    assert (s3['rate'], s3['burst'], s3['max_concurrency'], s3['initial_concurrency']) == (20.0, 20, 12, 1)
+    oam = endpoints.endpoint('api.openaerialmap.org').config
+    assert (oam['rate'], oam['burst'], oam['max_concurrency'], oam['min_concurrency']) == (0.2, 1, 1, 1)
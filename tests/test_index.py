@@ -0,0 +1,60 @@
+import os
+import json
+
+import pytest
+
+from disaster_data.catalog.index import ItemIndex, MANIFEST_NAME
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def write_collection(root, ids):
+    write_json(os.path.join(root, 'florence', 'catalog.json'),
+               {'id': 'florence', 'links': [{'rel': 'child', 'href': './2018-09-14/catalog.json'}]})
+    write_json(os.path.join(root, 'florence', '2018-09-14', 'catalog.json'),
+               {'id': '2018-09-14', 'links': [{'rel': 'item', 'href': './{}.json'.format(x)} for x in ids]})
+    for x in ids:
+        write_json(os.path.join(root, 'florence', '2018-09-14', x + '.json'),
+                   {'id': x, 'assets': {'data': {'href': 'https://host/{}.tif'.format(x)}}})
+    return os.path.join(root, 'florence', 'catalog.json')
+
+
+def test_unpublished_collection_has_an_empty_index(tmpdir):
+    index = ItemIndex.load(os.path.join(str(tmpdir), 'florence', 'catalog.json'))
+    assert len(index) == 0
+
+
+def test_manifest_is_read_instead_of_walking(tmpdir):
+    collection = write_collection(str(tmpdir), ['a', 'b'])
+    ItemIndex(['a'], ['https://host/a.tif']).save(os.path.join(str(tmpdir), 'florence', MANIFEST_NAME))
+    assert ItemIndex.load(collection).ids == {'a'}
+
+
+def test_collection_without_manifest_is_walked(tmpdir):
+    collection = write_collection(str(tmpdir), ['a', 'b'])
+    index = ItemIndex.load(collection, num_threads=2)
+
+    assert index.ids == {'a', 'b'}
+    assert index.hrefs == {'https://host/a.tif', 'https://host/b.tif'}
+    assert index.items['a'] == os.path.join(str(tmpdir), 'florence', '2018-09-14', 'a.json')
+
+
+def test_failed_walk_is_raised(tmpdir):
+    # An empty index would have every published item counted again as new
+    collection = write_collection(str(tmpdir), ['a', 'b'])
+    os.remove(os.path.join(str(tmpdir), 'florence', '2018-09-14', 'b.json'))
+    with pytest.raises(FileNotFoundError):
+        ItemIndex.load(collection)
+
+
+def test_unreadable_collection_is_raised(tmpdir):
+    collection = os.path.join(str(tmpdir), 'florence', 'catalog.json')
+    os.makedirs(os.path.dirname(collection))
+    with open(collection, 'w') as f:
+        f.write('{"id": "florence", ')
+    with pytest.raises(ValueError):
+        ItemIndex.load(collection)
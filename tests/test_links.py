@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from disaster_data.aws import client
+from disaster_data.loadtest.harness import LoadTest, CATALOG_BUCKET
+from disaster_data.catalog.links import LinkLog, compact, get_json, list_segments, link_key, object_url, s3_call
+from disaster_data.catalog.changes import ChangeFeed
+
+PREFIX = 'LinkTest'
+WRITERS = 6
+ITEMS_PER_WRITER = 60
+DATES = ['2019-01-0{}'.format(x) for x in range(1, 4)]
+
+
+@pytest.fixture
+def s3(tmpdir):
+    test = LoadTest(events=1).start()
+    test.configure(str(tmpdir))
+    client.cache_clear()
+    yield test
+    test.stop()
+    client.cache_clear()
+
+
+def make_item(writer, idx):
+    return {
+        'type': 'Feature',
+        'id': 'item-{}-{}'.format(writer, idx),
+        'collection': 'coll-{}'.format(idx % 2),
+        'properties': {'datetime': DATES[idx % len(DATES)] + 'T00:00:00Z'},
+        'geometry': None,
+        'assets': {},
+    }
+
+
+def item_links():
+    """Keys of every item linked from the date catalogs below the test prefix"""
+    found = set()
+    for coll in ('coll-0', 'coll-1'):
+        for date in DATES:
+            key = '{}/{}/{}/catalog.json'.format(PREFIX, coll, date)
+            catalog = get_json(CATALOG_BUCKET, key) or {'links': []}
+            found.update(link_key(key, x['href']) for x in catalog['links'] if x['rel'] == 'item')
+    return found
+
+
+def test_concurrent_writers_and_compaction_lose_no_links(s3):
+    expected = set()
+    expected_lock = threading.Lock()
+    done = threading.Event()
+
+    def write(writer):
+        with LinkLog(CATALOG_BUCKET, PREFIX, flush_size=7) as log:
+            for idx in range(ITEMS_PER_WRITER):
+                key = log.add_item(make_item(writer, idx))
+                with expected_lock:
+                    expected.add(key)
+
+    def compact_while_writing():
+        while not done.is_set():
+            compact(CATALOG_BUCKET, PREFIX, num_threads=4)
+
+    writers = [threading.Thread(target=write, args=(x,)) for x in range(WRITERS)]
+    compactor = threading.Thread(target=compact_while_writing)
+    compactor.start()
+    for t in writers:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    compactor.join()
+    compact(CATALOG_BUCKET, PREFIX, num_threads=4)
+
+    assert len(expected) == WRITERS * ITEMS_PER_WRITER
+    assert item_links() == expected
+    assert not list(list_segments(CATALOG_BUCKET, PREFIX))
+
+    # Compacting again changes nothing
+    assert not any(compact(CATALOG_BUCKET, PREFIX).values())
+
+
+def manifest_ids(coll):
+    return get_json(CATALOG_BUCKET, '{}/{}/manifest.json'.format(PREFIX, coll))['ids']
+
+
+def test_compaction_updates_manifests_and_change_feed(s3):
+    with LinkLog(CATALOG_BUCKET, PREFIX) as log:
+        for idx in range(4):
+            log.add_item(make_item(0, idx))
+    feed = ChangeFeed(CATALOG_BUCKET, 'test')
+    compact(CATALOG_BUCKET, PREFIX, feed=feed)
+
+    assert manifest_ids('coll-0') == ['item-0-0', 'item-0-2']
+    assert manifest_ids('coll-1') == ['item-0-1', 'item-0-3']
+    manifest = get_json(CATALOG_BUCKET, PREFIX + '/coll-0/manifest.json')
+    assert manifest['items']['item-0-0'] == object_url(CATALOG_BUCKET, PREFIX + '/coll-0/2019-01-01/item-0-0.json')
+    assert feed.counts() == {'added': 4, 'updated': 0, 'removed': 0}
+    entry = [x for x in feed.entries if x['id'] == 'item-0-1'][0]
+    assert (entry['collection'], entry['datetime']) == ('coll-1', '2019-01-02T00:00:00Z')
+
+    # An item written again is an update
+    with LinkLog(CATALOG_BUCKET, PREFIX) as log:
+        log.add_item(make_item(0, 0))
+        log.add_item(make_item(0, 4))
+    feed = ChangeFeed(CATALOG_BUCKET, 'test')
+    compact(CATALOG_BUCKET, PREFIX, feed=feed)
+
+    assert feed.counts() == {'added': 1, 'updated': 1, 'removed': 0}
+    assert manifest_ids('coll-0') == ['item-0-0', 'item-0-2', 'item-0-4']
+
+
+def test_compaction_walks_collections_without_manifest(s3):
+    with LinkLog(CATALOG_BUCKET, PREFIX) as log:
+        for idx in range(0, 6, 2):
+            log.add_item(make_item(0, idx))
+    compact(CATALOG_BUCKET, PREFIX)
+    s3_call('delete_object', Bucket=CATALOG_BUCKET, Key=PREFIX + '/coll-0/manifest.json')
+
+    with LinkLog(CATALOG_BUCKET, PREFIX) as log:
+        log.add_item(make_item(1, 0))
+    compact(CATALOG_BUCKET, PREFIX)
+
+    assert manifest_ids('coll-0') == ['item-0-0', 'item-0-2', 'item-0-4', 'item-1-0']
@@ -0,0 +1,147 @@
+import os
+import json
+
+import pytest
+from shapely.geometry import box
+
+# pairing shares the phase names of the DG spider
+pytest.importorskip('scrapy')
+
+from disaster_data.sources.dg_open_data import pairing
+from disaster_data.sources.dg_open_data.pairing import query, pair_items, pair_collection
+
+
+def item(id, phase, bounds, date):
+    return {
+        'id': id,
+        'geometry': box(*bounds).__geo_interface__,
+        'properties': {'dg:phase': phase, 'datetime': date + 'T00:00:00Z'},
+        'links': [{'rel': 'parent', 'href': './catalog.json'}],
+    }
+
+
+def summary(pairs):
+    return {id: [(overlap, gap, other['id']) for overlap, gap, other in ranked] for id, ranked in pairs.items()}
+
+
+class OldTree(object):
+
+    """STRtree of Shapely 1.x, whose queries return the geometries instead of their indices"""
+
+    def __init__(self, geoms, hits):
+        self.geoms = geoms
+        self.hits = hits
+
+    def query(self, geom):
+        return [self.geoms[x] for x in self.hits]
+
+
+def test_query_returns_indices():
+    geoms = [box(0, 0, 1, 1), box(5, 5, 6, 6), box(0.5, 0.5, 2, 2)]
+    assert sorted(query(pairing.STRtree(geoms), geoms, box(0.8, 0.8, 0.9, 0.9))) == [0, 2]
+    assert query(pairing.STRtree(geoms), geoms, box(10, 10, 11, 11)) == []
+
+
+def test_query_maps_shapely_1_geometries_to_indices():
+    # Equal geometries are told apart by identity
+    geoms = [box(0, 0, 1, 1), box(0, 0, 1, 1), box(5, 5, 6, 6)]
+    assert query(OldTree(geoms, [2, 1]), geoms, box(0, 0, 6, 6)) == [2, 1]
+    assert query(OldTree(geoms, []), geoms, box(0, 0, 6, 6)) == []
+
+
+def test_pair_items_ranks_by_overlap_then_time_gap():
+    items = [
+        item('pre', 'pre-event', (0, 0, 2, 2), '2018-09-01'),
+        item('post-exact', 'post-event', (0, 0, 2, 2), '2018-09-20'),
+        item('post-quarter', 'post-event', (1, 1, 3, 3), '2018-09-15'),
+        item('post-quarter-late', 'post-event', (1, 1, 3, 3), '2018-10-01'),
+        item('post-far', 'post-event', (10, 10, 11, 11), '2018-09-15'),
+    ]
+    pairs = summary(pair_items(items))
+
+    assert pairs['pre'] == [(1.0, 19, 'post-exact'), (0.25, 14, 'post-quarter'), (0.25, 30, 'post-quarter-late')]
+    assert pairs['post-exact'] == [(1.0, 19, 'pre')]
+    assert pairs['post-quarter'] == [(0.25, 14, 'pre')]
+    assert 'post-far' not in pairs
+
+
+def test_pair_items_skips_slivers_and_items_without_geometry():
+    items = [
+        item('pre', 'pre-event', (0, 0, 10, 10), '2018-09-01'),
+        # Covers 1% of the pre-event item, but all of itself
+        item('post-sliver', 'post-event', (0, 0, 1, 1), '2018-09-02'),
+        dict(item('post-unlocated', 'post-event', (0, 0, 10, 10), '2018-09-02'), geometry=None),
+    ]
+    pairs = summary(pair_items(items))
+
+    assert 'pre' not in pairs
+    assert pairs['post-sliver'] == [(1.0, 1, 'pre')]
+    assert 'post-unlocated' not in pairs
+
+
+def test_pair_items_limits_related_links(monkeypatch):
+    monkeypatch.setattr(pairing, 'RELATED_LINKS', 2)
+    items = [item('pre', 'pre-event', (0, 0, 1, 1), '2018-09-01')]
+    items += [item('post-{}'.format(x), 'post-event', (0, 0, 1, 1), '2018-09-0{}'.format(x + 2)) for x in range(4)]
+
+    assert [x[2] for x in summary(pair_items(items))['pre']] == ['post-0', 'post-1']
+
+
+def test_pair_items_without_counterparts():
+    assert pair_items([item('pre', 'pre-event', (0, 0, 1, 1), '2018-09-01')]) == {}
+
+
+def write_collection(root, items):
+    """Local DG collection with a date catalog per acquisition date"""
+    dates = {}
+    for x in items:
+        date = x['properties']['datetime'][:10]
+        dates.setdefault(date, []).append({'rel': 'item', 'href': './{}.json'.format(x['id'])})
+        os.makedirs(os.path.join(root, 'florence', date), exist_ok=True)
+        with open(os.path.join(root, 'florence', date, x['id'] + '.json'), 'w') as f:
+            json.dump(x, f)
+    for date, links in dates.items():
+        with open(os.path.join(root, 'florence', date, 'catalog.json'), 'w') as f:
+            json.dump({'id': date, 'links': links}, f)
+    collection = os.path.join(root, 'florence', 'catalog.json')
+    with open(collection, 'w') as f:
+        json.dump({'id': 'florence', 'links': [{'rel': 'child', 'href': './{}/catalog.json'.format(x)}
+                                               for x in sorted(dates)]}, f)
+    return collection
+
+
+def test_pair_collection(tmpdir, monkeypatch):
+    written = {}
+
+    def put_json(bucket, key, data):
+        written[key] = data
+        with open(key, 'w') as f:
+            json.dump(data, f)
+
+    monkeypatch.setattr(pairing, 'put_json', put_json)
+    collection = write_collection(str(tmpdir), [
+        item('pre', 'pre-event', (0, 0, 2, 2), '2018-09-01'),
+        item('post', 'post-event', (1, 1, 3, 3), '2018-09-15'),
+        item('post-far', 'post-event', (10, 10, 11, 11), '2018-09-15'),
+    ])
+    index = pair_collection('bucket', collection)
+
+    assert index == {
+        'pre': [{'id': 'post', 'overlap': 0.25, 'time_gap_days': 14}],
+        'post': [{'id': 'pre', 'overlap': 0.25, 'time_gap_days': 14}],
+    }
+    pairs_key = os.path.join(str(tmpdir), 'florence', 'pairs.json')
+    pre_key = os.path.join(str(tmpdir), 'florence', '2018-09-01', 'pre.json')
+    # Items without counterparts are left alone
+    assert sorted(written) == sorted([pairs_key, pre_key, os.path.join(str(tmpdir), 'florence', '2018-09-15',
+                                                                       'post.json')])
+    assert written[pre_key]['links'] == [
+        {'rel': 'parent', 'href': './catalog.json'},
+        {'rel': 'related', 'href': '../2018-09-15/post.json', 'title': 'post-event', 'dg:overlap': 0.25,
+         'dg:time_gap_days': 14},
+    ]
+
+    # Pairing again only rewrites the index
+    written.clear()
+    pair_collection('bucket', collection)
+    assert list(written) == [pairs_key]
@@ -0,0 +1,157 @@
+import gzip
+import json
+import struct
+
+from disaster_data import pmtiles
+from disaster_data.pmtiles import PMTilesWriter, HEADER_SIZE, zxy_to_tile_id, serialize_directory, build_directories
+
+HEADER_FIELDS = ('magic', 'version', 'root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+                 'leaves_offset', 'leaves_length', 'data_offset', 'data_length', 'addressed_tiles', 'tile_entries',
+                 'tile_contents', 'clustered', 'internal_compression', 'tile_compression', 'tile_type', 'min_zoom',
+                 'max_zoom', 'min_lon', 'min_lat', 'max_lon', 'max_lat', 'center_zoom', 'center_lon', 'center_lat')
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_directory(data):
+    """Entries of a serialized directory, with the offsets of tiles following the previous one resolved"""
+    data = gzip.decompress(data)
+    count, pos = read_varint(data, 0)
+    columns = []
+    for _ in range(4):
+        column = []
+        for _ in range(count):
+            value, pos = read_varint(data, pos)
+            column.append(value)
+        columns.append(column)
+    deltas, run_lengths, lengths, offsets = columns
+
+    entries = []
+    tile_id = 0
+    for idx in range(count):
+        tile_id += deltas[idx]
+        offset = entries[-1][1] + entries[-1][2] if idx and not offsets[idx] else offsets[idx] - 1
+        entries.append((tile_id, offset, lengths[idx], run_lengths[idx]))
+    return entries
+
+
+def read_header(data):
+    return dict(zip(HEADER_FIELDS, struct.unpack('<7sB11Q6B4iB2i', data[:HEADER_SIZE])))
+
+
+def test_tile_ids_follow_the_hilbert_curve():
+    assert zxy_to_tile_id(0, 0, 0) == 0
+    assert [zxy_to_tile_id(1, x, y) for x, y in [(0, 0), (0, 1), (1, 1), (1, 0)]] == [1, 2, 3, 4]
+    assert zxy_to_tile_id(2, 0, 0) == 5
+    # Every tile of a zoom level has its own id, right after the ids of the lower zooms
+    for z in range(1, 6):
+        ids = sorted(zxy_to_tile_id(z, x, y) for x in range(1 << z) for y in range(1 << z))
+        first = ((1 << (2 * z)) - 1) // 3
+        assert ids == list(range(first, first + (1 << (2 * z))))
+
+
+def test_directory_round_trip():
+    entries = [(1, 0, 10, 1), (2, 10, 20, 3), (9, 500, 5, 1), (10, 30, 7, 1)]
+    assert read_directory(serialize_directory(entries)) == entries
+
+
+def test_contiguous_tiles_are_encoded_as_zero_offsets():
+    raw = gzip.decompress(serialize_directory([(1, 0, 10, 1), (2, 10, 20, 1)]))
+    # Count, two id deltas, two run lengths, two lengths, then the offsets
+    assert list(raw) == [2, 1, 1, 1, 1, 10, 20, 1, 0]
+
+
+def test_small_directories_have_no_leaves():
+    entries = [(x, x * 10, 10, 1) for x in range(100)]
+    root, leaves = build_directories(entries)
+    assert leaves == b''
+    assert read_directory(root) == entries
+
+
+def test_large_directories_are_split_into_leaves(monkeypatch):
+    monkeypatch.setattr(pmtiles, 'ROOT_SIZE', 64)
+    monkeypatch.setattr(pmtiles, 'LEAF_SIZE', 100)
+    # Spread out ids and lengths, which don't compress to nothing
+    entries = [(x * 7, x * 1000, 1000 + x % 97, 1) for x in range(1000)]
+    root, leaves = build_directories(entries)
+    assert len(root) <= 64
+
+    root_entries = read_directory(root)
+    assert len(root_entries) > 1
+    assert all(run_length == 0 for _, _, _, run_length in root_entries)
+    found = []
+    for tile_id, offset, length, _ in root_entries:
+        leaf = read_directory(leaves[offset:offset + length])
+        assert leaf[0][0] == tile_id
+        found += leaf
+    assert found == entries
+
+
+def test_archive_layout(tmpdir):
+    path = str(tmpdir.join('tiles.pmtiles'))
+    writer = PMTilesWriter(path, 'png')
+    # Added out of order, with a run of identical tiles and a repeated tile elsewhere
+    writer.add(1, 1, 0, b'blank')
+    writer.add(0, 0, 0, b'world')
+    writer.add(1, 0, 0, b'north-west')
+    writer.add(1, 0, 1, b'blank')
+    writer.add(1, 1, 1, b'blank')
+    assert len(writer) == 5
+    writer.finish([-180, -85, 180, 85], {'name': 'florence'}, center_zoom=1)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = read_header(data)
+    assert header['magic'] == b'PMTiles'
+    assert header['version'] == 3
+    assert header['root_offset'] == HEADER_SIZE
+    assert header['metadata_offset'] == header['root_offset'] + header['root_length']
+    assert header['leaves_offset'] == header['metadata_offset'] + header['metadata_length']
+    assert header['leaves_length'] == 0
+    assert header['data_offset'] == header['leaves_offset'] + header['leaves_length']
+    assert header['data_offset'] + header['data_length'] == len(data)
+    assert (header['addressed_tiles'], header['tile_entries'], header['tile_contents']) == (5, 3, 3)
+    assert (header['clustered'], header['internal_compression'], header['tile_compression']) == (1, 2, 1)
+    assert (header['tile_type'], header['min_zoom'], header['max_zoom'], header['center_zoom']) == (2, 0, 1, 1)
+    assert (header['min_lon'], header['min_lat'], header['max_lon'], header['max_lat']) == \
+        (-1800000000, -850000000, 1800000000, 850000000)
+    assert (header['center_lon'], header['center_lat']) == (0, 0)
+
+    metadata = data[header['metadata_offset']:header['metadata_offset'] + header['metadata_length']]
+    assert json.loads(gzip.decompress(metadata).decode('utf-8')) == {'name': 'florence'}
+
+    def tile(entry):
+        start = header['data_offset'] + entry[1]
+        return data[start:start + entry[2]]
+
+    entries = read_directory(data[header['root_offset']:header['root_offset'] + header['root_length']])
+    assert [(x[0], x[3], tile(x)) for x in entries] == [(0, 1, b'world'), (1, 1, b'north-west'),
+                                                        (2, 3, b'blank')]
+    # The spool is removed once the archive is written
+    assert tmpdir.listdir() == [tmpdir.join('tiles.pmtiles')]
+
+
+def test_repeated_tiles_are_stored_once(tmpdir):
+    path = str(tmpdir.join('tiles.pmtiles'))
+    writer = PMTilesWriter(path, 'jpeg')
+    writer.add(1, 0, 0, b'same')
+    writer.add(1, 1, 1, b'other')
+    writer.add(1, 1, 0, b'same')
+    writer.finish([0, 0, 1, 1])
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = read_header(data)
+    entries = read_directory(data[header['root_offset']:header['root_offset'] + header['root_length']])
+    assert (header['tile_entries'], header['tile_contents'], header['data_length']) == (3, 2, 9)
+    assert header['tile_type'] == 3
+    assert entries[0][1] == entries[2][1]
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from disaster_data.aws import client
+from disaster_data.loadtest.harness import LoadTest, CATALOG_BUCKET
+from disaster_data.catalog.links import get_json, s3_call
+from disaster_data.catalog.publish import publish, file_hash, PUBLISH_MANIFEST
+
+
+@pytest.fixture
+def s3(tmpdir):
+    test = LoadTest(events=1).start()
+    test.configure(str(tmpdir.join('s3')))
+    client.cache_clear()
+    yield test
+    test.stop()
+    client.cache_clear()
+
+
+def write_tree(root, files):
+    for rel, content in files.items():
+        path = root.join(rel)
+        path.dirpath().ensure(dir=True)
+        path.write(content)
+    return str(root)
+
+
+def read(key):
+    return s3_call('get_object', Bucket=CATALOG_BUCKET, Key=key)['Body'].read().decode('utf-8')
+
+
+def test_only_changed_files_are_uploaded(s3, tmpdir):
+    tree = write_tree(tmpdir.join('catalog'), {'catalog.json': '{}', 'florence/a.json': '{"id": "a"}',
+                                               'florence/a.jpg': 'jpeg'})
+    assert sorted(publish([(tree, 'NOAAStorm')], CATALOG_BUCKET)) == \
+        ['NOAAStorm/catalog.json', 'NOAAStorm/florence/a.jpg', 'NOAAStorm/florence/a.json']
+    assert read('NOAAStorm/florence/a.json') == '{"id": "a"}'
+    head = s3_call('head_object', Bucket=CATALOG_BUCKET, Key='NOAAStorm/florence/a.jpg')
+    assert head['ContentType'] == 'image/jpeg'
+
+    # Published again without changes
+    assert publish([(tree, 'NOAAStorm')], CATALOG_BUCKET) == []
+
+    tmpdir.join('catalog', 'florence', 'a.json').write('{"id": "a", "properties": {}}')
+    write_tree(tmpdir.join('catalog'), {'florence/b.json': '{"id": "b"}'})
+    assert sorted(publish([(tree, 'NOAAStorm')], CATALOG_BUCKET)) == ['NOAAStorm/florence/a.json',
+                                                                      'NOAAStorm/florence/b.json']
+    assert sorted(get_json(CATALOG_BUCKET, 'NOAAStorm/' + PUBLISH_MANIFEST)) == \
+        ['NOAAStorm/catalog.json', 'NOAAStorm/florence/a.jpg', 'NOAAStorm/florence/a.json',
+         'NOAAStorm/florence/b.json']
+
+
+def test_each_tree_has_its_own_manifest(s3, tmpdir):
+    catalog = write_tree(tmpdir.join('catalog'), {'florence/a.json': '{"id": "a"}'})
+    thumbnails = write_tree(tmpdir.join('thumbnails'), {'florence/a.jpg': 'jpeg'})
+    publish([(catalog, 'NOAAStorm'), (thumbnails, 'thumbnails')], CATALOG_BUCKET)
+
+    assert get_json(CATALOG_BUCKET, 'NOAAStorm/' + PUBLISH_MANIFEST) == \
+        {'NOAAStorm/florence/a.json': file_hash(str(tmpdir.join('catalog', 'florence', 'a.json')))}
+    assert list(get_json(CATALOG_BUCKET, 'thumbnails/' + PUBLISH_MANIFEST)) == ['thumbnails/florence/a.jpg']
+    assert get_json(CATALOG_BUCKET, PUBLISH_MANIFEST) is None
+
+
+def test_concurrent_publishes_of_different_prefixes(s3, tmpdir):
+    trees = {prefix: write_tree(tmpdir.join(prefix), {'coll-{}/item-{}.json'.format(x % 3, x): str(x)
+                                                      for x in range(30)})
+             for prefix in ('NOAAStorm', 'DGOpenData', 'thumbnails')}
+    threads = [threading.Thread(target=publish, args=([(tree, prefix)], CATALOG_BUCKET))
+               for prefix, tree in trees.items()]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # No run overwrote the hashes recorded by another, so nothing is uploaded again
+    for prefix, tree in trees.items():
+        assert len(get_json(CATALOG_BUCKET, prefix + '/' + PUBLISH_MANIFEST)) == 30
+        assert publish([(tree, prefix)], CATALOG_BUCKET) == []
+
+
+def test_manifest_is_not_published_from_the_tree(s3, tmpdir):
+    tree = write_tree(tmpdir.join('catalog'), {'catalog.json': '{}', PUBLISH_MANIFEST: '{"stale": "hash"}'})
+    assert publish([(tree, '')], CATALOG_BUCKET) == ['catalog.json']
+    assert get_json(CATALOG_BUCKET, PUBLISH_MANIFEST) == {'catalog.json': file_hash(str(tmpdir.join('catalog',
+                                                                                                    'catalog.json')))}
@@ -0,0 +1,88 @@
+import time
+import sqlite3
+import threading
+from collections import Counter
+
+from disaster_data.queues import SQLiteQueue, open_queue
+
+
+def drain(queue, processed, lock, visibility=30):
+    """Receive and acknowledge messages until the queue stays empty"""
+    while True:
+        messages = queue.receive(max_messages=2, wait=0.5, visibility=visibility)
+        if not messages:
+            return
+        for message in messages:
+            with lock:
+                processed.append(message.body)
+            queue.ack(message)
+
+
+def test_workers_process_each_message_once(tmpdir):
+    path = str(tmpdir.join('queue.db'))
+    bodies = ['job-{}'.format(x) for x in range(200)]
+    open_queue('sqlite://' + path).send(bodies)
+
+    processed = []
+    lock = threading.Lock()
+    # Each worker has its own queue object, like separate worker processes
+    workers = [threading.Thread(target=drain, args=(SQLiteQueue(path), processed, lock)) for _ in range(4)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert Counter(processed) == Counter(bodies)
+    assert len(SQLiteQueue(path)) == 0
+
+
+def test_unacknowledged_message_is_redelivered(tmpdir):
+    path = str(tmpdir.join('queue.db'))
+    worker_a, worker_b = SQLiteQueue(path), SQLiteQueue(path)
+    worker_a.send(['job'])
+
+    first = worker_a.receive(wait=0, visibility=0.3)[0]
+    # Invisible to other workers until the visibility timeout lapses
+    assert worker_b.receive(wait=0) == []
+    time.sleep(0.4)
+    second = worker_b.receive(wait=0, visibility=30)[0]
+    assert second.id == first.id
+    assert second.receipt != first.receipt
+
+    # The first worker lost the message, its late ack must not delete it
+    worker_a.ack(first)
+    assert len(worker_b) == 1
+    worker_b.ack(second)
+    assert len(worker_b) == 0
+
+
+def test_extend_keeps_message_invisible(tmpdir):
+    path = str(tmpdir.join('queue.db'))
+    worker_a, worker_b = SQLiteQueue(path), SQLiteQueue(path)
+    worker_a.send(['job'])
+
+    message = worker_a.receive(wait=0, visibility=0.3)[0]
+    time.sleep(0.2)
+    worker_a.extend(message, visibility=30)
+    time.sleep(0.2)
+    assert worker_b.receive(wait=0) == []
+
+
+def test_messages_received_too_often_are_dead_lettered(tmpdir):
+    path = str(tmpdir.join('queue.db'))
+    workers = [SQLiteQueue(path, max_receives=3) for _ in range(2)]
+    workers[0].send(['poison', 'good'])
+
+    receives = Counter()
+    for attempt in range(6):
+        for message in workers[attempt % 2].receive(max_messages=2, wait=0, visibility=0):
+            receives[message.body] += 1
+            if message.body == 'good':
+                workers[attempt % 2].ack(message)
+
+    assert receives == {'poison': 3, 'good': 1}
+    assert len(workers[0]) == 0
+    # Left in the table for inspection rather than deleted
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT body, receives FROM messages").fetchall() == [('poison', 3)]
+    conn.close()
@@ -0,0 +1,232 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from disaster_data import rangecache
+from disaster_data.rangecache import BlockCache, RangeCacheHandler, RANGE_PATTERN, STREAM_BLOCKS, read_range
+
+DATA = bytes(range(256)) * 40
+BLOCK_SIZE = 64
+
+
+class FileHandler(BaseHTTPRequestHandler):
+
+    """Serves ``DATA`` at any path, with range requests unless ``ignore_range`` is set, counting the GETs"""
+
+    protocol_version = 'HTTP/1.1'
+    gets = []
+    delay = 0
+    ignore_range = False
+    lock = threading.Lock()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+
+    def do_GET(self):
+        match = RANGE_PATTERN.match(self.headers.get('Range', ''))
+        if not match or self.ignore_range:
+            with self.lock:
+                self.gets.append(None)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(DATA)))
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        with self.lock:
+            self.gets.append((start, end))
+        time.sleep(self.delay)
+        body = DATA[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(DATA)))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def remote(http_server):
+    FileHandler.gets = []
+    FileHandler.delay = 0
+    FileHandler.ignore_range = False
+    return http_server(FileHandler) + '/image.tif'
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return BlockCache(str(tmpdir.join('cache')), max_size=1 << 20, block_size=BLOCK_SIZE)
+
+
+@pytest.mark.parametrize('start,end', [(0, 0), (0, 63), (10, 20), (60, 70), (63, 64), (100, 400),
+                                       (len(DATA) - 5, len(DATA) - 1), (0, len(DATA) - 1)])
+def test_range_slicing(cache, remote, start, end):
+    assert cache.read(remote, start, end) == DATA[start:end + 1]
+    # Served from the cache the second time
+    gets = len(FileHandler.gets)
+    assert cache.read(remote, start, end) == DATA[start:end + 1]
+    assert len(FileHandler.gets) == gets
+
+
+def test_missing_blocks_are_fetched_in_runs(cache, remote):
+    cache.read(remote, 0, BLOCK_SIZE - 1)
+    cache.read(remote, 3 * BLOCK_SIZE, 4 * BLOCK_SIZE - 1)
+    FileHandler.gets = []
+    # Blocks 1-2 and 5-6 are missing, block 3 is cached
+    assert cache.read(remote, BLOCK_SIZE, 7 * BLOCK_SIZE - 1) == DATA[BLOCK_SIZE:7 * BLOCK_SIZE]
+    assert FileHandler.gets == [(BLOCK_SIZE, 3 * BLOCK_SIZE - 1), (4 * BLOCK_SIZE, 7 * BLOCK_SIZE - 1)]
+
+
+def test_stats(cache, remote):
+    cache.read(remote, 0, 2 * BLOCK_SIZE - 1)
+    cache.read(remote, BLOCK_SIZE, 3 * BLOCK_SIZE - 1)
+
+    report = cache.report()
+    assert report['requests'] == 2
+    assert report['hits'] == 1
+    assert report['misses'] == 3
+    assert report['bytes_from_cache'] == BLOCK_SIZE
+    assert report['bytes_fetched'] == 3 * BLOCK_SIZE
+    assert report['blocks'] == 3
+    assert report['size'] == 3 * BLOCK_SIZE
+    assert report['hit_rate'] == 0.25
+
+
+def test_eviction(tmpdir, remote):
+    directory = str(tmpdir.join('cache'))
+    cache = BlockCache(directory, max_size=4 * BLOCK_SIZE, block_size=BLOCK_SIZE)
+    for block in range(4):
+        cache.read(remote, block * BLOCK_SIZE, block * BLOCK_SIZE)
+    # Block 0 becomes the most recently used, block 1 is evicted next
+    cache.read(remote, 0, 0)
+    cache.read(remote, 4 * BLOCK_SIZE, 6 * BLOCK_SIZE - 1)
+
+    assert cache.size <= cache.max_size
+    assert cache.report()['evicted'] == 2
+    etag = cache.head(remote)['etag']
+    kept = [x for x in range(6) if os.path.exists(cache.block_path(remote, etag, x))]
+    assert kept == [0, 3, 4, 5]
+
+    # A new cache over the same directory finds the same blocks
+    rescanned = BlockCache(directory, max_size=4 * BLOCK_SIZE, block_size=BLOCK_SIZE)
+    assert sorted(rescanned.blocks) == sorted(cache.blocks)
+    assert rescanned.size == cache.size
+
+
+def test_block_removed_during_read_is_a_miss(cache, remote, monkeypatch):
+    cache.read(remote, 0, 0)
+    path = cache.block_path(remote, cache.head(remote)['etag'], 0)
+
+    def utime(path, *args):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(rangecache.os, 'utime', utime)
+    assert cache.get_block(path) is None
+    assert path not in cache.blocks
+    assert cache.size == 0
+
+
+def test_concurrent_reads_fetch_a_block_once(cache, remote):
+    FileHandler.delay = 0.2
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.read(remote, 10, 20))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [DATA[10:21]] * 8
+    assert FileHandler.gets == [(0, BLOCK_SIZE - 1)]
+
+
+def test_handler(http_server, cache, remote):
+    RangeCacheHandler.cache = cache
+    url = http_server(RangeCacheHandler) + '/' + remote
+
+    r = requests.get(url, headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.content == DATA[100:200]
+    assert r.headers['Content-Range'] == 'bytes 100-199/{}'.format(len(DATA))
+
+    r = requests.get(url, headers={'Range': 'bytes=-10'})
+    assert r.content == DATA[-10:]
+
+    r = requests.get(url, headers={'Range': 'bytes={}-'.format(len(DATA))})
+    assert r.status_code == 416
+
+    r = requests.head(url)
+    assert int(r.headers['Content-Length']) == len(DATA)
+
+    assert requests.get(url.split('/http')[0] + '/_stats').json()['requests'] == 2
+
+
+class Response(object):
+
+    """Whole file response, recording how many chunks were read"""
+
+    def __init__(self):
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for idx in range(0, len(DATA), chunk_size):
+            self.read += 1
+            yield DATA[idx:idx + chunk_size]
+
+
+@pytest.mark.parametrize('start,end', [(0, 0), (10, 20), (60, 70), (64, 127), (len(DATA) - 5, len(DATA) - 1)])
+def test_read_range_stops_after_the_end(start, end):
+    r = Response()
+    assert read_range(r, start, end, chunk_size=BLOCK_SIZE) == DATA[start:end + 1]
+    assert r.read == end // BLOCK_SIZE + 1
+
+
+def test_server_ignoring_ranges(cache, remote):
+    FileHandler.ignore_range = True
+    assert cache.read(remote, 100, 200) == DATA[100:201]
+    assert FileHandler.gets == [None]
+    assert cache.report()['bytes_fetched'] == 3 * BLOCK_SIZE
+    assert cache.read(remote, 64, 191) == DATA[64:192]
+    assert FileHandler.gets == [None]
+
+
+def test_handler_streams_whole_files_from_the_cache(http_server, cache, remote):
+    RangeCacheHandler.cache = cache
+    url = http_server(RangeCacheHandler) + '/' + remote
+
+    r = requests.get(url)
+    assert r.status_code == 200
+    assert r.content == DATA
+    step = BLOCK_SIZE * STREAM_BLOCKS
+    assert FileHandler.gets == [(x, min(x + step, len(DATA)) - 1) for x in range(0, len(DATA), step)]
+
+    FileHandler.gets = []
+    assert requests.get(url).content == DATA
+    assert FileHandler.gets == []
+
+
+def test_handler_passes_large_files_through(http_server, cache, remote, monkeypatch):
+    monkeypatch.setattr(rangecache, 'PASSTHROUGH_SIZE', len(DATA) - 1)
+    RangeCacheHandler.cache = cache
+    url = http_server(RangeCacheHandler) + '/' + remote
+
+    r = requests.get(url)
+    assert r.status_code == 200
+    assert r.content == DATA
+    assert FileHandler.gets == [None]
+    assert cache.blocks == {}
+    assert cache.report()['bytes_passed_through'] == len(DATA)
+
+    # Ranges of large files are still cached
+    assert requests.get(url, headers={'Range': 'bytes=0-9'}).content == DATA[:10]
+    assert len(cache.blocks) == 1
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+# The noaa_storm package imports the whole NOAA Storm pipeline
+pytest.importorskip('satstac')
+pytest.importorskip('osgeo')
+
+from disaster_data.sources.noaa_storm.scheduler import ArchiveScheduler
+
+
+class FakeArchive(object):
+
+    """Archive which tracks how many bytes of its kind are on disk"""
+
+    def __init__(self, name, size, disk):
+        self.item = {'archive': name, 'event_name': 'event'}
+        self.size = size
+        self.disk = disk
+
+    def download(self, out_dir):
+        with self.disk['lock']:
+            self.disk['used'] += self.size
+            self.disk['peak'] = max(self.disk['peak'], self.disk['used'])
+
+    def remove(self, out_dir=None):
+        with self.disk['lock']:
+            self.disk['used'] -= self.size
+
+
+def scheduler(sizes, budget, tmpdir, max_downloads=4):
+    disk = {'used': 0, 'peak': 0, 'lock': threading.Lock()}
+    archives = [FakeArchive('archive-{}'.format(size), size, disk) for size in sizes]
+    s = ArchiveScheduler(archives, str(tmpdir), budget=budget, max_downloads=max_downloads)
+    # Sized up front instead of with HEAD requests
+    s.sizes = {id(x): x.size for x in archives}
+    return s, disk
+
+
+def test_plan_admits_smallest_first_then_largest_within_budget(tmpdir):
+    s, _ = scheduler([5, 3, 8, 1, 4], 10, tmpdir)
+    plan = s.plan()
+
+    assert [x['bytes'] for x in plan['schedule']] == [1, 8, 5, 4, 3]
+    assert [x['footprint'] for x in plan['schedule']] == [1, 9, 5, 9, 7]
+    assert plan['peak_bytes'] == 9
+    assert plan['total_bytes'] == 21
+    assert s.used == 0
+
+
+def test_plan_runs_oversized_archive_alone(tmpdir):
+    s, _ = scheduler([15, 2], 10, tmpdir)
+    plan = s.plan()
+
+    assert [x['bytes'] for x in plan['schedule']] == [2, 15]
+    # The oversized archive waits until nothing else is on disk
+    assert plan['schedule'][1]['footprint'] == 15
+
+
+def test_run_stays_within_budget(tmpdir):
+    s, disk = scheduler([5, 3, 8, 1, 4, 2, 6], 10, tmpdir)
+    seen = [x.item['archive'] for x in s.run()]
+
+    assert len(seen) == 7
+    assert disk['peak'] <= 10
+    assert disk['used'] == 0
+    assert s.used == 0
+
+
+def test_run_releases_archives_when_the_consumer_fails(tmpdir):
+    s, disk = scheduler([5, 3, 8, 1, 4], 10, tmpdir)
+    with pytest.raises(RuntimeError):
+        for archive in s.run():
+            raise RuntimeError("failed to build items")
+
+    # The yielded archive and every download still in flight are removed
+    assert disk['used'] == 0
+    assert s.used == 0
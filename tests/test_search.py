@@ -0,0 +1,128 @@
+import json
+import calendar
+from datetime import datetime
+
+import pytest
+
+from disaster_data.catalog.search import CatalogIndex, parse_interval, utc_offset, to_timestamp
+
+
+def ts(*args):
+    return calendar.timegm(datetime(*args).timetuple())
+
+
+def item(id, bbox=None, dt=None, collection='florence', **properties):
+    doc = {'id': id, 'collection': collection, 'properties': dict(properties)}
+    if bbox:
+        doc['bbox'] = bbox
+    if dt:
+        doc['properties']['datetime'] = dt
+    return 'https://host/{}.json'.format(id), json.dumps(doc)
+
+
+def ids(features):
+    return [json.loads(x)['id'] for x in features]
+
+
+@pytest.fixture
+def index():
+    return CatalogIndex([
+        item('a', [0, 0, 1, 1], '2018-09-14T12:00:00Z', **{'eo:cloud_cover': 10}),
+        item('b', [10, 10, 11, 11], '2018-09-15T12:00:00Z', **{'eo:cloud_cover': 50}),
+        item('c', [0.5, 0.5, 2, 2], '2018-10-01T00:00:00Z', collection='michael', **{'eo:cloud_cover': 20}),
+        item('d', None, '2018-09-20T00:00:00Z', **{'eo:cloud_cover': 5}),
+        item('e', [0, 0, 1, 1], None, **{'eo:cloud_cover': 0}),
+        item('f', [-180, -90, 180, 90], '2017-01-01', **{'eo:cloud_cover': 90}),
+    ])
+
+
+def test_utc_offset():
+    assert utc_offset('') == 0
+    assert utc_offset(None) == 0
+    assert utc_offset('Z') == 0
+    assert utc_offset('+05:30') == 19800
+    assert utc_offset('-0400') == -14400
+    assert utc_offset('+02') == 7200
+
+
+def test_to_timestamp_converts_to_utc():
+    assert to_timestamp('2018-09-14T12:00:00Z') == ts(2018, 9, 14, 12)
+    assert to_timestamp('2018-09-14T12:00:00.123+02:00') == ts(2018, 9, 14, 10)
+    assert to_timestamp('2018-09-14 12:00:00-0130') == ts(2018, 9, 14, 13, 30)
+
+
+def test_parse_interval_of_periods():
+    assert parse_interval('2018') == (ts(2018, 1, 1), ts(2018, 12, 31, 23, 59, 59))
+    assert parse_interval('2016-02') == (ts(2016, 2, 1), ts(2016, 2, 29, 23, 59, 59))
+    assert parse_interval('2018-09-14') == (ts(2018, 9, 14), ts(2018, 9, 14, 23, 59, 59))
+    assert parse_interval('2018-09-14T12:00:00Z') == (ts(2018, 9, 14, 12), ts(2018, 9, 14, 12))
+
+
+def test_parse_interval_ranges():
+    assert parse_interval('2018-09-01/2018-09-30') == (ts(2018, 9, 1), ts(2018, 9, 30, 23, 59, 59))
+    assert parse_interval('../2018-09') == (None, ts(2018, 9, 30, 23, 59, 59))
+    assert parse_interval('2018-09-01T00:00:00Z/') == (ts(2018, 9, 1), None)
+
+
+def test_search_returns_newest_first_and_undated_last(index):
+    features, matched = index.search(limit=10)
+    assert ids(features) == ['c', 'd', 'b', 'a', 'f', 'e']
+    assert matched == 6
+
+
+def test_items_without_bbox_never_match_a_spatial_query(index):
+    # d has no bbox
+    assert ids(index.search(bbox=[-1, -1, 0.4, 0.4])[0]) == ['a', 'f', 'e']
+    assert ids(index.search(bbox=[-0.1, -0.1, 0.1, 0.1])[0]) == ['a', 'f', 'e']
+    assert 'd' in ids(index.search(datetime='2018-09')[0])
+
+
+def test_search_filters(index):
+    assert ids(index.search(datetime='2018-09')[0]) == ['d', 'b', 'a']
+    assert ids(index.search(datetime='2018-09-15/..')[0]) == ['c', 'd', 'b']
+    assert ids(index.search(collections=['michael'])[0]) == ['c']
+    assert index.search(collections=['unknown']) == ([], 0)
+    features, matched = index.search(bbox=[0, 0, 3, 3], datetime='2018', collections=['florence'])
+    assert ids(features) == ['a']
+    assert matched == 1
+
+
+def test_search_pages(index):
+    features, matched = index.search(limit=4, page=2)
+    assert ids(features) == ['f', 'e']
+    assert matched == 6
+    assert index.search(limit=4, page=3) == ([], 6)
+
+
+def test_property_query_pages(index):
+    query = {'eo:cloud_cover': {'lte': 20}}
+    # A full page stops evaluating, so the number matched is unknown
+    features, matched = index.search(query=query, limit=2)
+    assert ids(features) == ['c', 'd']
+    assert matched is None
+
+    features, matched = index.search(query=query, limit=2, page=2)
+    assert ids(features) == ['a', 'e']
+    assert matched == 4
+
+    # Past the end only the items matched are counted, not the offset
+    assert index.search(query=query, limit=2, page=5) == ([], 4)
+    assert index.search(query={'eo:cloud_cover': {'gt': 100}}, page=3) == ([], 0)
+
+
+def test_query_operators(index):
+    assert ids(index.search(query={'eo:cloud_cover': {'in': [50, 90]}})[0]) == ['b', 'f']
+    assert ids(index.search(query={'collection': {'neq': 'florence'}})[0]) == ['c']
+    assert ids(index.search(query={'eo:cloud_cover': {'gte': 20, 'lt': 90}})[0]) == ['c', 'b']
+
+
+def test_empty_index():
+    empty = CatalogIndex([])
+    assert len(empty) == 0
+    assert empty.search(bbox=[0, 0, 1, 1]) == ([], 0)
+
+
+def test_3d_bboxes_are_indexed_by_their_horizontal_extent():
+    index = CatalogIndex([item('a', [0, 0, -10, 1, 1, 10], '2018-09-14')])
+    assert ids(index.search(bbox=[0.5, 0.5, 2, 2])[0]) == ['a']
+    assert index.search(bbox=[2, 2, 3, 3]) == ([], 0)
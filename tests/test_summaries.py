@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from disaster_data.catalog import summaries
+from disaster_data.catalog.summaries import Summary, SummaryLog, compact_summaries, summarize
+
+
+class Bucket(object):
+
+    """In-memory stand-in for the S3 calls of the summary log"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def s3_call(self, method, Bucket, Delete):
+        assert method == 'delete_objects'
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+
+    def put_json(self, bucket, key, data):
+        self.objects[key] = json.dumps(data)
+
+    def get_json(self, bucket, key):
+        return json.loads(self.objects[key]) if key in self.objects else None
+
+    def list_segments(self, bucket, prefix, log_prefix):
+        start = prefix + '/' + log_prefix + '/'
+        return sorted(k for k in self.objects if k.startswith(start))
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    store = Bucket()
+    for name in ('s3_call', 'put_json', 'get_json', 'list_segments'):
+        monkeypatch.setattr(summaries, name, getattr(store, name))
+    return store
+
+
+def item(id, collection='florence', **properties):
+    properties.setdefault('datetime', '2018-09-14T12:00:00Z')
+    return {'id': id, 'collection': collection, 'properties': properties}
+
+
+def test_add_bins_histograms_and_extends_ranges():
+    summary = Summary()
+    summary.add(item('a', **{'eo:platform': 'WV03', 'eo:instrument': 'VNIR', 'eo:gsd': 0.31,
+                             'eo:cloud_cover': 95}))
+    summary.add(item('b', **{'eo:gsd': 40, 'datetime': '2018-09-15T00:00:00Z'}))
+
+    assert len(summary) == 2
+    assert summary.total['histograms']['eo:gsd'] == [0, 1, 0, 0, 0, 0, 0, 0, 1]
+    # The last bin is open ended
+    assert summary.total['histograms']['eo:cloud_cover'][-1] == 1
+    assert summary.total['dates'] == {'2018-09-14': 1, '2018-09-15': 1}
+    assert sorted(summary.platforms) == ['WV03', 'unknown']
+    assert summary.stac_summaries() == {
+        'eo:platform': ['WV03'],
+        'eo:instrument': ['VNIR'],
+        'eo:gsd': {'min': 0.31, 'max': 40},
+        'eo:cloud_cover': {'min': 95, 'max': 95},
+        'datetime': {'min': '2018-09-14T12:00:00Z', 'max': '2018-09-15T00:00:00Z'},
+    }
+
+
+def test_merge_equals_summarizing_everything():
+    items = [
+        item('a', **{'eo:platform': 'WV03', 'eo:gsd': 0.5, 'eo:off_nadir': 12}),
+        item('b', **{'eo:platform': 'WV02', 'eo:cloud_cover': 30, 'datetime': '2018-09-01T00:00:00Z'}),
+        item('c', **{'eo:platform': 'WV03', 'eo:instrument': 'VNIR', 'eo:gsd': 2}),
+    ]
+    merged = summarize(items[:1])['florence'].merge(summarize(items[1:])['florence'])
+    assert merged.to_dict() == summarize(items)['florence'].to_dict()
+
+    # Summaries round trip through their documents
+    assert Summary(json.loads(json.dumps(merged.to_dict()))).to_dict() == merged.to_dict()
+
+
+def test_merging_an_empty_summary_changes_nothing():
+    summary = summarize([item('a', **{'eo:gsd': 1})])['florence']
+    before = json.dumps(summary.to_dict(), sort_keys=True)
+    assert json.dumps(summary.merge(Summary()).to_dict(), sort_keys=True) == before
+    assert Summary().merge(summary).to_dict() == summary.to_dict()
+
+
+def test_log_flushes_segments_per_worker(bucket):
+    log = SummaryLog('bucket', 'NOAAStorm')
+    log.add(summarize([item('a'), item('b', 'michael')]))
+    log.flush()
+    log.add(summarize([item('c')]))
+    log.flush()
+    # Nothing to write
+    log.flush()
+
+    segments = bucket.list_segments('bucket', 'NOAAStorm', '_summaries')
+    assert segments == ['NOAAStorm/_summaries/{}/{:08d}.json'.format(log.worker, x) for x in range(2)]
+    assert sorted(bucket.get_json('bucket', segments[0])) == ['florence', 'michael']
+
+
+def test_named_flush_replaces_the_segment(bucket):
+    for _ in range(2):
+        with SummaryLog('bucket', 'NOAAStorm') as log:
+            log.add(summarize([item('a'), item('b')]))
+            log.flush('job-1')
+
+    assert bucket.list_segments('bucket', 'NOAAStorm', '_summaries') == ['NOAAStorm/_summaries/named/job-1.json']
+    compact_summaries('bucket', 'NOAAStorm', collection=False)
+    assert bucket.get_json('bucket', 'NOAAStorm/florence/summaries.json')['total']['count'] == 2
+
+
+def test_compact_adds_segments_into_collections(bucket):
+    bucket.put_json('bucket', 'NOAAStorm/florence/catalog.json', {'id': 'florence', 'links': []})
+    bucket.put_json('bucket', 'NOAAStorm/florence/summaries.json',
+                    summarize([item('a', **{'eo:platform': 'WV02'})])['florence'].to_dict())
+    with SummaryLog('bucket', 'NOAAStorm') as log:
+        log.add(summarize([item('b', **{'eo:platform': 'WV03'}), item('c', 'michael')]))
+
+    merged = compact_summaries('bucket', 'NOAAStorm')
+    assert sorted(merged) == ['florence', 'michael']
+
+    current = bucket.get_json('bucket', 'NOAAStorm/florence/summaries.json')
+    assert current['total']['count'] == 2
+    assert bucket.get_json('bucket', 'NOAAStorm/florence/catalog.json')['summaries'] == {
+        'eo:platform': ['WV02', 'WV03'],
+        'datetime': {'min': '2018-09-14T12:00:00Z', 'max': '2018-09-14T12:00:00Z'},
+    }
+    # Collections which aren't published yet only get their summaries document
+    assert bucket.get_json('bucket', 'NOAAStorm/michael/summaries.json')['total']['count'] == 1
+    assert bucket.get_json('bucket', 'NOAAStorm/michael/catalog.json') is None
+
+    # The segments are removed, so compacting again adds nothing
+    assert bucket.list_segments('bucket', 'NOAAStorm', '_summaries') == []
+    assert compact_summaries('bucket', 'NOAAStorm') == {}
+    assert bucket.get_json('bucket', 'NOAAStorm/florence/summaries.json') == current
+
+
+def test_compact_without_updating_collections(bucket):
+    bucket.put_json('bucket', 'DGOpenData/florence/catalog.json', {'id': 'florence', 'links': []})
+    with SummaryLog('bucket', 'DGOpenData') as log:
+        log.add(summarize([item('a', **{'eo:platform': 'WV03'})]))
+
+    compact_summaries('bucket', 'DGOpenData', collection=False)
+    assert 'summaries' not in bucket.get_json('bucket', 'DGOpenData/florence/catalog.json')
+    assert bucket.get_json('bucket', 'DGOpenData/florence/summaries.json')['total']['count'] == 1
@@ -0,0 +1,95 @@
+import pytest
+
+# The noaa_storm package imports the whole NOAA Storm pipeline
+pytest.importorskip('satstac')
+pytest.importorskip('osgeo')
+
+from osgeo import ogr, osr
+
+from disaster_data.sources.noaa_storm.assets import Archive
+
+# 1 km squares in UTM zone 17N, around 81W 29.8N
+TILES = {
+    'C:\\imagery\\20180914a_RGB\\TILE_001.tif': (500000, 3300000),
+    'tile_002.tif': (501000, 3300000),
+}
+
+
+def write_tile_index(path, epsg=32617):
+    ds = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(path)
+    srs = None
+    if epsg:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+    lyr = ds.CreateLayer('tile_index', srs, ogr.wkbPolygon)
+    lyr.CreateField(ogr.FieldDefn('location', ogr.OFTString))
+    lyr.CreateField(ogr.FieldDefn('row', ogr.OFTInteger))
+    for row, (location, (x, y)) in enumerate(TILES.items()):
+        feat = ogr.Feature(lyr.GetLayerDefn())
+        feat.SetField('location', location)
+        feat.SetField('row', row)
+        wkt = 'POLYGON (({0} {1}, {0} {3}, {2} {3}, {2} {1}, {0} {1}))'.format(x, y, x + 1000, y + 1000)
+        feat.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+        lyr.CreateFeature(feat)
+    ds = None
+
+
+def archive(tmpdir, epsg=32617):
+    write_tile_index(str(tmpdir.join('20180914_tile_index.shp')), epsg)
+    a = Archive({'archive': 'https://example.com/20180914a_RGB.tar',
+                 'tile_index': 'https://example.com/20180914_tile_index.shp',
+                 'event_name': 'florence'}, str(tmpdir))
+    # Read from the extracted directory instead of through /vsitar/
+    a.archive = str(tmpdir)
+    a.vsipath = ''
+    a.opened = []
+
+    def gdal_metadata(asset):
+        a.opened.append(asset)
+        return {'bbox': [0, 0, 1, 1], 'geometry': None, 'epsg': 4326, 'gsd': 0.5}
+
+    a.gdal_metadata = gdal_metadata
+    return a
+
+
+def test_members_are_joined_on_filename_stem(tmpdir):
+    a = archive(tmpdir)
+    md = a.asset_metadata('/data/20180914a_RGB/tile_001.tif')
+
+    assert md['epsg'] == 32617
+    assert md['geometry']['type'] == 'Polygon'
+    minx, miny, maxx, maxy = md['bbox']
+    # Reprojected to WGS84 longitude and latitude
+    assert -81.01 < minx < maxx < -80.97
+    assert 29.8 < miny < maxy < 29.84
+    assert md['gsd'] == 0.5
+    assert sorted(a.tile_index) == ['tile_001', 'tile_002']
+
+
+def test_gsd_is_read_once_per_format(tmpdir):
+    a = archive(tmpdir)
+    a.asset_metadata('/data/tile_001.tif')
+    a.asset_metadata('/data/tile_002.tif')
+    assert a.opened == ['/data/tile_001.tif']
+
+    # Members missing from the tile index are opened
+    assert a.asset_metadata('/data/tile_003.tif')['epsg'] == 4326
+    assert a.opened == ['/data/tile_001.tif', '/data/tile_003.tif']
+
+
+def test_tile_index_without_spatial_reference_is_ignored(tmpdir):
+    a = archive(tmpdir, epsg=None)
+    a.asset_metadata('/data/tile_001.tif')
+    a.asset_metadata('/data/tile_002.tif')
+
+    assert a.tile_index == {}
+    assert a.opened == ['/data/tile_001.tif', '/data/tile_002.tif']
+
+
+def test_gdal_mode_reads_every_member(tmpdir):
+    a = archive(tmpdir)
+    a.metadata = 'gdal'
+    a.asset_metadata('/data/tile_001.tif')
+
+    assert a.tile_index is None
+    assert a.opened == ['/data/tile_001.tif']
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('osgeo')
+
+from disaster_data.tiles import lonlat_to_tile, tile_bounds, tiles_for_bbox, tile_jobs, ORIGIN
+
+
+def test_lonlat_to_tile():
+    assert lonlat_to_tile(0, 0, 0) == (0, 0)
+    assert lonlat_to_tile(-80, 30, 1) == (0, 0)
+    assert lonlat_to_tile(80, -30, 1) == (1, 1)
+    # Latitudes past the web mercator limit and the antimeridian are clamped to the edge tiles
+    assert lonlat_to_tile(180, 90, 3) == (7, 0)
+    assert lonlat_to_tile(-180, -90, 3) == (0, 7)
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == pytest.approx((-ORIGIN, -ORIGIN, ORIGIN, ORIGIN))
+    assert tile_bounds(1, 1, 0) == pytest.approx((0, 0, ORIGIN, ORIGIN))
+
+
+def test_tiles_for_bbox():
+    assert list(tiles_for_bbox([-180, -85, 180, 85], 0)) == [(0, 0)]
+    assert list(tiles_for_bbox([10, 10, 20, 20], 1)) == [(1, 0)]
+    assert sorted(tiles_for_bbox([-10, -10, 10, 10], 1)) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    # Florence landfall, a single zoom 10 column spanning two rows
+    assert list(tiles_for_bbox([-77.9, 34.2, -77.8, 34.35], 10)) == [(290, 407), (290, 408)]
+
+
+def test_tile_jobs_list_the_sources_of_each_tile():
+    sources = [{'bbox': [-10, -10, 10, 10]}, {'bbox': [10, 10, 20, 20]}]
+    jobs = list(tile_jobs(sources, 0, 1))
+    assert jobs[0] == (0, 0, 0, [0, 1])
+    assert jobs[1:] == [(1, 0, 0, [0]), (1, 0, 1, [0]), (1, 1, 0, [0, 1]), (1, 1, 1, [0])]
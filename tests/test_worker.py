@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+pytest.importorskip('boto3')
+pytest.importorskip('scrapy')
+pytest.importorskip('satstac')
+pytest.importorskip('osgeo')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, the NOAA Storm modules read the stand-in urls when they're first imported
+SCRIPT = """
+import sys
+import json
+
+from disaster_data.loadtest.harness import LoadTest, CATALOG_BUCKET
+
+data_dir = sys.argv[1]
+test = LoadTest(events=1, archives_per_event=2, tiles_per_archive=2).start()
+test.configure(data_dir)
+
+from disaster_data.catalog.changes import ChangeFeed
+from disaster_data.catalog.links import compact, get_json, s3_call
+from disaster_data.catalog.summaries import compact_summaries
+from disaster_data.sources.noaa_storm.worker import enqueue, run_worker
+
+
+def total(name, count):
+    keys = [x['Key'] for x in s3_call('list_objects_v2', Bucket=CATALOG_BUCKET, Prefix='NOAAStorm/')['Contents']]
+    return sum(count(get_json(CATALOG_BUCKET, k)) for k in keys if k.endswith('/' + name))
+
+
+queue = 'sqlite:///' + data_dir + '/queue.db'
+rounds = []
+for _ in range(2):
+    enqueue(test.site.noaa_events(), queue)
+    run_worker(queue, out_dir=data_dir + '/work', idle_timeout=0)
+    feed = ChangeFeed(CATALOG_BUCKET, 'noaa-storm')
+    compact(CATALOG_BUCKET, 'NOAAStorm', feed=feed)
+    compact_summaries(CATALOG_BUCKET, 'NOAAStorm')
+    feed.publish()
+    rounds.append({
+        'changes': feed.counts(),
+        'manifest': total('manifest.json', lambda x: len(x['ids'])),
+        'summary': total('summaries.json', lambda x: x['total']['count']),
+    })
+test.stop()
+print(json.dumps(rounds))
+"""
+
+
+def test_enqueueing_an_event_twice_counts_its_items_once(tmpdir):
+    result = subprocess.run([sys.executable, '-c', SCRIPT, str(tmpdir)], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+    first, second = json.loads(result.stdout.strip().splitlines()[-1])
+
+    items = first['manifest']
+    assert items > 0
+    assert first['changes'] == {'added': items, 'updated': 0, 'removed': 0}
+    assert first['summary'] == items
+
+    # The second run finds every item in the manifests written by the first compaction
+    assert second['changes'] == {'added': 0, 'updated': items, 'removed': 0}
+    assert second['manifest'] == items
+    assert second['summary'] == items
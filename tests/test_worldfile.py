@@ -0,0 +1,91 @@
+import io
+import math
+import struct
+
+import pytest
+
+# The noaa_storm package imports the whole NOAA Storm pipeline
+pytest.importorskip('satstac')
+pytest.importorskip('osgeo')
+
+from disaster_data.sources.noaa_storm.worldfile import (parse_world_file, jpeg_dimensions, footprints,
+                                                        METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON)
+
+
+def segment(code, payload):
+    return struct.pack('>BBH', 0xFF, code, len(payload) + 2) + payload
+
+
+def jpeg(width, height, before=b''):
+    """JPEG header with an APP0 and a DHT segment ahead of the baseline start of frame"""
+    return (b'\xff\xd8' + segment(0xE0, b'JFIF\x00' + b'\x00' * 9) + before + segment(0xC4, b'\x00' * 20) +
+            segment(0xC0, struct.pack('>BHHB', 8, height, width, 3) + b'\x00' * 9) + segment(0xDA, b'\x00' * 10))
+
+
+def test_parse_world_file():
+    assert parse_world_file("0.5\n0.0\n0.0\n-0.5\n100.25\n40.75\n") == [0.5, 0.0, 0.0, -0.5, 100.25, 40.75]
+    assert parse_world_file("  1e-3 0 0 -1e-3 -80 30  ") == [0.001, 0.0, 0.0, -0.001, -80.0, 30.0]
+
+
+def test_parse_world_file_rejects_wrong_coefficient_count():
+    with pytest.raises(ValueError):
+        parse_world_file("0.5\n0.0\n0.0\n-0.5\n100.25\n")
+    with pytest.raises(ValueError):
+        parse_world_file("")
+
+
+def test_jpeg_dimensions_reads_start_of_frame():
+    assert jpeg_dimensions(io.BytesIO(jpeg(640, 480))) == (640, 480)
+
+
+def test_jpeg_dimensions_skips_fill_bytes_and_standalone_markers():
+    # Fill bytes and a restart marker between segments
+    assert jpeg_dimensions(io.BytesIO(jpeg(1024, 768, before=b'\xff\xff\xff\xd0'))) == (1024, 768)
+
+
+def test_jpeg_dimensions_progressive_frame():
+    data = b'\xff\xd8' + segment(0xC2, struct.pack('>BHHB', 8, 300, 200, 3) + b'\x00' * 9)
+    assert jpeg_dimensions(io.BytesIO(data)) == (200, 300)
+
+
+def test_jpeg_dimensions_without_frame_header():
+    # Truncated stream, and a start of scan without a frame header
+    assert jpeg_dimensions(io.BytesIO(jpeg(640, 480)[:30])) is None
+    assert jpeg_dimensions(io.BytesIO(b'\xff\xd8' + segment(0xDA, b'\x00' * 10))) is None
+
+
+def test_jpeg_dimensions_rejects_other_files():
+    with pytest.raises(ValueError):
+        jpeg_dimensions(io.BytesIO(b'\x89PNG\r\n\x1a\n'))
+    with pytest.raises(ValueError):
+        jpeg_dimensions(io.BytesIO(b'\xff\xd8\x00\x00'))
+
+
+def test_footprints():
+    # 0.001 degree pixels, the world file references the centre of the upper-left pixel at (-80, 30)
+    transforms = [
+        [0.001, 0.0, 0.0, -0.001, -80.0 + 0.0005, 30.0 - 0.0005],
+        [0.002, 0.0, 0.0, -0.002, 10.001, 0.999],
+    ]
+    sizes = [(100, 200), (50, 50)]
+    corners, bboxes, gsd = footprints(transforms, sizes)
+
+    assert corners.shape == (2, 5, 2)
+    # Upper-left, lower-left, lower-right, upper-right and back, like gdal.Info's wgs84Extent
+    expected = [[-80.0, 30.0], [-80.0, 29.8], [-79.9, 29.8], [-79.9, 30.0], [-80.0, 30.0]]
+    assert corners[0].ravel().tolist() == pytest.approx(sum(expected, []))
+    assert bboxes[0].tolist() == pytest.approx([-80.0, 29.8, -79.9, 30.0])
+    assert bboxes[1].tolist() == pytest.approx([10.0, 0.9, 10.1, 1.0])
+
+    xres = 0.001 * METERS_PER_DEGREE_LON * math.cos(math.radians(29.9))
+    yres = 0.001 * METERS_PER_DEGREE_LAT
+    assert gsd[0] == pytest.approx((xres + yres) / 2)
+    # Near the equator a pixel is about as wide as it is tall
+    assert gsd[1] == pytest.approx(0.002 * (METERS_PER_DEGREE_LON + METERS_PER_DEGREE_LAT) / 2, rel=1e-3)
+
+
+def test_footprints_of_rotated_image():
+    # 90 degree rotation: columns run south and rows run east
+    corners, bboxes, _ = footprints([[0.0, -0.001, 0.001, 0.0, 0.0005, -0.0005]], [(100, 200)])
+    assert bboxes[0].tolist() == pytest.approx([0.0, -0.1, 0.2, 0.0])
+    assert corners[0][0].tolist() == pytest.approx([0.0, 0.0])